@@ -12,12 +12,39 @@ def _load_config():
     config_name = here.parent.parent / 'config.json'
     if config_name.is_file():
         with open(config_name) as config_file:
-            CONFIG.update(json.load(config_file))
+            _merge_config(json.load(config_file))
 
     for key in CONFIG:
         environ_key = 'LFETCH_' + key.upper()
         if environ_key in os.environ:
-            CONFIG[key] = os.environ.get(environ_key)
+            value = _parse_env(os.environ.get(environ_key), CONFIG[key])
+            _merge_config({key: value})
+
+
+def _merge_config(values):
+    """
+    Update CONFIG with the settings in `values`. The sections that hold a
+    dictionary (like 'hedge' or 'retries') are merged with the current ones
+    instead of replaced, so the keys missing from `values` keep their values.
+    """
+    for key, value in values.items():
+        if isinstance(value, dict) and isinstance(CONFIG.get(key), dict):
+            merged = dict(CONFIG[key])
+            merged.update(value)
+            value = merged
+        CONFIG[key] = value
+
+
+def _parse_env(value, default):
+    """
+    Convert the value of an environment variable to the type of the default
+    value of the setting it overrides.
+    """
+    if isinstance(default, bool):
+        return value.lower() not in ('', '0', 'false', 'no')
+    if isinstance(default, (int, float, dict, list)):
+        return json.loads(value)
+    return value
 
 
 # Contains the characters usually removed or replaced in URLS
@@ -29,7 +56,112 @@ CONFIG = {
     'errno': 0,
     'print_stats': False,
     'debug': False,
-    'lastfm_key': ''
+    'lastfm_key': '',
+    # Parser used by BeautifulSoup: 'html.parser' or the faster 'lxml'
+    'html_parser': 'html.parser',
+    # Get the lyrics straight from the downloaded bytes for the sources that
+    # support it, and compare the result with the full parse for this fraction
+    # of the pages
+    'fast_paths': True,
+    'fast_path_validation': 0.01,
+    # Number of processes used to parse the pages downloaded by the threads
+    # searching for a single song (0 to parse them in the threads themselves)
+    'parse_workers': 0,
+    # Search engine: 'sync' runs the sources of a song in threads (or one
+    # after another in the processes launched with several jobs), 'hedged'
+    # runs them one after another but starts the next one when the current
+    # one is slow (see 'hedge'), and 'async' runs every song and source on a
+    # single event loop (see the aio module), with up to 'async_concurrency'
+    # songs in flight and their requests sent by 'async_threads' threads (0
+    # means enough for every source of every song in flight)
+    'engine': 'sync',
+    'async_concurrency': 32,
+    'async_threads': 0,
+    # Hedged searches start the next source when the running ones have taken
+    # longer than the 'percentile' of their recent search times (or 'delay'
+    # seconds, until there are enough of them), with up to 'max_sources'
+    # sources running at the same time
+    'hedge': {
+        'percentile': 90,
+        'delay': 2,
+        'max_sources': 3,
+    },
+    # Maximum number of hosts and idle connections per host kept in the pool
+    'pool_hosts': 16,
+    'pool_size': 4,
+    # Timeouts (in seconds) for every request, and the maximum time allowed to
+    # search for the lyrics of a single song (0 means no limit)
+    'connect_timeout': 5,
+    'read_timeout': 15,
+    'deadline': 0,
+    # Maximum size (in bytes) of a response body, 0 means no limit
+    'max_body_size': 5 * 1024 * 1024,
+    # Responses whose download stops early are read to the end and their
+    # connection reused if at most this many bytes (0 to never do it) are left,
+    # and closed otherwise
+    'max_drain_size': 64 * 1024,
+    # Number of sources (in the order they are searched) to open connections
+    # to before the first search starts
+    'warmup': 0,
+    # Number of seconds to cache the addresses of every host (0 to disable)
+    'dns_ttl': 300,
+    # Path of an archive to record every response to, or to replay them from
+    # instead of using the network, optionally waiting as long as the original
+    # requests took
+    'record': '',
+    'replay': '',
+    'replay_timing': False,
+    # Send every request to this url instead (like http://127.0.0.1:8000),
+    # keeping the original host in the Host header. Used by the benchmarks
+    'host_override': '',
+    # Persistent cache for the downloaded pages. The size is in bytes, and the
+    # ttl maps the name of every source to the number of seconds its responses
+    # are considered fresh
+    'cache': True,
+    'cache_dir': '',
+    'cache_size': 256 * 1024 * 1024,
+    'cache_ttl': {'default': 7 * 24 * 3600},
+    # Maximum size (in bytes) of the pages kept in memory by every process,
+    # and of the parsed documents among them (0 to disable)
+    'memory_cache': 64 * 1024 * 1024,
+    'memory_cache_parsed': 4 * 1024 * 1024,
+    # Number of seconds to remember that a source didn't have some lyrics
+    'negative_ttl': 30 * 24 * 3600,
+    # Number of seconds to remember a permanent redirect
+    'redirect_ttl': 30 * 24 * 3600,
+    # Maps every host to the maximum number of requests per second and the
+    # size of the burst allowed, shared by all the processes. A rate of 0 means
+    # no limit
+    'rate_limits': {
+        'default': [5, 10],
+        # Musixmatch bans IPs pretty easily
+        'www.musixmatch.com': [0.5, 2],
+    },
+    'max_host_connections': 8,
+    # Settings for the circuit breakers of every source: they open when the
+    # error rate, timeout rate or average latency (in seconds) of the last
+    # 'window' searches go over these limits, and let a new search through
+    # after 'cooldown' seconds
+    'breaker': {
+        'window': 20,
+        'min_calls': 5,
+        'error_rate': 0.5,
+        'timeout_rate': 0.3,
+        'latency': 10,
+        'cooldown': 60,
+    },
+    # Policy to retry failed requests: maximum number of retries per request,
+    # base and maximum backoff (in seconds), and the status codes that can be
+    # retried. Retries can't go over 'budget_min' plus 'budget_ratio' times the
+    # total number of requests sent in an execution
+    'retries': {
+        'total': 2,
+        'backoff': 0.5,
+        'max_backoff': 10,
+        'statuses': [429, 500, 502, 503, 504],
+        'budget_ratio': 0.1,
+        'budget_min': 10,
+    },
 }
 
 _load_config()
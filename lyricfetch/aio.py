@@ -0,0 +1,276 @@
+"""
+Asynchronous search engine, which runs the searches of many songs and sources
+at the same time on a single event loop.
+
+There's no async HTTP client among the dependencies, so every step of the
+sources (including their plans, which may send requests of their own) still
+runs in a shared pool of `CONFIG['async_threads']` threads, sending the
+requests through the pooled connections of the transport module. The event
+loop only coordinates them, so a search can be cancelled between any two
+steps, and up to `CONFIG['async_concurrency']` songs can be searched at the
+same time without a set of threads of their own.
+"""
+import asyncio
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from . import CONFIG
+from . import cache
+from . import logger
+from . import metrics
+from . import parsepool
+from . import sources
+from . import transport
+from .run import Result
+from .run import allow_source
+from .run import cancel_search
+from .run import prepare_run
+from .run import process_result
+from .run import record_outcome
+from .run import report_run
+from .run import skip_known_misses
+from .run import source_key
+from .scraping import Request
+from .scraping import fetch_body
+from .scraping import source_steps
+from .stats import Stats
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def thread_count():
+    """
+    Returns the number of threads that should send the requests.
+    """
+    threads = int(CONFIG['async_threads'])
+    if threads <= 0:
+        # Enough for every source of every song in flight
+        threads = max(int(CONFIG['async_concurrency']), 1) * len(sources)
+    return threads
+
+
+def get_executor():
+    """
+    Returns the pool of threads that send the requests, creating it if needed.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(thread_count(),
+                                           thread_name_prefix='lyricfetch')
+        return _executor
+
+
+def reset():
+    """
+    Shut down the pool of threads. A new one will be created with the current
+    settings when it's needed again.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+
+def run_loop(coro):
+    """
+    Run a coroutine on a new event loop and return its result, closing the
+    loop afterwards (like `asyncio.run`, which needs Python 3.7).
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coro)
+    finally:
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+def _in_context(source, counters, until, token, func, *args):
+    """
+    Call `func` in a thread of the pool, with the metrics, deadline and cancel
+    token of the search it belongs to.
+    """
+    with metrics.track(source, counters), transport.deadline(until=until), \
+            transport.cancellation(token):
+        return func(*args)
+
+
+async def _call(source, counters, until, token, func, *args):
+    """
+    Run `func` in the pool of threads and return its result.
+    """
+    loop = asyncio.get_event_loop()
+    call = partial(_in_context, source, counters, until, token, func, *args)
+    return await loop.run_in_executor(get_executor(), call)
+
+
+def _run_step(request, song, first):
+    """
+    Send a request of a source and run the extract step on its response.
+    """
+    if not first:
+        transport.require_time(request.url)
+    body = fetch_body(request.url, request.parser, request.region)
+    return parsepool.extract(request, body, song)
+
+
+async def run_steps(source, song, counters=None, until=None, token=None):
+    """
+    Search for the lyrics of `song` in `source`, like `scraping.run_steps`.
+
+    Sources without separate steps are run in a single call.
+    """
+    plan = source_steps.get(source)
+    if plan is None:
+        return await _call(source, counters, until, token, source, song)
+
+    # Planning may need requests too (like the lastfm lookups of darklyrics)
+    result = await _call(source, counters, until, token, plan, song)
+    first = True
+    while isinstance(result, Request):
+        result = await _call(source, counters, until, token, _run_step,
+                             result, song, first)
+        first = False
+    return result or ''
+
+
+async def scrape(source, song, counters=None, until=None, token=None):
+    """
+    Async version of `run.scrape`.
+    """
+    res = dict(runtime=0, lyrics='', source=source, error=False,
+               skipped=False)
+    if not allow_source(source, counters):
+        res['skipped'] = True
+        return res
+
+    # Other tasks run in this thread while this one waits, so only the
+    # breaker's bookkeeping is tracked, and not the whole search
+    with record_outcome(source, res, counters):
+        res['lyrics'] = await run_steps(source, song, counters, until, token)
+    return res
+
+
+async def get_lyrics(song, l_sources=None):
+    """
+    Searches for the lyrics of a single song in every source at the same time,
+    and returns a Result object with the various stats collected in the
+    process. As soon as one of them finds the lyrics, the rest are cancelled,
+    along with their requests in progress.
+
+    The optional parameter 'sources' specifies an alternative list of sources.
+    If not present, the main list will be used.
+    """
+    if l_sources is None:
+        l_sources = sources
+
+    if song.lyrics and not CONFIG['overwrite']:
+        logger.debug('%s already has embedded lyrics', song)
+        return None
+
+    runtimes = {}
+    counters = Counter()
+    missed = []
+    source = None
+    lyrics = ''
+    l_sources = skip_known_misses(song, l_sources, counters)
+    # The threads will hand the pages to this pool for parsing, if enabled
+    parsepool.start()
+    until = None
+    if CONFIG['deadline']:
+        until = time.time() + float(CONFIG['deadline'])
+    token = transport.CancelToken()
+    tasks = [asyncio.ensure_future(scrape(l_source, song, counters, until,
+                                          token))
+             for l_source in l_sources]
+    try:
+        for task in asyncio.as_completed(tasks):
+            res = await task
+            if res['skipped']:
+                continue
+            runtimes[res['source']] = res['runtime']
+            if res['lyrics']:
+                source = res['source']
+                lyrics = res['lyrics']
+                break
+            if not res['error']:
+                missed.append(source_key(res['source']))
+    finally:
+        running = [l_source for l_source, task in zip(l_sources, tasks)
+                   if not task.done()]
+        cancel_search(token, running, counters)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    cache.add_misses(song, missed)
+
+    if lyrics:
+        logger.info('++ %s: Found lyrics for %s\n', source.__name__, song)
+        song.lyrics = lyrics
+    else:
+        logger.info("Couldn't find lyrics for %s\n", song)
+
+    return Result(song, source, runtimes, counters)
+
+
+async def search(songs, func=None):
+    """
+    Call `func` (`get_lyrics` by default) for every song in `songs`, with up
+    to `CONFIG['async_concurrency']` songs at the same time, and yield the
+    results as they are ready.
+    """
+    if func is None:
+        func = get_lyrics
+    semaphore = asyncio.Semaphore(max(int(CONFIG['async_concurrency']), 1))
+
+    async def limited(song):
+        async with semaphore:
+            return await func(song)
+
+    tasks = [asyncio.ensure_future(limited(song)) for song in songs]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _search_all(songs):
+    """
+    Search for the lyrics of every song in `songs`, process the results and
+    return a Stats object.
+    """
+    stats = Stats()
+    async for result in search(songs):
+        if result is None:
+            continue
+        for source, runtime in result.runtimes.items():
+            stats.add_result(source, result.source == source, runtime)
+        stats.add_counters(result.counters)
+        process_result(result)
+    return stats
+
+
+def run_async(songs):
+    """
+    Like `run.run`, but with the async engine.
+    """
+    prepare_run()
+    if not hasattr(songs, '__iter__'):
+        result = run_loop(get_lyrics(songs))
+        process_result(result)
+        report_run()
+    else:
+        start = time.time()
+        stats = run_loop(_search_all(songs))
+        report_run(stats, time.time() - start)
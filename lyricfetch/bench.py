@@ -0,0 +1,266 @@
+"""
+Benchmarks for lyricfetch.
+
+The load test searches for the lyrics of a made up library in a local server
+that stands in for every website (see the fakesite module), and reports the
+throughput, the latency percentiles and the resources used. There's also a
+microbenchmark of the url slugs built for every song.
+
+Run them with `lyricfetch bench` or `python -m lyricfetch.bench`.
+"""
+import argparse
+import random
+import resource
+import time
+from functools import partial
+from multiprocessing import Pool
+
+from . import CONFIG
+from . import Song
+from . import aio
+from . import ratelimit
+from . import retry
+from .fakesite import DISTRIBUTIONS
+from .fakesite import SiteOptions
+from .fakesite import serve
+from .run import get_lyrics
+from .run import get_lyrics_hedged
+from .run import get_lyrics_threaded
+from .run import init_worker
+from .scraping import source_steps
+from .stats import Stats
+from .stats import percentile
+
+# Functions that can search for the lyrics of a single song. The async engine
+# searches for every song in a single process instead
+ENGINES = {
+    'sequential': get_lyrics,
+    'threaded': get_lyrics_threaded,
+    'hedged': get_lyrics_hedged,
+    'async': aio.get_lyrics,
+}
+
+WORDS = [
+    'love', 'night', 'wish', 'alpenglow', 'días', 'niño', 'über', 'café',
+    "don't", "rock 'n' roll", 'ac/dc', 'p!nk', 'r.e.m.', '¿qué?', '¡sí!',
+    'live @ home', 'you & me', '100%', 'mötley', 'crüe', 'part (ii)',
+    'the', 'a', 'of', 'sea', 'mountain', 'fire', 'blue', 'dream',
+]
+
+
+def make_library(count, songs_per_artist=10, seed=0):
+    """
+    Returns a list of `count` made up songs, with artist names and titles
+    full of the accents and punctuation that sources have to deal with.
+    """
+    rand = random.Random(seed)
+
+    def name(words):
+        return ' '.join(rand.choice(WORDS) for _ in range(words)).title()
+
+    songs = []
+    for i in range(count):
+        if i % songs_per_artist == 0:
+            artist = name(rand.randint(1, 3))
+            album = name(rand.randint(1, 4))
+        songs.append(Song(artist, name(rand.randint(1, 5)), album))
+    return songs
+
+
+def bench_slugs(songs, rounds=3):
+    """
+    Build the first url of every source for every song in `songs`, and
+    return the number of songs per second of the first round (when the slugs
+    of the library are not memoized yet) and of the best of the rest.
+    """
+    plans = list(source_steps.values())
+    results = []
+    for _ in range(max(rounds, 2)):
+        start = time.perf_counter()
+        for song in songs:
+            for plan in plans:
+                plan(song)
+        results.append(len(songs) / (time.perf_counter() - start))
+    return results[0], max(results[1:])
+
+
+def _search(engine, song):
+    """
+    Search for the lyrics of `song` with `engine`, and return the Result and
+    the time it took.
+    """
+    start = time.perf_counter()
+    result = ENGINES[engine](song)
+    return result, time.perf_counter() - start
+
+
+def _cpu_time():
+    """
+    Returns the CPU time used by this process and its finished children.
+    """
+    usage = 0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        rusage = resource.getrusage(who)
+        usage += rusage.ru_utime + rusage.ru_stime
+    return usage
+
+
+async def _search_async(songs):
+    """
+    Search for the lyrics of every song in `songs` with the async engine, and
+    return a list with the Result of each one and the time it took.
+    """
+    async def timed(song):
+        start = time.perf_counter()
+        result = await aio.get_lyrics(song)
+        return result, time.perf_counter() - start
+
+    return [result async for result in aio.search(songs, timed)]
+
+
+def _search_pool(songs, engine, jobs):
+    """
+    Search for the lyrics of every song in `songs` with `engine`, in a pool of
+    `jobs` processes like `run_mp` does, and yield the Result of each one and
+    the time it took.
+    """
+    initargs = (ratelimit.get_limiter(), retry.get_budget(), jobs == 1)
+    with Pool(jobs, initializer=init_worker, initargs=initargs) as pool:
+        search = partial(_search, engine)
+        # One song at a time, so every worker stays busy until the end and the
+        # number of processes is the only thing that changes between runs
+        yield from pool.imap_unordered(search, songs)
+
+
+def bench_load(songs, engine='threaded', jobs=1):
+    """
+    Search for the lyrics of every song in `songs` with `engine`, and return a
+    dictionary with the results and resources used.
+
+    Every engine but the async one runs in a pool of `jobs` processes.
+    """
+    stats = Stats()
+    latencies = []
+    found = 0
+    cpu = _cpu_time()
+    start = time.perf_counter()
+    if engine == 'async':
+        results = aio.run_loop(_search_async(songs))
+    else:
+        results = _search_pool(songs, engine, jobs)
+    for result, elapsed in results:
+        latencies.append(elapsed)
+        if result is None:
+            continue
+        for source, runtime in result.runtimes.items():
+            stats.add_result(source, result.source == source, runtime)
+        stats.add_counters(result.counters)
+        found += result.source is not None
+    elapsed = time.perf_counter() - start
+
+    requests = stats.counters['requests'] + sum(
+        record.counters['requests'] for record in stats.source_stats.values())
+    rss = max(resource.getrusage(who).ru_maxrss for who in
+              (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    return {
+        'songs': len(songs),
+        'found': found,
+        'time': elapsed,
+        'throughput': len(songs) / elapsed,
+        'latencies': {p: percentile(latencies, p) for p in (50, 90, 99, 100)},
+        'requests': requests,
+        'cpu': _cpu_time() - cpu,
+        # In KiB on linux
+        'rss': rss,
+        'stats': stats,
+    }
+
+
+def print_load(results):
+    """
+    Print the results of `bench_load()`.
+    """
+    latencies = results['latencies']
+    print(f"""\
+Songs: {results['songs']} ({results['found']} found) in \
+{results['time']:.2f}s, {results['throughput']:.2f} songs/s
+Latency per song: p50 {latencies[50]:.3f}s, p90 {latencies[90]:.3f}s, \
+p99 {latencies[99]:.3f}s, max {latencies[100]:.3f}s
+Requests: {results['requests']} \
+({results['requests'] / max(results['songs'], 1):.2f} per song)
+CPU time: {results['cpu']:.2f}s \
+({results['cpu'] * 1000 / max(results['songs'], 1):.2f}ms per song)
+Peak RSS: {results['rss'] / 1024:.1f} MiB""")
+
+
+def parse_args(args=None):
+    """
+    Parse the command line arguments of the benchmarks.
+    """
+    parser = argparse.ArgumentParser(
+        prog='lyricfetch bench',
+        description='Search for the lyrics of a made up library in a local'
+        ' server that stands in for every website')
+    parser.add_argument('--songs', type=int, default=200, metavar='N',
+                        help='Number of songs in the library')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='Number of parallel processes (ignored by the'
+                        ' async engine)')
+    parser.add_argument('--engine', choices=sorted(ENGINES),
+                        default='threaded', help='Search engine to use')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        metavar='SECONDS', help='Average response time')
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS,
+                        default='lognormal',
+                        help='Distribution of the response times')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        metavar='RATE', help='Fraction of requests that fail')
+    parser.add_argument('--miss-rate', type=float, default=0.3,
+                        metavar='RATE', help='Fraction of songs missing in'
+                        ' every website')
+    parser.add_argument('--throttle', type=float, default=0,
+                        metavar='RATE', help='Maximum number of requests per'
+                        ' second to every host (0 means no limit)')
+    parser.add_argument('--page-size', type=int, default=30000,
+                        metavar='BYTES', help='Size of the pages')
+    parser.add_argument('-s', '--stats', action='store_true',
+                        help='Print the stats of every source')
+    parser.add_argument('--slugs', action='store_true',
+                        help='Only run the microbenchmark of the url slugs')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='Number of rounds of the slugs microbenchmark')
+    args = parser.parse_args(args)
+    if args.songs <= 0 or args.jobs <= 0:
+        parser.error('The number of songs and jobs must be positive')
+    return args
+
+
+def main(args=None):
+    """
+    Main function. Run the benchmarks and print their results.
+    """
+    args = parse_args(args)
+    songs = make_library(args.songs)
+    if args.slugs:
+        cold, warm = bench_slugs(songs, args.rounds)
+        print(f'Slugs: {cold:.0f} songs/s (cold), {warm:.0f} songs/s (warm)')
+        return 0
+
+    options = SiteOptions(args.latency, args.distribution, args.error_rate,
+                          args.miss_rate, args.throttle, args.page_size)
+    # Every request has to reach the server, which does its own throttling
+    CONFIG['cache'] = False
+    CONFIG['rate_limits'] = {'default': [0, 0]}
+    CONFIG['jobcount'] = args.jobs
+    with serve(songs, options) as url:
+        CONFIG['host_override'] = url
+        results = bench_load(songs, args.engine, args.jobs)
+
+    print_load(results)
+    if args.stats:
+        results['stats'].print_stats()
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,168 @@
+"""
+Circuit breakers to stop scraping websites that are down or too slow.
+
+Every source gets a breaker that keeps track of the outcome of its most recent
+searches. When too many of them fail, time out or take too long, the breaker
+opens and the source is skipped. After a cooldown period, a single search is
+allowed through to probe the website, and the breaker is closed again if it
+succeeds.
+"""
+import threading
+import time
+from collections import deque
+from urllib.error import HTTPError
+
+from . import CONFIG
+from . import logger
+from . import metrics
+from .stats import percentile
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Statuses of the pages a website doesn't have, which are just a miss
+MISS_STATUSES = (404, 410)
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def is_miss(error):
+    """
+    Returns a boolean indicating whether `error` only means that the website
+    doesn't have the page requested.
+    """
+    return isinstance(error, HTTPError) and error.code in MISS_STATUSES
+
+
+def is_failure(error):
+    """
+    Returns a boolean indicating whether `error` means that the website is in
+    trouble. Of the HTTP errors, only server errors and throttling are.
+    """
+    if isinstance(error, HTTPError):
+        return error.code >= 500 or error.code == 429
+    return True
+
+
+class CircuitBreaker:
+    """
+    Keeps the outcomes of the last `window` calls to a source and decides
+    whether it should be called again.
+    """
+    def __init__(self, name, window=20, min_calls=5, error_rate=0.5,
+                 timeout_rate=0.3, latency=10, cooldown=60):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.latency = latency
+        self.cooldown = cooldown
+
+        self.state = CLOSED
+        self.opened_at = 0
+        self.probing = False
+        self.outcomes = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def _transition(self, state):
+        """
+        Change the state of the breaker and register it in the metrics. Must
+        be called while holding the lock.
+        """
+        logger.debug('Circuit breaker for %s is now %s', self.name, state)
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.time()
+        with metrics.track(self.name):
+            metrics.incr('breaker_' + state.replace('-', '_'))
+
+    def allow(self):
+        """
+        Returns a boolean indicating whether the source can be called.
+        """
+        with self.lock:
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.cooldown:
+                    return False
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    return False
+                self.probing = True
+            return True
+
+    def should_open(self):
+        """
+        Returns a boolean indicating whether the recent outcomes are bad
+        enough to open the breaker.
+        """
+        total = len(self.outcomes)
+        if total < self.min_calls:
+            return False
+        errors = sum(1 for error, _, _ in self.outcomes if error)
+        timeouts = sum(1 for _, timeout, _ in self.outcomes if timeout)
+        latency = sum(runtime for _, _, runtime in self.outcomes) / total
+        return (errors / total >= self.error_rate
+                or timeouts / total >= self.timeout_rate
+                or (self.latency and latency >= self.latency))
+
+    def latency_percentile(self, percent):
+        """
+        Returns the `percent` percentile of the time taken by the recent calls
+        that didn't fail, or None if there are not enough of them.
+        """
+        with self.lock:
+            runtimes = [runtime for error, timeout, runtime in self.outcomes
+                        if not error and not timeout]
+        if not runtimes or len(runtimes) < self.min_calls:
+            return None
+        return percentile(runtimes, percent)
+
+    def release(self):
+        """
+        Register that a call let through by `allow()` ended without an outcome
+        that says anything about the source (like being cancelled), so a
+        half-open breaker can let another probe through.
+        """
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probing = False
+
+    def record(self, runtime, error=False, timeout=False):
+        """
+        Register the outcome of a call to the source.
+        """
+        failed = error or timeout or (self.latency and runtime >= self.latency)
+        with self.lock:
+            self.outcomes.append((error, timeout, runtime))
+            if self.state == HALF_OPEN:
+                self.probing = False
+                if failed:
+                    self._transition(OPEN)
+                else:
+                    self.outcomes.clear()
+                    self._transition(CLOSED)
+            elif self.state == CLOSED and self.should_open():
+                self._transition(OPEN)
+
+
+def get_breaker(source):
+    """
+    Returns the circuit breaker of `source` (a scraping function or its
+    name), configured as specified in CONFIG.
+    """
+    name = source if isinstance(source, str) else source.__name__
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **CONFIG['breaker'])
+        return _breakers[name]
+
+
+def reset():
+    """
+    Forget the state of every breaker.
+    """
+    with _breakers_lock:
+        _breakers.clear()
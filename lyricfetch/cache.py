@@ -0,0 +1,526 @@
+"""
+Persistent on-disk cache for the responses downloaded by the scraping
+functions.
+
+Entries are stored in an sqlite database, so the cache can be safely shared by
+all the processes launched by `run_mp`, as well as by consecutive runs.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from . import CONFIG
+from . import logger
+from . import metrics
+from . import transport
+from .database import Database
+
+Entry = namedtuple('Entry', 'body etag last_modified stored')
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def cache_dir():
+    """
+    Returns the directory where the cache files are stored.
+    """
+    if CONFIG['cache_dir']:
+        return Path(CONFIG['cache_dir'])
+    base = os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')
+    return Path(base) / 'lyricfetch'
+
+
+def normalize_url(url):
+    """
+    Returns a canonical version of `url`, so that equivalent urls map to the
+    same cache entry.
+    """
+    parts = urlsplit(url)
+    netloc = parts.hostname or ''
+    default_port = {'http': 80, 'https': 443}.get(parts.scheme.lower())
+    if parts.port and parts.port != default_port:
+        netloc += f':{parts.port}'
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), netloc, parts.path or '/', query,
+                       ''))
+
+
+def get_ttl(source):
+    """
+    Returns the number of seconds a response downloaded by `source` (the name
+    of a scraping function) is considered fresh.
+    """
+    ttls = CONFIG['cache_ttl']
+    return float(ttls.get(source, ttls.get('default', 0)))
+
+
+class ResponseCache(Database):
+    """
+    Stores compressed response bodies indexed by url and parser, and evicts the
+    least recently used ones when the total size goes over `max_size` bytes.
+
+    The total size is kept up to date by the database itself, and the access
+    times are only as precise as `access_resolution`, so that reading entries
+    doesn't need to write to the database every time.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            stored REAL NOT NULL,
+            accessed REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_accessed
+            ON responses (accessed);
+
+        CREATE TABLE IF NOT EXISTS responses_size (
+            total INTEGER NOT NULL
+        );
+        INSERT INTO responses_size
+            SELECT COALESCE(SUM(size), 0) FROM responses
+            WHERE NOT EXISTS (SELECT * FROM responses_size);
+        CREATE TRIGGER IF NOT EXISTS responses_insert
+            AFTER INSERT ON responses
+        BEGIN
+            UPDATE responses_size SET total = total + NEW.size;
+        END;
+        CREATE TRIGGER IF NOT EXISTS responses_delete
+            AFTER DELETE ON responses
+        BEGIN
+            UPDATE responses_size SET total = total - OLD.size;
+        END;
+    """
+    # Seconds that can pass before a new access to an entry is written
+    access_resolution = 60
+    # Number of entries read at once when looking for entries to evict
+    evict_batch = 64
+
+    def __init__(self, path, max_size):
+        super().__init__(path)
+        self.max_size = max_size
+
+    def get(self, key):
+        """
+        Returns the Entry stored for `key`, or None if there isn't one.
+        """
+        rows = self.execute('SELECT body, etag, last_modified, stored, '
+                            'accessed FROM responses WHERE key = ?', (key,))
+        if not rows:
+            return None
+        body, etag, last_modified, stored, accessed = rows[0]
+        now = time.time()
+        if now - accessed >= self.access_resolution:
+            self.execute('UPDATE responses SET accessed = ? WHERE key = ?',
+                         (now, key))
+        return Entry(zlib.decompress(body), etag, last_modified, stored)
+
+    def put(self, key, body, etag=None, last_modified=None):
+        """
+        Store a new response body for `key`.
+        """
+        now = time.time()
+        body = zlib.compress(body)
+        with self.lock:
+            # A REPLACE wouldn't update the total size of the old entry
+            with self.transaction() as conn:
+                conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                conn.execute('INSERT INTO responses VALUES '
+                             '(?, ?, ?, ?, ?, ?, ?)',
+                             (key, body, len(body), etag, last_modified, now,
+                              now))
+            self.evict()
+
+    def refresh(self, key):
+        """
+        Mark the entry for `key` as freshly downloaded.
+        """
+        now = time.time()
+        self.execute('UPDATE responses SET stored = ?, accessed = ? '
+                     'WHERE key = ?', (now, now, key))
+
+    def size(self):
+        """
+        Returns the total size of the stored bodies.
+        """
+        return self.execute('SELECT total FROM responses_size')[0][0]
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the total size is below
+        the maximum.
+        """
+        if self.size() <= self.max_size:
+            return
+
+        evicted = 0
+        with self.transaction() as conn:
+            excess = conn.execute('SELECT total FROM responses_size')
+            excess = excess.fetchone()[0] - self.max_size
+            while excess > 0:
+                rows = conn.execute('SELECT key, size FROM responses '
+                                    'ORDER BY accessed LIMIT ?',
+                                    (self.evict_batch,)).fetchall()
+                if not rows:
+                    break
+                keys = []
+                for key, size in rows:
+                    if excess <= 0:
+                        break
+                    keys.append((key,))
+                    excess -= size
+                conn.executemany('DELETE FROM responses WHERE key = ?', keys)
+                evicted += len(keys)
+        metrics.incr('cache_evictions', evicted)
+
+
+class NegativeCache(Database):
+    """
+    Remembers which sources didn't have the lyrics for a song, so they aren't
+    scraped again until `ttl` seconds have passed.
+
+    Every entry is just a 64 bit hash of the source id, artist and title plus
+    a timestamp, and lookups go straight to the database, so the cache can
+    grow to millions of entries without having to keep them in memory.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS misses (
+            key INTEGER PRIMARY KEY,
+            stored REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path, ttl):
+        super().__init__(path)
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(source_id, song):
+        """
+        Returns the integer key for the pair of `source_id` and `song`.
+        """
+        artist = ' '.join((song.artist or '').lower().split())
+        title = ' '.join((song.title or '').lower().split())
+        digest = hashlib.blake2b('\0'.join((source_id, artist, title))
+                                 .encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big', signed=True)
+
+    def misses(self, song, source_ids):
+        """
+        Returns the subset of `source_ids` that are known to not have the
+        lyrics for `song`.
+        """
+        keys = {self.make_key(source_id, song): source_id
+                for source_id in source_ids}
+        if not keys:
+            return set()
+        placeholders = ', '.join('?' * len(keys))
+        rows = self.execute(f'SELECT key FROM misses WHERE stored > ? AND '
+                            f'key IN ({placeholders})',
+                            (time.time() - self.ttl, *keys))
+        return {keys[key] for key, in rows}
+
+    def add(self, song, source_ids):
+        """
+        Register that none of `source_ids` have the lyrics for `song`.
+        """
+        now = time.time()
+        rows = [(self.make_key(source_id, song), now)
+                for source_id in source_ids]
+        with self.transaction() as conn:
+            conn.executemany('INSERT OR REPLACE INTO misses VALUES (?, ?)',
+                             rows)
+
+    def purge(self):
+        """
+        Remove all the expired entries.
+        """
+        self.execute('DELETE FROM misses WHERE stored <= ?',
+                     (time.time() - self.ttl,))
+
+
+class RedirectStore(Database):
+    """
+    Remembers the permanent redirects returned by every website, so that
+    later requests can go straight to the final location.
+
+    Redirects that only change the scheme or host of a url (like http to https,
+    or www to the bare domain) are stored for the whole origin, and any other
+    redirect is stored for its exact url.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS redirects (
+            key TEXT PRIMARY KEY,
+            target TEXT NOT NULL,
+            stored REAL NOT NULL
+        );
+    """
+    # Maximum number of redirects followed when rewriting a url
+    max_redirects = 5
+
+    def __init__(self, path, ttl):
+        super().__init__(path)
+        self.ttl = ttl
+
+    @staticmethod
+    def split_origin(url):
+        """
+        Returns the origin (scheme and host) of `url` and the rest of it.
+        """
+        parts = urlsplit(normalize_url(url))
+        origin = urlunsplit((parts.scheme, parts.netloc, '', '', ''))
+        return origin, urlunsplit(('', '', parts.path, parts.query, ''))
+
+    def rewrite(self, url):
+        """
+        Returns the final location of `url` according to the stored redirects,
+        and the list of keys of the redirects that were applied.
+        """
+        applied = []
+        for _ in range(self.max_redirects):
+            origin, rest = self.split_origin(url)
+            rows = self.execute('SELECT key, target FROM redirects WHERE '
+                                'stored > ? AND key IN (?, ?)',
+                                (time.time() - self.ttl,
+                                 normalize_url(url), origin))
+            if not rows:
+                break
+            # Exact matches take precedence over the ones for the origin
+            key, target = max(rows, key=lambda row: len(row[0]))
+            if key == origin:
+                target += rest
+            applied.append(key)
+            url = target
+        return url, applied
+
+    def add(self, history):
+        """
+        Store the permanent redirects in `history`, a list of (url, status,
+        location) tuples.
+        """
+        now = time.time()
+        rows = []
+        for url, status, location in history:
+            if status not in (301, 308):
+                continue
+            origin, rest = self.split_origin(url)
+            target_origin, target_rest = self.split_origin(location)
+            if rest == target_rest and origin != target_origin:
+                rows.append((origin, target_origin, now))
+            else:
+                rows.append((normalize_url(url), location, now))
+        if rows:
+            with self.transaction() as conn:
+                conn.executemany('INSERT OR REPLACE INTO redirects VALUES '
+                                 '(?, ?, ?)', rows)
+
+    def remove(self, keys):
+        """
+        Forget the redirects stored for `keys`.
+        """
+        with self.transaction() as conn:
+            conn.executemany('DELETE FROM redirects WHERE key = ?',
+                             [(key,) for key in keys])
+
+
+def _get_database(filename, factory, *args):
+    path = cache_dir() / filename
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = factory(path, *args)
+        return _caches[path]
+
+
+def get_cache():
+    """
+    Returns the response cache configured in CONFIG, or None if caching is
+    disabled.
+    """
+    if not CONFIG['cache']:
+        return None
+    return _get_database('responses.sqlite', ResponseCache,
+                         int(CONFIG['cache_size']))
+
+
+def get_negative_cache():
+    """
+    Returns the negative results cache configured in CONFIG, or None if it's
+    disabled.
+    """
+    if not CONFIG['cache'] or not CONFIG['negative_ttl']:
+        return None
+    return _get_database('misses.sqlite', NegativeCache,
+                         float(CONFIG['negative_ttl']))
+
+
+def get_redirects():
+    """
+    Returns the store of permanent redirects, or None if caching is disabled.
+    """
+    if not CONFIG['cache'] or not CONFIG['redirect_ttl']:
+        return None
+    return _get_database('redirects.sqlite', RedirectStore,
+                         float(CONFIG['redirect_ttl']))
+
+
+def reset():
+    """
+    Close every open cache database.
+    """
+    with _caches_lock:
+        for cache in _caches.values():
+            cache.close()
+        _caches.clear()
+
+
+def _stale_redirects(error, applied):
+    """
+    Returns the keys of the redirects in `applied` that can't be trusted
+    anymore, now that a request to the url they lead to failed with `error`.
+    """
+    if isinstance(error, HTTPError):
+        # A redirect that can't be followed, or the wrong host
+        if 300 <= error.code < 400 or error.code == 421:
+            return applied
+        # An error for the page itself only says that its own redirects may
+        # have changed, not the ones for the whole origin (like http to https)
+        if 400 <= error.code < 500:
+            return [key for key in applied if urlsplit(key).path]
+        return []
+    if transport.is_timeout(error) or isinstance(error, (
+            transport.DeadlineExceeded, transport.Cancelled,
+            transport.BodyTooLarge)):
+        return []
+    # The target can't be reached at all, or it redirects in a loop
+    return applied
+
+
+def _download(url, headers=None, region=None):
+    """
+    Download `url`, skipping any permanent redirects learned before and
+    remembering the new ones.
+    """
+    redirects = get_redirects()
+    if redirects is None:
+        return transport.fetch(url, headers=headers, region=region)
+
+    try:
+        target, applied = redirects.rewrite(url)
+    except sqlite3.Error as error:
+        logger.warning('Could not read from the cache: %s', error)
+        return transport.fetch(url, headers=headers, region=region)
+
+    metrics.incr('redirects_saved', len(applied))
+    try:
+        response = transport.fetch(target, headers=headers, region=region)
+    except URLError as error:
+        # The website may have changed, so don't trust these redirects again
+        stale = _stale_redirects(error, applied)
+        if stale:
+            redirects.remove(stale)
+        raise
+
+    try:
+        redirects.add(response.history)
+    except sqlite3.Error as error:
+        logger.warning('Could not write to the cache: %s', error)
+    return response
+
+
+def fetch(url, parser, region=None):
+    """
+    Get the body of `url` from the cache if there's a fresh copy of it, or
+    download it otherwise. Stale entries are revalidated with the server
+    before being used again.
+
+    If a `region` is passed, the body may be truncated right after it.
+    """
+    cache = get_cache()
+    if cache is None:
+        return _download(url, region=region).body
+
+    key = f'{parser}:{normalize_url(url)}'
+    if region is not None:
+        # Truncated bodies can't be shared with other regions
+        key = f'{parser}:{region}:{normalize_url(url)}'
+    try:
+        entry = cache.get(key)
+    except sqlite3.Error as error:
+        logger.warning('Could not read from the cache: %s', error)
+        return _download(url, region=region).body
+
+    headers = {}
+    if entry is not None:
+        if time.time() - entry.stored < get_ttl(metrics.current_source()):
+            metrics.incr('cache_hits')
+            return entry.body
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+
+    metrics.incr('cache_misses')
+    response = _download(url, headers=headers, region=region)
+    try:
+        if response.status == 304 and entry is not None:
+            metrics.incr('cache_revalidated')
+            cache.refresh(key)
+            return entry.body
+
+        cache.put(key, response.body, response.headers.get('ETag'),
+                  response.headers.get('Last-Modified'))
+    except sqlite3.Error as error:
+        logger.warning('Could not write to the cache: %s', error)
+    return response.body
+
+
+def known_misses(song, source_ids):
+    """
+    Returns the subset of `source_ids` that are known to not have the lyrics
+    for `song`, according to the negative results cache.
+    """
+    negative_cache = get_negative_cache()
+    if negative_cache is None:
+        return set()
+    try:
+        return negative_cache.misses(song, source_ids)
+    except sqlite3.Error as error:
+        logger.warning('Could not read from the cache: %s', error)
+        return set()
+
+
+def add_misses(song, source_ids):
+    """
+    Register in the negative results cache that none of `source_ids` have the
+    lyrics for `song`.
+    """
+    negative_cache = get_negative_cache()
+    if negative_cache is None or not source_ids:
+        return
+    try:
+        negative_cache.add(song, source_ids)
+    except sqlite3.Error as error:
+        logger.warning('Could not write to the cache: %s', error)
+
+
+def purge_misses():
+    """
+    Remove the expired entries from the negative results cache.
+    """
+    negative_cache = get_negative_cache()
+    if negative_cache is None:
+        return
+    try:
+        negative_cache.purge()
+    except sqlite3.Error as error:
+        logger.warning('Could not write to the cache: %s', error)
@@ -9,9 +9,11 @@ import glob
 
 from . import logger
 from . import CONFIG
+from .aio import run_async
 from .song import Song
 from .song import get_current_song
 from .run import run
+from .run import start_warmup
 
 
 def load_from_file(filename):
@@ -48,6 +50,26 @@ def parse_argv():
                         ' up to three times)', action='count')
     parser.add_argument('-d', '--debug', help='Enable debug output',
                         action='store_true')
+    parser.add_argument('--deadline', help='Maximum number of seconds to'
+                        ' spend searching for the lyrics of each song',
+                        type=float, metavar='SECONDS')
+    parser.add_argument('--engine', help='Search engine to use (hedged only'
+                        ' starts another source when the current one is slow,'
+                        ' async runs every song on a single event loop,'
+                        ' ignoring -j)', choices=('sync', 'hedged', 'async'))
+    parser.add_argument('--no-cache', help="Don't use the cache of downloaded"
+                        ' pages', action='store_true')
+    parser.add_argument('--warmup', help='Open connections to the first N'
+                        ' sources while the songs are being read',
+                        type=int, metavar='N')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--record', help='Record every response received to'
+                       ' an archive', metavar='FILE')
+    group.add_argument('--replay', help='Serve the responses recorded in an'
+                       ' archive instead of using the network', metavar='FILE')
+    parser.add_argument('--replay-timing', help='Wait as long as the recorded'
+                        ' requests took when replaying them',
+                        action='store_true')
     group = parser.add_mutually_exclusive_group()
     group.add_argument('-r', '--recursive', help='Recursively search for'
                        ' mp3 files', metavar='path', nargs='?', const='.')
@@ -60,6 +82,17 @@ def parse_argv():
 
     CONFIG['overwrite'] = args.overwrite
     CONFIG['print_stats'] = args.stats
+    if args.engine is not None:
+        CONFIG['engine'] = args.engine
+    if args.no_cache:
+        CONFIG['cache'] = False
+    if args.record or args.replay:
+        # Every request has to go through the archive
+        CONFIG['cache'] = False
+        CONFIG['record'] = args.record or ''
+        CONFIG['replay'] = args.replay or ''
+    if args.replay_timing:
+        CONFIG['replay_timing'] = True
 
     if args.verbose is None or args.verbose == 0:
         logger.setLevel(logging.CRITICAL)
@@ -68,12 +101,25 @@ def parse_argv():
     else:
         logger.setLevel(logging.DEBUG)
 
+    if args.deadline is not None:
+        if args.deadline < 0:
+            parser.error('Argument --deadline cannot be negative')
+        CONFIG['deadline'] = args.deadline
+
     if args.jobs <= 0:
         msg = 'Argument -j/--jobs should have a value greater than zero'
         parser.error(msg)
     else:
         CONFIG['jobcount'] = args.jobs
 
+    if args.warmup is not None:
+        if args.warmup < 0:
+            parser.error('Argument --warmup cannot be negative')
+        CONFIG['warmup'] = args.warmup
+    if CONFIG['warmup']:
+        # Runs in the background while the tags are read
+        start_warmup(CONFIG['warmup'])
+
     songs = set()
     if args.from_file:
         songs = load_from_file(args.from_file)
@@ -99,6 +145,12 @@ def main():
     """
     Main function.
     """
+    if sys.argv[1:2] == ['bench']:
+        # Imported here, so the rest of the commands don't load the benchmark
+        # and its fake site
+        from .bench import main as bench_main
+        return bench_main(sys.argv[2:])
+
     msg = ''
     try:
         songs = parse_argv()
@@ -112,7 +164,10 @@ def main():
 
     logger.debug('Running with %s', songs)
     try:
-        run(songs)
+        if CONFIG['engine'] == 'async':
+            run_async(songs)
+        else:
+            run(songs)
     except KeyboardInterrupt:
         print('Interrupted')
         return 1
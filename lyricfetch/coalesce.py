@@ -0,0 +1,70 @@
+"""
+Coalescing of identical requests sent at the same time by several threads.
+
+When several songs of the same album or artist are searched at once, their
+threads often need the same page (like a darklyrics album page) at the same
+moment. Only the first of them actually fetches it, and the rest wait for its
+result.
+"""
+import threading
+
+from . import metrics
+
+
+class WaitTimeout(TimeoutError):
+    """
+    Raised when a call in progress in another thread takes too long.
+    """
+
+
+class Flight:
+    """
+    A call in progress, whose result will be shared by every thread waiting
+    for it.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call at a time for every key.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def do(self, key, func, timeout=None):
+        """
+        Returns the result of `func()`, or of the call already in progress
+        for the same `key`, waiting up to `timeout` seconds for it. Exceptions
+        raised by the call are raised in every thread waiting for it.
+
+        Raises WaitTimeout if the call in progress doesn't finish in time.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            metrics.incr('coalesced')
+            if not flight.done.wait(timeout):
+                raise WaitTimeout(f'Timed out waiting for {key}')
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
@@ -0,0 +1,62 @@
+"""
+Sqlite databases shared by the threads and processes of an execution.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class Database:
+    """
+    Thin wrapper around an sqlite connection that can be shared between
+    threads, and is transparently reopened after a fork.
+    """
+    schema = ''
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30,
+                                   check_same_thread=False,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(self.schema)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def execute(self, query, args=()):
+        with self.lock:
+            return self.conn.execute(query, args).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run every statement executed inside this context in a single
+        transaction, holding the write lock of the database.
+        """
+        with self.lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
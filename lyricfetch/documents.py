@@ -0,0 +1,130 @@
+"""
+In-memory cache of the documents fetched and parsed by every process.
+
+The same pages are often needed several times in a single execution, like the
+album pages of darklyrics (which have the lyrics of every song in the album)
+or the artist pages of lyrics.com. The persistent cache saves downloading them
+again, but they would still be read from disk, decompressed and parsed again
+for every song.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from . import CONFIG
+from . import metrics
+
+# Rough ratio between the memory taken by a BeautifulSoup object and the size
+# of the html it was parsed from
+SOUP_SIZE_FACTOR = 30
+
+_documents = None
+_documents_pid = None
+_documents_lock = threading.Lock()
+
+
+class DocumentCache:
+    """
+    Keeps the most recently used documents, as long as their total size
+    doesn't go over `max_size` bytes.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # Maps every key to a tuple of (document, size)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Returns the document stored for `key`, or None if there isn't one.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+
+        if entry is None:
+            metrics.incr('memory_misses')
+            return None
+        metrics.incr('memory_hits')
+        return entry[0]
+
+    def put(self, key, document, size):
+        """
+        Store a `document` that takes approximately `size` bytes, evicting the
+        least recently used ones if needed.
+        """
+        if size > self.max_size:
+            return
+
+        evicted = 0
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (document, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, old_size) = self.entries.popitem(last=False)
+                self.size -= old_size
+                evicted += 1
+        if evicted:
+            metrics.incr('memory_evictions', evicted)
+
+    def hit_rate(self):
+        """
+        Returns the percentage of lookups that found a document.
+        """
+        lookups = self.hits + self.misses
+        return self.hits * 100 / lookups if lookups else 0
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of documents stored, their
+        approximate size in bytes and the hit rate of the cache.
+        """
+        with self.lock:
+            return {
+                'documents': len(self.entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hit_rate(),
+            }
+
+
+def get_documents():
+    """
+    Returns the document cache of this process, or None if it's disabled in
+    CONFIG.
+    """
+    global _documents, _documents_pid
+    max_size = int(CONFIG['memory_cache'])
+    if max_size <= 0:
+        return None
+
+    with _documents_lock:
+        # Every process keeps its own cache
+        if _documents is None or _documents_pid != os.getpid():
+            _documents = DocumentCache(max_size)
+            _documents_pid = os.getpid()
+        _documents.max_size = max_size
+        return _documents
+
+
+def reset():
+    """
+    Drop every document in the cache.
+    """
+    global _documents
+    with _documents_lock:
+        _documents = None
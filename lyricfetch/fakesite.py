@@ -0,0 +1,437 @@
+"""
+Local stand-in for the websites scraped by every source, used to load test
+lyricfetch without touching the real ones.
+
+The server is built for a library of songs, and serves synthetic pages with
+the same url layout and markup as the real websites for each of them. Every
+request can be delayed, fail or be throttled as set in a `SiteOptions`. Set
+`CONFIG['host_override']` to the url of the server to point the sources at
+it.
+"""
+import math
+import multiprocessing
+import random
+import threading
+import time
+import urllib.request as request
+from collections import namedtuple
+from contextlib import contextmanager
+from html import escape
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+
+from .scraping import source_steps
+
+SiteOptions = namedtuple('SiteOptions', 'latency distribution error_rate '
+                         'miss_rate throttle page_size seed')
+SiteOptions.__new__.__defaults__ = (0.05, 'lognormal', 0, 0.3, 0, 30000, 0)
+
+DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+
+LINES = [
+    'Wish I could see over the mountains',
+    'Alpenglow, so bright',
+    'Deep in the heart of the night',
+    'Over the sea and far away',
+    'All the things I never said',
+    'Burning like a fire in the dark',
+]
+
+HEAD = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script type="text/javascript">var ads = "<div class='ad'></div>";</script>
+</head>
+<body>
+<div class="header"><a href="/">Home</a> | <a href="/top">Top</a></div>
+"""
+
+TAIL = """
+<div class="footer"><p>Copyright &copy; 2019 &mdash; All rights reserved</p>
+</div>
+</body>
+</html>
+"""
+
+
+def make_lyrics(song):
+    """
+    Returns the made up lines of the lyrics of `song`.
+    """
+    rand = random.Random(f'{song.artist}\0{song.title}')
+    lines = [rand.choice(LINES) for _ in range(rand.randint(8, 24))]
+    return [escape(song.title)] + lines
+
+
+def _padding(size):
+    """
+    Returns a block of html with approximately `size` bytes.
+    """
+    row = '<div class="related"><a href="/top">Related song</a></div>\n'
+    return row * max(size // len(row), 0)
+
+
+def _page(song, content, size):
+    """
+    Returns a full html page with the `content` for `song` in the middle,
+    padded to approximately `size` bytes.
+    """
+    head = HEAD.format(title=escape(f'{song.artist} - {song.title}'))
+    padding = size - len(head) - len(content) - len(TAIL)
+    return (head + _padding(padding // 2) + content +
+            _padding(padding - padding // 2) + TAIL)
+
+
+def _render_azlyrics(song, size):
+    lyrics = '<br>\n'.join(make_lyrics(song))
+    return _page(song, f"""
+<div class="col-xs-12 col-lg-8 text-center">
+<div class="ringtone"><a href="#">Ringtone</a></div>
+<div>
+<!-- Usage of azlyrics.com content by any third-party lyrics provider is
+prohibited by our licensing agreement. Sorry about that. -->
+{lyrics}<br>
+</div>
+</div>""", size)
+
+
+def _render_metrolyrics(song, size):
+    lyrics = make_lyrics(song)
+    verses = ''.join(f"<p class='verse'>{'<br>'.join(lyrics[i:i + 4])}</p>\n"
+                     for i in range(0, len(lyrics), 4))
+    return _page(song, f"""
+<div id="lyrics-body-text" class="js-lyric-text">
+{verses}</div>""", size)
+
+
+def _render_lyricswikia(song, size):
+    lyrics = '<br />'.join(make_lyrics(song))
+    return _page(song, f"""
+<div class='lyricbox'>{lyrics}<div class='lyricsbreak'></div>
+</div>""", size)
+
+
+def _render_darklyrics(songs, size):
+    content = '<div class="lyrics">\n'
+    for number, song in enumerate(songs, 1):
+        lyrics = '<br />\n'.join(make_lyrics(song))
+        content += (f'<h3><a name="{number}">{number}. '
+                    f'{escape(song.title)}</a></h3><br />\n{lyrics}<br />\n')
+    content += '<div class="thanks">Thanks for the lyrics.</div>\n</div>'
+    return _page(songs[0], content, size)
+
+
+def _render_genius(song, size):
+    lyrics = '<br>\n'.join(make_lyrics(song))
+    return _page(song, f"""
+<div class="song_body-lyrics">
+<div class="lyrics">
+<!--sse-->
+<p>{lyrics}</p>
+<!--/sse-->
+</div>
+</div>""", size)
+
+
+def _render_metalarchives_search(song_id):
+    link = (f'<a href=\\"javascript:;\\" id=\\"lyricsLink_{song_id}\\" '
+            f'onclick=\\"toggleLyrics(\'{song_id}\'); return false;\\">'
+            'Show lyrics</a>')
+    return ('{"error": "", "iTotalRecords": 1, "iTotalDisplayRecords": 1, '
+            f'"sEcho": 0, "aaData": [["Band", "Album", "Full-length", '
+            f'"Title", "{link}"]]}}')
+
+
+def _render_metalarchives(song, size):
+    return '<br />\n'.join(make_lyrics(song)) + '<br />\n'
+
+
+def _render_musixmatch(song, size):
+    lyrics = make_lyrics(song)
+    verses = ''.join('<span><p class="mxm-lyrics__content "><span>'
+                     + '\n'.join(lyrics[i:i + 4]) + '</span></p></span>\n'
+                     for i in range(0, len(lyrics), 4))
+    return _page(song, f"""
+<div class="mxm-lyrics">
+{verses}</div>""", size)
+
+
+def _render_songlyrics(song, size):
+    lyrics = '<br />\n'.join(make_lyrics(song))
+    return _page(song, f"""
+<div id="songLyricsContainer">
+<p id="songLyricsDiv" class="songLyricsV14 iComment-text">{lyrics}</p>
+</div>""", size)
+
+
+def _render_lyricscom_search(song, artist_id, size):
+    artist = escape(song.artist)
+    return _page(song, f"""
+<table class="tdata">
+<tr><th>Artist</th></tr>
+<tr><td><a class="name" href="artist/id/{artist_id}"
+title="{artist}">{artist}</a></td></tr>
+</table>""", size)
+
+
+def _render_lyricscom_artist(songs, song_ids, size):
+    links = ''.join(f'<tr><td><a href="/lyric/{song_id}">'
+                    f'{escape(song.title)}</a></td></tr>\n'
+                    for song, song_id in zip(songs, song_ids))
+    return _page(songs[0], f"""
+<div class="tdata-ext">
+<table>
+{links}</table>
+</div>""", size)
+
+
+def _render_lyricscom(song, size):
+    lyrics = '\n'.join(make_lyrics(song))
+    return _page(song, f"""
+<div class="lyric clearfix">
+<pre id="lyric-body-text" class="lyric-body" dir="ltr">{lyrics}</pre>
+</div>""", size)
+
+
+def _render_vagalume(song, size):
+    lyrics = '<br/>'.join(make_lyrics(song))
+    return _page(song, f"""
+<div id="lyricContent">
+<div id="lyrics">{lyrics}</div>
+</div>""", size)
+
+
+def _render_lyricsmode(song, size):
+    lyrics = '<br />\n'.join(make_lyrics(song))
+    return _page(song, f"""
+<div id="lyrics_text" class="ui-annotatable js-lyric-text-container">
+{lyrics}<br />
+<div class="ad-rectangle"><span>Advertisement</span></div>
+</div>""", size)
+
+
+def _render_letras(song, size):
+    lyrics = make_lyrics(song)
+    verses = ''.join(f"<p>{'<br/>'.join(lyrics[i:i + 4])}</p>\n"
+                     for i in range(0, len(lyrics), 4))
+    return _page(song, f"""
+<div class="cnt-head">
+<div class="cnt-head_title"><h1>{escape(song.title)}</h1></div>
+</div>
+<div class="cnt-letra">
+<article>
+{verses}</article>
+</div>""", size)
+
+
+_RENDERERS = {
+    'azlyrics': _render_azlyrics,
+    'metrolyrics': _render_metrolyrics,
+    'lyricswikia': _render_lyricswikia,
+    'genius': _render_genius,
+    'musixmatch': _render_musixmatch,
+    'songlyrics': _render_songlyrics,
+    'vagalume': _render_vagalume,
+    'lyricsmode': _render_lyricsmode,
+    'letras': _render_letras,
+}
+
+
+def route_key(url):
+    """
+    Returns the key of the route for `url`: a tuple of the host and the path
+    (with the query) requested by the transport.
+    """
+    parts = urlsplit(request.quote(url, safe=':/?=&'))
+    path = parts.path + ('?' + parts.query if parts.query else '')
+    return parts.netloc, path
+
+
+def build_routes(songs, miss_rate=0, seed=0):
+    """
+    Returns a dictionary that maps the key of every url the sources request
+    for `songs` to a function that renders its page with the specified size.
+    Every source is missing the lyrics of `miss_rate` of the songs.
+    """
+    rand = random.Random(seed)
+    routes = {}
+    albums = {}
+    artists = {}
+    for song_id, song in enumerate(songs):
+        for source, plan in source_steps.items():
+            if rand.random() < miss_rate:
+                continue
+            name = source.__name__
+            req = plan(song)
+            if not req:
+                continue
+            key = route_key(req.url)
+            if name == 'darklyrics':
+                albums.setdefault(key, []).append(song)
+            elif name == 'metalarchives':
+                routes[key] = (lambda size, song_id=song_id:
+                               _render_metalarchives_search(song_id))
+                url = ('https://www.metal-archives.com/release/'
+                       f'ajax-view-lyrics/id/{song_id}')
+                routes[route_key(url)] = (lambda size, song=song:
+                                          _render_metalarchives(song, size))
+            elif name == 'lyricscom':
+                artists.setdefault(key, []).append((song_id, song))
+            else:
+                render = _RENDERERS[name]
+                routes[key] = (lambda size, song=song, render=render:
+                               render(song, size))
+
+    for key, album in albums.items():
+        routes[key] = (lambda size, album=album:
+                       _render_darklyrics(album, size))
+
+    for artist_id, (key, entries) in enumerate(artists.items()):
+        song_ids, artist_songs = zip(*entries)
+        routes[key] = (lambda size, song=artist_songs[0], artist_id=artist_id:
+                       _render_lyricscom_search(song, artist_id, size))
+        url = f'https://www.lyrics.com/artist/id/{artist_id}'
+        routes[route_key(url)] = (
+            lambda size, songs=artist_songs, song_ids=song_ids:
+            _render_lyricscom_artist(songs, song_ids, size))
+        for song_id, song in entries:
+            url = f'https://www.lyrics.com/lyric/{song_id}'
+            routes[route_key(url)] = (lambda size, song=song:
+                                      _render_lyricscom(song, size))
+    return routes
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Replies to every request with the page of its route, after the delay
+    chosen by the server.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        host = self.headers.get('Host', '')
+        status, headers, body = self.server.respond(host, self.path)
+        body = body.encode()
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server that stands in for every website, serving the pages of the
+    songs in a library.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, songs, options=SiteOptions(), address=('127.0.0.1', 0)):
+        if options.distribution not in DISTRIBUTIONS:
+            raise ValueError(f'Unknown distribution {options.distribution}')
+        super().__init__(address, StandInHandler)
+        self.options = options
+        self.routes = build_routes(songs, options.miss_rate, options.seed)
+        self.random = random.Random(options.seed)
+        self.lock = threading.Lock()
+        # Maps every host to its available tokens and the time they were
+        # last updated
+        self.buckets = {}
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def handle_error(self, request, client_address):
+        # Clients close their connections early when they only need the
+        # beginning of a page
+        pass
+
+    def delay(self):
+        """
+        Returns a random delay for a response, from the distribution set in
+        the options.
+        """
+        mean = self.options.latency
+        if mean <= 0:
+            return 0
+        distribution = self.options.distribution
+        with self.lock:
+            if distribution == 'uniform':
+                return self.random.uniform(0, 2 * mean)
+            elif distribution == 'exponential':
+                return self.random.expovariate(1 / mean)
+            elif distribution == 'lognormal':
+                # Same mean, with a long tail
+                sigma = 1
+                mu = math.log(mean) - sigma ** 2 / 2
+                return self.random.lognormvariate(mu, sigma)
+        return mean
+
+    def throttled(self, host):
+        """
+        Returns a boolean indicating whether a request to `host` goes over
+        the rate set in the options.
+        """
+        rate = self.options.throttle
+        if not rate:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(host, (max(rate, 1), now))
+            tokens = min(tokens + (now - updated) * rate, max(rate, 1))
+            allowed = tokens >= 1
+            self.buckets[host] = (tokens - allowed, now)
+        return not allowed
+
+    def respond(self, host, path):
+        """
+        Returns the status, headers and body of the response to a request.
+        """
+        time.sleep(self.delay())
+        if self.throttled(host):
+            return 429, {'Retry-After': '1'}, 'Too many requests'
+        with self.lock:
+            failed = self.random.random() < self.options.error_rate
+        if failed:
+            return 503, {}, 'Service unavailable'
+
+        render = self.routes.get((host, path))
+        if render is None:
+            return 404, {}, 'Not found'
+        return 200, {}, render(self.options.page_size)
+
+
+def _serve(songs, options, conn):
+    server = StandInServer(songs, options)
+    conn.send(server.url)
+    conn.close()
+    server.serve_forever()
+
+
+@contextmanager
+def serve(songs, options=SiteOptions()):
+    """
+    Run a StandInServer for `songs` in a separate process, so it doesn't
+    compete with the code being measured, and return its url.
+    """
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve,
+                                      args=(songs, options, child),
+                                      daemon=True)
+    process.start()
+    try:
+        yield parent.recv()
+    finally:
+        process.terminate()
+        process.join()
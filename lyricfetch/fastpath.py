@@ -0,0 +1,84 @@
+"""
+Fast-path extractors that get the lyrics straight from the bytes of a
+response, for the websites with a stable enough markup.
+
+Every extractor returns the same text the BeautifulSoup version of its source
+would, or None if the page doesn't look like expected, in which case the
+caller should fall back to the full parse.
+"""
+import re
+from html import unescape
+
+COMMENT_RE = re.compile(r'<!--.*?-->', re.S)
+BR_RE = re.compile(r'<br\s*/?>', re.I)
+TAG_RE = re.compile(r'<[^>]*>')
+
+VAGALUME_RE = re.compile(rb'<div id=["\']?lyrics["\'\s>][^>]*>(.*?)</div>',
+                         re.S | re.I)
+LETRAS_TITLE_RE = re.compile(rb'<div class=["\']cnt-head_title["\'][^>]*>\s*'
+                             rb'<h1[^>]*>(.*?)</h1>', re.S | re.I)
+LETRAS_ARTICLE_RE = re.compile(rb'<article[^>]*>(.*?)</article>', re.S | re.I)
+PARAGRAPH_RE = re.compile(r'<p\b[^>]*>(.*?)</p>', re.S | re.I)
+# Signs of markup that the simple extractors can't handle
+UNSAFE_RE = re.compile(rb'<(div|script|style|html|body|textarea|pre|'
+                       rb'!\[CDATA)\b', re.I)
+
+
+def decode(body):
+    """
+    Decode a response body the same way BeautifulSoup would.
+    """
+    return body.decode('utf-8', 'replace')
+
+
+def get_text(html, br=None):
+    """
+    Returns the text of an html fragment, like BeautifulSoup's `get_text()`.
+    If `br` is set, line breaks are replaced with it.
+    """
+    html = COMMENT_RE.sub('', html)
+    if br is not None:
+        html = BR_RE.sub(br, html)
+    return unescape(TAG_RE.sub('', html))
+
+
+def vagalume(body, song):
+    """
+    Returns the lyrics in a vagalume.com.br page.
+    """
+    match = VAGALUME_RE.search(body)
+    if match is None or UNSAFE_RE.search(match.group(1)):
+        return None
+    return get_text(decode(match.group(1)), br='\n').strip()
+
+
+def letras(body, song):
+    """
+    Returns the lyrics in a letras.com page.
+    """
+    title = LETRAS_TITLE_RE.search(body)
+    article = LETRAS_ARTICLE_RE.search(body)
+    if title is None or article is None or \
+            UNSAFE_RE.search(title.group(1) + article.group(1)):
+        return None
+
+    found_title = get_text(decode(title.group(1)))
+    found_title = re.sub(r'[\W_]+', '', found_title.lower())
+    if found_title != re.sub(r'[\W_]+', '', song.title.lower()):
+        # The site took us to the wrong song page
+        return ''
+
+    text = ''
+    for paragraph in PARAGRAPH_RE.findall(decode(article.group(1))):
+        text += get_text(paragraph, br='\n') + '\n\n'
+    return text.strip()
+
+
+def metalarchives(body, song):
+    """
+    Returns the lyrics in a response from metal-archives' lyrics endpoint,
+    which is just a fragment of html.
+    """
+    if UNSAFE_RE.search(body):
+        return None
+    return get_text(decode(body)).strip()
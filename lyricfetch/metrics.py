@@ -0,0 +1,65 @@
+"""
+Lightweight counters shared by the transport layer and the search functions.
+
+Counters are always attributed to the source that is being scraped by the
+current thread (or to None if there is no such source), so they can later be
+aggregated per website in the `Stats` object.
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+_local = threading.local()
+_lock = threading.Lock()
+
+# Process-wide counters, accumulated since the module was imported
+totals = Counter()
+
+
+def current_source():
+    """
+    Returns the name of the source being scraped by the current thread, or
+    None if there isn't one.
+    """
+    return getattr(_local, 'source', None)
+
+
+@contextmanager
+def track(source=None, counters=None):
+    """
+    Attribute every counter incremented inside this context (and in this
+    thread) to `source`, which can be a scraping function or its name.
+
+    If a `counters` object is passed, the increments will also be added to it,
+    so callers can collect the counters of a single search.
+    """
+    if callable(source):
+        source = source.__name__
+    previous = (current_source(), getattr(_local, 'counters', None))
+    _local.source = source
+    if counters is not None:
+        _local.counters = counters
+    try:
+        yield counters
+    finally:
+        _local.source, _local.counters = previous
+
+
+def incr(name, value=1):
+    """
+    Increment the counter `name` of the current source by `value`.
+    """
+    key = (current_source(), name)
+    counters = getattr(_local, 'counters', None)
+    with _lock:
+        totals[key] += value
+        if counters is not None:
+            counters[key] += value
+
+
+def reset():
+    """
+    Clear the process-wide counters.
+    """
+    with _lock:
+        totals.clear()
@@ -0,0 +1,105 @@
+"""
+Process pool to parse the downloaded pages outside of the threads that
+download them.
+
+When searching for a single song, every source runs in its own thread, but
+BeautifulSoup is pure python, so all the parsing ends up serialized on the GIL.
+With this pool enabled, the threads only send requests and hand the response
+bodies to a few worker processes, which run the extract steps of the sources
+and send back the results.
+"""
+import atexit
+import multiprocessing
+import threading
+import time
+from collections import Counter
+
+from . import CONFIG
+from . import logger
+from . import metrics
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker(config):
+    """
+    Initializer for every process in the pool.
+    """
+    CONFIG.update(config)
+
+
+def _run_extract(extract, body, song, source):
+    """
+    Run an extract step in a worker process, and return its result along with
+    the counters incremented while running it.
+    """
+    counters = Counter()
+    with metrics.track(source, counters):
+        result = extract(body, song)
+    return result, counters
+
+
+def start():
+    """
+    Start the pool with the number of processes set in
+    `CONFIG['parse_workers']`, if it's not running already. Returns the pool,
+    or None if it's disabled.
+
+    Processes in the pool launched by `run_mp` can't have children of their
+    own, so the pool is always disabled in them.
+    """
+    global _pool
+    workers = int(CONFIG['parse_workers'])
+    if workers <= 0 or multiprocessing.current_process().daemon:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            # Forking a process with several threads running is unsafe
+            methods = multiprocessing.get_all_start_methods()
+            method = 'forkserver' if 'forkserver' in methods else 'spawn'
+            context = multiprocessing.get_context(method)
+            logger.debug('Starting a pool of %d parsing processes', workers)
+            _pool = context.Pool(workers, initializer=_init_worker,
+                                 initargs=(dict(CONFIG),))
+        return _pool
+
+
+def stop():
+    """
+    Stop the pool, after the pages that are already being parsed are done.
+    Terminating it instead would leave the threads waiting for them blocked
+    forever.
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+atexit.register(stop)
+
+
+def extract(request, body, song):
+    """
+    Run the extract step of `request` on the response `body`, in the pool if
+    it's running or in the current thread otherwise, and return its result.
+
+    The time spent (including the transfer to and from the pool) is added to
+    the `parse_ms` counter, so both modes can be compared.
+    """
+    start_time = time.time()
+    with _pool_lock:
+        pool = _pool
+    if pool is None:
+        result = request.extract(body, song)
+    else:
+        args = (request.extract, body, song, metrics.current_source())
+        result, counters = pool.apply(_run_extract, args)
+        for (_, name), value in counters.items():
+            metrics.incr(name, value)
+    metrics.incr('parse_ms', round((time.time() - start_time) * 1000))
+    return result
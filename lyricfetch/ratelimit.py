@@ -0,0 +1,161 @@
+"""
+Per-host rate limiting shared by every thread and process of an execution.
+
+Each host gets a token bucket that refills at a configurable rate, and a
+counter of the requests currently in flight. All of them are stored in shared
+memory, so the processes launched by `run_mp` can coordinate and the total
+number of requests sent to a website doesn't grow with the number of jobs.
+"""
+import multiprocessing
+import threading
+import time
+import zlib
+
+from . import CONFIG
+
+# Maximum time to sleep before checking again if a request can be sent
+POLL_INTERVAL = 0.05
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limits(host):
+    """
+    Returns the rate (in requests per second) and burst size configured for
+    `host`. A rate of 0 means no limit.
+    """
+    limits = CONFIG['rate_limits']
+    rate, burst = limits.get(host, limits.get('default', (0, 0)))
+    return float(rate), max(float(burst), 1)
+
+
+class RateLimiter:
+    """
+    A set of token buckets for up to `slots` different hosts, kept in shared
+    memory. Hosts beyond that number are not limited.
+    """
+    # Fields stored for every host in the `state` array
+    TOKENS, UPDATED, ACTIVE = range(3)
+
+    def __init__(self, slots=64):
+        self.slots = slots
+        self.lock = multiprocessing.Lock()
+        self.hosts = multiprocessing.Array('q', slots, lock=False)
+        self.state = multiprocessing.Array('d', slots * 3, lock=False)
+
+    def _find_slot(self, host, burst):
+        """
+        Returns the index of the slot assigned to `host`, assigning a new one
+        if needed, or None if there are no free slots left. Must be called
+        while holding the lock.
+        """
+        host_hash = zlib.crc32(host.encode()) + 1
+        for slot in range(self.slots):
+            if self.hosts[slot] == host_hash:
+                return slot
+            if self.hosts[slot] == 0:
+                self.hosts[slot] = host_hash
+                base = slot * 3
+                self.state[base + self.TOKENS] = burst
+                self.state[base + self.UPDATED] = time.time()
+                self.state[base + self.ACTIVE] = 0
+                return slot
+        return None
+
+    def try_acquire(self, host, rate, burst, max_active):
+        """
+        Try to take a token from the bucket of `host`.
+
+        Returns a tuple with a boolean indicating whether the request can be
+        sent, the slot of the host (which must be passed to `release()`) and
+        the number of seconds to wait before trying again.
+        """
+        with self.lock:
+            slot = self._find_slot(host, burst)
+            if slot is None:
+                return True, None, 0
+
+            base = slot * 3
+            now = time.time()
+            tokens = self.state[base + self.TOKENS]
+            if rate:
+                elapsed = now - self.state[base + self.UPDATED]
+                tokens = min(burst, tokens + elapsed * rate)
+            else:
+                tokens = burst
+            self.state[base + self.TOKENS] = tokens
+            self.state[base + self.UPDATED] = now
+
+            if self.state[base + self.ACTIVE] >= max_active:
+                return False, slot, POLL_INTERVAL
+            if tokens < 1:
+                return False, slot, (1 - tokens) / rate
+
+            self.state[base + self.TOKENS] = tokens - 1
+            self.state[base + self.ACTIVE] += 1
+            return True, slot, 0
+
+    def release(self, slot):
+        """
+        Register that a request acquired through `try_acquire()` has finished.
+        """
+        if slot is None:
+            return
+        with self.lock:
+            base = slot * 3
+            self.state[base + self.ACTIVE] = max(
+                self.state[base + self.ACTIVE] - 1, 0)
+
+
+def get_limiter():
+    """
+    Returns the rate limiter of this execution, creating it if needed.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
+
+
+def set_limiter(limiter):
+    """
+    Use `limiter` as the rate limiter of this process. Child processes should
+    call this with the limiter created by their parent.
+    """
+    global _limiter
+    with _limiter_lock:
+        _limiter = limiter
+
+
+def acquire(host, timeout=None):
+    """
+    Block until a request to `host` can be sent without going over its rate
+    limit or its maximum number of concurrent connections.
+
+    Returns the slot that must be passed to `release()` when the request has
+    finished and the number of seconds spent waiting, or raises TimeoutError
+    if that would take longer than `timeout` seconds.
+    """
+    rate, burst = get_limits(host)
+    max_active = int(CONFIG['max_host_connections']) or float('inf')
+    limiter = get_limiter()
+    start = time.time()
+    waited = 0
+    while True:
+        allowed, slot, wait = limiter.try_acquire(host, rate, burst,
+                                                  max_active)
+        if allowed:
+            return slot, waited
+        if timeout is not None and waited + wait > timeout:
+            raise TimeoutError(f'Rate limit for {host} exceeded')
+        time.sleep(min(wait, POLL_INTERVAL))
+        waited = time.time() - start
+
+
+def release(slot):
+    """
+    Register that a request acquired through `acquire()` has finished.
+    """
+    get_limiter().release(slot)
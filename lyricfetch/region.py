@@ -0,0 +1,130 @@
+"""
+Regions of a page needed by the scraping functions.
+
+Most sources only need a single element of the pages they download, like the
+div with the lyrics. Declaring it as a Region lets the transport stop reading
+the response as soon as that element has been closed, and lets `get_url`
+parse only that part of the page.
+"""
+import re
+
+from bs4 import SoupStrainer
+
+
+class RegionScanner:
+    """
+    Finds the start and end offsets of a region in a response body that is
+    received in chunks.
+    """
+    def __init__(self, region):
+        self.region = region
+        self.buffer = bytearray()
+        # Offset where the next search should start
+        self.pos = 0
+        self.start = None
+        self.end = None
+        self.depth = 0
+        self.tags = None
+
+    @property
+    def done(self):
+        return self.end is not None
+
+    def _skip_scanned(self, pos):
+        """
+        Move the search position to `pos`, or to the last incomplete tag after
+        it, so that it's searched again when more data arrives.
+        """
+        partial = self.buffer.rfind(b'<', pos)
+        self.pos = partial if partial != -1 else len(self.buffer)
+
+    def feed(self, chunk):
+        """
+        Add a new chunk of the body and return a boolean indicating whether
+        the end of the region has already been received.
+        """
+        if self.done:
+            return True
+        self.buffer += chunk
+
+        if self.start is None:
+            match = self.region.pattern.search(self.buffer, self.pos)
+            if match is None:
+                self._skip_scanned(self.pos)
+                return False
+            self.start = match.start()
+            self.depth = 0
+            self.pos = self.start
+            tag = re.escape(match.group(1))
+            self.tags = re.compile(rb'<(/?)' + tag + rb'\b[^>]*?(/?)>', re.I)
+
+        pos = self.pos
+        for match in self.tags.finditer(self.buffer, self.pos):
+            pos = match.end()
+            if match.group(1):
+                self.depth -= 1
+            elif not match.group(2):
+                self.depth += 1
+            if self.depth <= 0:
+                self.end = pos
+                return True
+        self._skip_scanned(pos)
+        return False
+
+
+class Region:
+    """
+    A single element of a page, identified by its tag name and either its id
+    or one of its classes.
+    """
+    def __init__(self, name=None, id=None, class_=None):
+        if id is None and class_ is None:
+            raise ValueError('A region needs an id or a class')
+        self.name = name
+        self.id = id
+        self.class_ = class_
+
+        tag = re.escape(name).encode() if name else rb'[a-zA-Z][\w-]*'
+        if id is not None:
+            attr = rb'\bid\s*=\s*["\']?' + re.escape(id).encode() + \
+                rb'(?=["\'\s/>])'
+        else:
+            attr = rb'\bclass\s*=\s*["\'](?:[^"\'>]*\s)?' + \
+                re.escape(class_).encode() + rb'(?=["\'\s])'
+        self.pattern = re.compile(rb'<(' + tag + rb')\b[^>]*?' + attr, re.I)
+
+    def __str__(self):
+        text = self.name or ''
+        if self.id is not None:
+            return f'{text}#{self.id}'
+        return f'{text}.{self.class_}'
+
+    def __repr__(self):
+        return f'Region({self})'
+
+    def scanner(self):
+        """
+        Returns a new RegionScanner to find this region in a response body.
+        """
+        return RegionScanner(self)
+
+    def strainer(self):
+        """
+        Returns a SoupStrainer to parse only this region of a page.
+        """
+        if self.id is not None:
+            attrs = {'id': self.id}
+        else:
+            attrs = {'class': self.class_}
+        return SoupStrainer(self.name, attrs=attrs)
+
+    def extract(self, body):
+        """
+        Returns the part of `body` that contains the region, or the whole body
+        if it can't be found.
+        """
+        scanner = self.scanner()
+        scanner.feed(body)
+        if scanner.start is None:
+            return body
+        return body[scanner.start:scanner.end]
@@ -0,0 +1,150 @@
+"""
+Record and replay of the responses received by the transport.
+
+When `CONFIG['record']` is set to the path of an archive, every response is
+stored in it along with the time it took to arrive, and when
+`CONFIG['replay']` is set, the responses are served back from the archive
+without any network access. This way an execution can be reproduced offline,
+and changes to the scheduling or the parsers can be compared on the exact
+same inputs.
+"""
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+from pathlib import Path
+from urllib.error import URLError
+
+from urllib3._collections import HTTPHeaderDict
+
+from . import CONFIG
+from . import logger
+from . import metrics
+from .database import Database
+
+Recording = namedtuple('Recording', 'url status headers body history elapsed')
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+class NotRecorded(URLError):
+    """
+    Raised when replaying a request that is not in the archive.
+    """
+    def __init__(self, url):
+        super().__init__(f'No recorded response for {url}')
+
+
+class Archive(Database):
+    """
+    Stores the compressed responses received for every url, indexed by the url
+    and the region of the page that was requested.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            headers TEXT NOT NULL,
+            body BLOB NOT NULL,
+            history TEXT NOT NULL,
+            elapsed REAL NOT NULL
+        );
+    """
+
+    @staticmethod
+    def make_key(url, region=None):
+        """
+        Returns the key of the responses for `url`. Truncated bodies are stored
+        separately for every region, like in the response cache.
+        """
+        if region is None:
+            return url
+        return f'{region}:{url}'
+
+    def add(self, url, region, response, elapsed):
+        """
+        Store the `response` received for `url` after `elapsed` seconds.
+        """
+        row = (self.make_key(url, region), response.url, response.status,
+               json.dumps(list(response.headers.items())),
+               zlib.compress(response.body), json.dumps(response.history),
+               elapsed)
+        with self.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO responses VALUES '
+                         '(?, ?, ?, ?, ?, ?, ?)', row)
+
+    def get(self, url, region=None):
+        """
+        Returns the Recording stored for `url`, or None if there isn't one.
+        """
+        rows = self.execute('SELECT url, status, headers, body, history, '
+                            'elapsed FROM responses WHERE key = ?',
+                            (self.make_key(url, region),))
+        if not rows:
+            return None
+        final_url, status, headers, body, history, elapsed = rows[0]
+        headers = HTTPHeaderDict(json.loads(headers))
+        history = tuple(map(tuple, json.loads(history)))
+        return Recording(final_url, status, headers, zlib.decompress(body),
+                         history, elapsed)
+
+
+def get_archive():
+    """
+    Returns the archive that responses are recorded to or replayed from, or
+    None if neither is enabled in CONFIG.
+    """
+    global _archive
+    path = CONFIG['replay'] or CONFIG['record']
+    if not path:
+        return None
+    with _archive_lock:
+        if _archive is None or _archive.path != Path(path):
+            _archive = Archive(path)
+        return _archive
+
+
+def reset():
+    """
+    Close the archive.
+    """
+    global _archive
+    with _archive_lock:
+        if _archive is not None:
+            _archive.close()
+        _archive = None
+
+
+def record(url, region, response, elapsed):
+    """
+    Store the `response` received for `url` if recording is enabled.
+    """
+    if not CONFIG['record'] or CONFIG['replay']:
+        return
+    try:
+        get_archive().add(url, region, response, elapsed)
+        metrics.incr('recorded')
+    except sqlite3.Error as error:
+        logger.warning('Could not record the response from %s: %s', url,
+                       error)
+
+
+def replay(url, region=None):
+    """
+    Returns the Recording of the response for `url` in the archive, after
+    waiting as long as the original request took if `CONFIG['replay_timing']`
+    is set. Raises NotRecorded if it's not in the archive.
+    """
+    recording = get_archive().get(url, region)
+    if recording is None:
+        metrics.incr('replay_misses')
+        raise NotRecorded(url)
+
+    metrics.incr('replayed')
+    if CONFIG['replay_timing']:
+        time.sleep(recording.elapsed)
+    return recording
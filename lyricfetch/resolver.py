@@ -0,0 +1,86 @@
+"""
+In-process cache for DNS lookups.
+
+Every connection opened by the transport resolves its host through this
+module, so a website is only looked up once every few minutes instead of once
+per connection. The hosts of the scraping functions can also be resolved in
+parallel before the first search starts.
+"""
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from . import CONFIG
+from . import logger
+from . import metrics
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _lookup(host, port, family):
+    """
+    Resolve `host` and returns the list of addresses (without duplicates)
+    that can be used to open a TCP connection to it.
+    """
+    addresses = []
+    for res in socket.getaddrinfo(host, port, family, socket.SOCK_STREAM):
+        address = res[4][0]
+        if address not in addresses:
+            addresses.append(address)
+    return addresses
+
+
+def resolve(host, port=443, family=socket.AF_UNSPEC):
+    """
+    Returns the list of addresses of `host`, from the cache if they were
+    resolved less than `CONFIG['dns_ttl']` seconds ago.
+
+    The system resolver doesn't expose the TTL of the records it returns, so
+    the same configurable TTL is used for every host. Failed lookups are never
+    cached.
+    """
+    key = (host, family)
+    ttl = float(CONFIG['dns_ttl'])
+    with _cache_lock:
+        entry = _cache.get(key)
+    if entry is not None and time.time() < entry[0]:
+        metrics.incr('dns_hits')
+        return entry[1]
+
+    metrics.incr('dns_lookups')
+    addresses = _lookup(host, port, family)
+    if ttl > 0:
+        with _cache_lock:
+            _cache[key] = (time.time() + ttl, addresses)
+    return addresses
+
+
+def prefetch(hosts, timeout=None):
+    """
+    Resolve every host in `hosts` in parallel, waiting at most `timeout`
+    seconds for all of them to finish. Errors are logged and ignored.
+    """
+    hosts = list(dict.fromkeys(hosts))
+    if not hosts or float(CONFIG['dns_ttl']) <= 0:
+        return
+
+    def lookup(host):
+        try:
+            resolve(host)
+        except OSError as error:
+            logger.debug('Could not resolve %s: %s', host, error)
+
+    executor = ThreadPoolExecutor(max_workers=len(hosts))
+    wait([executor.submit(lookup, host) for host in hosts], timeout=timeout)
+    # Don't wait for slow lookups, they will still populate the cache
+    executor.shutdown(wait=False)
+
+
+def reset():
+    """
+    Forget every cached address.
+    """
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,143 @@
+"""
+Retry policy for failed requests.
+
+Requests that fail with a transient error (like a 429 or 503 status, or a
+dropped connection) are retried after an exponential backoff with random
+jitter, or after the time requested by the server in its Retry-After header.
+
+To keep retries from snowballing when a website is overloaded, they are
+limited by a budget shared by all the processes of an execution: only a
+fraction of the total number of requests sent can be retries.
+"""
+import multiprocessing
+import random
+import socket
+import ssl
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.error import HTTPError
+
+import urllib3
+
+from . import CONFIG
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+class RetryBudget:
+    """
+    Counts the requests and retries of an execution in shared memory, and
+    allows a new retry only while they stay under `ratio` times the number of
+    requests, plus a fixed `minimum`.
+    """
+    def __init__(self):
+        self.lock = multiprocessing.Lock()
+        self.requests = multiprocessing.Value('q', 0, lock=False)
+        self.retries = multiprocessing.Value('q', 0, lock=False)
+
+    def add_request(self):
+        """
+        Register that a new request has been sent.
+        """
+        with self.lock:
+            self.requests.value += 1
+
+    def withdraw(self, ratio, minimum):
+        """
+        Try to take a retry from the budget and return a boolean indicating
+        whether it was allowed.
+        """
+        with self.lock:
+            if self.retries.value >= minimum + ratio * self.requests.value:
+                return False
+            self.retries.value += 1
+            return True
+
+
+def get_budget():
+    """
+    Returns the retry budget of this execution, creating it if needed.
+    """
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = RetryBudget()
+        return _budget
+
+
+def set_budget(budget):
+    """
+    Use `budget` as the retry budget of this process. Child processes should
+    call this with the budget created by their parent.
+    """
+    global _budget
+    with _budget_lock:
+        _budget = budget
+
+
+def parse_retry_after(value):
+    """
+    Returns the number of seconds requested in a Retry-After header, which can
+    be either a number of seconds or an HTTP date, or None if it's invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    """
+    Returns a boolean indicating whether the request that raised `error` can
+    be retried.
+    """
+    if isinstance(error, HTTPError):
+        return error.code in CONFIG['retries']['statuses']
+
+    # A failed TLS handshake (even after the fallback to older versions) or a
+    # host that can't be resolved won't be any different in a few seconds
+    reason = getattr(error, 'reason', error)
+    if isinstance(reason, (ssl.SSLError, urllib3.exceptions.SSLError)):
+        return False
+    if isinstance(reason, socket.gaierror) or \
+            isinstance(getattr(reason, '__cause__', None), socket.gaierror):
+        return False
+    return True
+
+
+def get_delay(error, attempt):
+    """
+    Returns the number of seconds to wait before retrying a request that
+    failed with `error` after `attempt` retries, or None if it should not be
+    retried.
+    """
+    policy = CONFIG['retries']
+    if attempt >= int(policy['total']) or not is_retryable(error):
+        return None
+
+    max_backoff = float(policy['max_backoff'])
+    if isinstance(error, HTTPError) and error.headers is not None:
+        retry_after = parse_retry_after(error.headers.get('Retry-After'))
+        if retry_after is not None:
+            return retry_after if retry_after <= max_backoff else None
+
+    backoff = min(float(policy['backoff']) * 2 ** attempt, max_backoff)
+    return random.uniform(0, backoff)
+
+
+def allow_retry():
+    """
+    Returns a boolean indicating whether the retry budget allows one more
+    retry.
+    """
+    policy = CONFIG['retries']
+    return get_budget().withdraw(float(policy['budget_ratio']),
+                                 int(policy['budget_min']))
@@ -5,6 +5,9 @@ import os
 import time
 import math
 import threading
+from collections import Counter
+from contextlib import contextmanager
+from queue import Empty
 from queue import Queue
 
 from urllib.error import URLError, HTTPError
@@ -14,33 +17,48 @@ from multiprocessing import Pool
 import eyed3
 
 from . import CONFIG
+from . import breaker
+from . import cache
+from . import documents
 from . import logger
+from . import metrics
+from . import parsepool
+from . import ratelimit
+from . import resolver
+from . import retry
 from . import sources
+from . import transport
 from .scraping import id_source
+from .scraping import source_hosts
+from .scraping import source_origins
 from .stats import Stats
 
+# Thread opening the connections to the first sources, see `start_warmup()`
+_warmup = None
+
 
 class LyrThread(threading.Thread):
     """
     Threaded object to search for lyrics.
+
+    Threads are daemonic, so the ones that are still running once the lyrics
+    have been found don't keep the program from exiting.
     """
-    def __init__(self, source, song, queue):
-        super().__init__()
+    def __init__(self, source, song, queue, counters=None, deadline=None,
+                 token=None):
+        super().__init__(daemon=True)
         self.source = source
         self.song = song
         self.queue = queue
+        self.counters = counters
+        # Timestamp after which no more requests should be sent
+        self.deadline = deadline
+        # CancelToken that stops the search when it's cancelled
+        self.token = token
 
     def run(self):
-        start = time.time()
-        try:
-            lyrics = self.source(self.song)
-        except (HTTPError, HTTPException, URLError, ConnectionError):
-            lyrics = ''
-
-        res = dict(runtime=time.time() - start,
-                   lyrics=lyrics,
-                   source=self.source)
-        self.queue.put(res)
+        self.queue.put(scrape(self.source, self.song, self.counters,
+                              self.deadline, self.token))
 
 
 class Result:
@@ -48,7 +66,7 @@ class Result:
     Contains the results generated from run, so they can be returned as a
     single variable.
     """
-    def __init__(self, song, source=None, runtimes=None):
+    def __init__(self, song, source=None, runtimes=None, counters=None):
         self.song = song
 
         # The source where the lyrics were found (or None if they weren't)
@@ -61,6 +79,110 @@ class Result:
         else:
             self.runtimes = runtimes
 
+        # The counters collected during the search (see the metrics module),
+        # indexed by (source name, counter name)
+        if counters is None:
+            self.counters = Counter()
+        else:
+            self.counters = counters
+
+
+def allow_source(source, counters=None):
+    """
+    Returns whether the circuit breaker of `source` lets it be searched,
+    counting the searches skipped.
+    """
+    with metrics.track(source, counters):
+        if breaker.get_breaker(source).allow():
+            return True
+        metrics.incr('breaker_skipped')
+        return False
+
+
+@contextmanager
+def record_outcome(source, res, counters=None):
+    """
+    Time the search in `source` run inside this context and keep its circuit
+    breaker up to date with the outcome, adding its transitions to
+    `counters`. The runtime and whether it failed are stored in the `res`
+    dictionary, and network errors are not raised. Pages that don't exist are
+    not errors, only a miss.
+    """
+    circuit = breaker.get_breaker(source)
+    start = time.time()
+    failed = timeout = cancelled = recorded = False
+    try:
+        try:
+            yield res
+        except (HTTPError, HTTPException, URLError, ConnectionError) as error:
+            # A page that doesn't exist is just a miss
+            if not breaker.is_miss(error):
+                res['error'] = True
+                failed = breaker.is_failure(error)
+                timeout = transport.is_timeout(error)
+                cancelled = isinstance(error, (transport.DeadlineExceeded,
+                                               transport.Cancelled))
+        res['runtime'] = time.time() - start
+
+        # Running out of time for this song (or being cancelled because
+        # another source found the lyrics) is not the website's fault
+        if not cancelled:
+            with metrics.track(source, counters):
+                circuit.record(res['runtime'], failed and not timeout,
+                               timeout)
+            recorded = True
+    finally:
+        # Includes any other exception, like the task of the async engine
+        # being cancelled
+        if not recorded:
+            circuit.release()
+
+
+def scrape(source, song, counters=None, deadline=None, token=None):
+    """
+    Search for the lyrics of `song` in a single source, unless its circuit
+    breaker is open, and keep the breaker up to date with the outcome. The
+    search stops early if the cancel `token` is cancelled.
+
+    Returns a dictionary with the source, the lyrics found (or an empty
+    string), the time taken and two booleans indicating whether the source
+    failed with an error or was skipped altogether.
+    """
+    res = dict(runtime=0, lyrics='', source=source, error=False,
+               skipped=False)
+    if not allow_source(source, counters):
+        res['skipped'] = True
+        return res
+
+    with metrics.track(source, counters), \
+            record_outcome(source, res, counters), \
+            transport.deadline(until=deadline), transport.cancellation(token):
+        res['lyrics'] = source(song)
+    return res
+
+
+def source_key(source):
+    """
+    Returns the identifier of a source in the negative results cache.
+    """
+    return id_source(source) or source.__name__
+
+
+def skip_known_misses(song, l_sources, counters):
+    """
+    Returns the list of sources that are not known to be missing the lyrics
+    for `song`, and counts the ones that were skipped.
+    """
+    misses = cache.known_misses(song, [source_key(s) for s in l_sources])
+    remaining = []
+    for source in l_sources:
+        if source_key(source) in misses:
+            with metrics.track(source, counters):
+                metrics.incr('negative_cache_hits')
+        else:
+            remaining.append(source)
+    return remaining
+
 
 def exclude_sources(exclude, section=False):
     """
@@ -90,6 +212,20 @@ def exclude_sources(exclude, section=False):
     return newlist
 
 
+def cancel_search(token, running, counters):
+    """
+    Cancel the sources in `running` once the lyrics have been found, and count
+    the requests they had sent as wasted.
+    """
+    token.cancel()
+    for source in running:
+        with metrics.track(source, counters):
+            metrics.incr('cancelled')
+            wasted = counters[source.__name__, 'requests']
+            if wasted:
+                metrics.incr('wasted_requests', wasted)
+
+
 def get_lyrics(song, l_sources=None):
     """
     Searches for lyrics of a single song and returns a Result object with the
@@ -106,18 +242,30 @@ def get_lyrics(song, l_sources=None):
         return None
 
     runtimes = {}
+    counters = Counter()
     source = None
-    for l_source in l_sources:
-        start = time.time()
-        try:
-            lyrics = l_source(song)
-        except (HTTPError, HTTPException, URLError, ConnectionError):
-            lyrics = ''
-
-        runtimes[l_source] = time.time() - start
-        if lyrics != '':
-            source = l_source
-            break
+    lyrics = ''
+    missed = []
+    l_sources = skip_known_misses(song, l_sources, counters)
+    with transport.deadline(CONFIG['deadline']):
+        for l_source in l_sources:
+            left = transport.time_left()
+            if left is not None and left <= 0:
+                logger.debug('Ran out of time searching lyrics for %s', song)
+                break
+
+            res = scrape(l_source, song, counters)
+            if res['skipped']:
+                continue
+
+            lyrics = res['lyrics']
+            runtimes[l_source] = res['runtime']
+            if lyrics != '':
+                source = l_source
+                break
+            if not res['error']:
+                missed.append(source_key(l_source))
+    cache.add_misses(song, missed)
 
     if lyrics != '':
         logger.info('++ %s: Found lyrics for %s\n', source.__name__, song)
@@ -126,7 +274,7 @@ def get_lyrics(song, l_sources=None):
         logger.info("Couldn't find lyrics for %s\n", song)
         source = None
 
-    return Result(song, source, runtimes)
+    return Result(song, source, runtimes, counters)
 
 
 def get_lyrics_threaded(song, l_sources=None):
@@ -144,16 +292,38 @@ def get_lyrics_threaded(song, l_sources=None):
         return None
 
     runtimes = {}
+    counters = Counter()
+    missed = []
+    l_sources = skip_known_misses(song, l_sources, counters)
+    if not l_sources:
+        return Result(song, None, runtimes, counters)
+
+    # The threads will hand the pages to this pool for parsing, if enabled
+    parsepool.start()
     queue = Queue()
-    pool = [LyrThread(source, song, queue) for source in l_sources]
+    token = transport.CancelToken()
+    deadline = None
+    if CONFIG['deadline']:
+        deadline = time.time() + float(CONFIG['deadline'])
+    pool = [LyrThread(source, song, queue, counters, deadline, token)
+            for source in l_sources]
     for thread in pool:
         thread.start()
 
+    running = list(l_sources)
     for _ in range(len(pool)):
         result = queue.get()
+        running.remove(result['source'])
+        if result['skipped']:
+            continue
         runtimes[result['source']] = result['runtime']
         if result['lyrics']:
+            # Don't wait for the rest
+            cancel_search(token, running, counters)
             break
+        if not result['error']:
+            missed.append(source_key(result['source']))
+    cache.add_misses(song, missed)
 
     if result['lyrics']:
         song.lyrics = result['lyrics']
@@ -161,7 +331,104 @@ def get_lyrics_threaded(song, l_sources=None):
     else:
         source = None
 
-    return Result(song, source, runtimes)
+    return Result(song, source, runtimes, counters)
+
+
+def hedge_delay(source):
+    """
+    Returns the number of seconds a hedged search should wait for `source`
+    before starting the next one: the percentile of its recent search times
+    set in `CONFIG['hedge']`, or a fixed delay until there are enough of them.
+    """
+    hedge = CONFIG['hedge']
+    delay = breaker.get_breaker(source).latency_percentile(
+        float(hedge['percentile']))
+    if delay is None:
+        return float(hedge['delay'])
+    return delay
+
+
+def get_lyrics_hedged(song, l_sources=None):
+    """
+    Searches for the lyrics of a single song in one source after another, like
+    `get_lyrics`, but if a source takes longer than usual to answer (see
+    `hedge_delay()`), the next one is started without waiting for it. Up to
+    `CONFIG['hedge']['max_sources']` sources run at the same time.
+
+    The optional parameter 'sources' specifies an alternative list of sources.
+    If not present, the main list will be used.
+    """
+    if l_sources is None:
+        l_sources = sources
+
+    if song.lyrics and not CONFIG['overwrite']:
+        logger.debug('%s already has embedded lyrics', song)
+        return None
+
+    runtimes = {}
+    counters = Counter()
+    missed = []
+    source = None
+    lyrics = ''
+    pending = skip_known_misses(song, l_sources, counters)
+
+    # The threads will hand the pages to this pool for parsing, if enabled
+    parsepool.start()
+    queue = Queue()
+    token = transport.CancelToken()
+    deadline = None
+    if CONFIG['deadline']:
+        deadline = time.time() + float(CONFIG['deadline'])
+    max_running = max(int(CONFIG['hedge']['max_sources']), 1)
+    running = []
+    # Time to start the next source even if the running ones haven't answered
+    next_start = 0
+    while pending or running:
+        now = time.time()
+        if deadline is not None and now >= deadline and pending:
+            logger.debug('Ran out of time searching lyrics for %s', song)
+            pending = []
+        if pending and len(running) < max_running and now >= next_start:
+            l_source = pending.pop(0)
+            if running:
+                with metrics.track(l_source, counters):
+                    metrics.incr('hedged')
+            LyrThread(l_source, song, queue, counters, deadline,
+                      token).start()
+            running.append(l_source)
+            next_start = now + hedge_delay(l_source)
+            continue
+
+        timeout = None
+        if pending and len(running) < max_running:
+            timeout = next_start - now
+        try:
+            res = queue.get(timeout=timeout)
+        except Empty:
+            continue
+        running.remove(res['source'])
+        # Whatever happened, the next source can start right away
+        next_start = 0
+        if res['skipped']:
+            continue
+
+        runtimes[res['source']] = res['runtime']
+        if res['lyrics']:
+            source = res['source']
+            lyrics = res['lyrics']
+            cancel_search(token, running, counters)
+            break
+        if not res['error']:
+            missed.append(source_key(res['source']))
+    cache.add_misses(song, missed)
+
+    if lyrics:
+        logger.info('++ %s: Found lyrics for %s\n', source.__name__, song)
+        song.lyrics = lyrics
+    else:
+        logger.info("Couldn't find lyrics for %s\n", song)
+
+    return Result(song, source, runtimes, counters)
 
 
 def process_result(result):
@@ -190,25 +457,106 @@ def process_result(result):
     return found
 
 
-def run(songs):
+def start_warmup(count):
     """
-    Calls get_lyrics_threaded for a song or list of songs.
+    Start opening connections to the hosts of the first `count` sources in a
+    background thread, so they are ready by the time the first song is
+    searched. Call `wait_warmup()` before starting the search.
     """
-    if not hasattr(songs, '__iter__'):
-        result = get_lyrics_threaded(songs)
-        process_result(result)
-    else:
-        start = time.time()
-        stats = run_mp(songs)
-        end = time.time()
+    global _warmup
+    origins = source_origins(sources[:count])
+    if not origins or CONFIG['replay'] or CONFIG['host_override']:
+        return
+    _warmup = threading.Thread(target=transport.warmup, args=(origins,),
+                               kwargs={'timeout': CONFIG['connect_timeout']},
+                               daemon=True)
+    _warmup.start()
+
+
+def wait_warmup():
+    """
+    Wait for the warm-up started by `start_warmup()` to finish.
+    """
+    global _warmup
+    if _warmup is not None:
+        _warmup.join(float(CONFIG['connect_timeout']))
+        _warmup = None
+
+
+def prepare_run():
+    """
+    Get everything ready before starting a search.
+    """
+    # Resolve every host beforehand so the first searches don't have to wait
+    if not CONFIG['replay'] and not CONFIG['host_override']:
+        resolver.prefetch(source_hosts(sources),
+                          timeout=float(CONFIG['connect_timeout']))
+    # Expired misses are ignored, but they would stay in the database forever
+    cache.purge_misses()
+    wait_warmup()
+
+
+def report_run(stats=None, total_time=None):
+    """
+    Print the stats (if enabled) and the total time of a search of several
+    songs, which are not passed for a single song.
+    """
+    if stats is not None:
         if CONFIG['print_stats']:
             stats.print_stats()
-        total_time = end - start
         total_time = '%d:%02d:%02d' % (total_time / 3600,
                                        (total_time / 3600) / 60,
                                        (total_time % 3600) % 60)
         print(f'Total time: {total_time}')
 
+    cached = documents.get_documents()
+    if cached is None:
+        return
+    if stats is None:
+        logger.debug('Document cache: %(documents)d documents, %(size)d '
+                     'bytes, %(hit_rate).2f%% hit rate', cached.stats())
+        return
+
+    # With run_mp, the documents are cached by the workers, so only their
+    # counters are known here
+    hits = stats.total('memory_hits')
+    lookups = hits + stats.total('memory_misses')
+    logger.debug('Document cache: %d lookups, %.2f%% hit rate', lookups,
+                 hits * 100 / lookups if lookups else 0)
+
+
+def run(songs):
+    """
+    Calls get_lyrics_threaded for a song or run_mp for a list of songs (or
+    get_lyrics_hedged for both with the hedged engine).
+    """
+    prepare_run()
+    if not hasattr(songs, '__iter__'):
+        if CONFIG['engine'] == 'hedged':
+            result = get_lyrics_hedged(songs)
+        else:
+            result = get_lyrics_threaded(songs)
+        process_result(result)
+        report_run()
+    else:
+        start = time.time()
+        stats = run_mp(songs)
+        report_run(stats, time.time() - start)
+
+
+def init_worker(limiter=None, budget=None, keep_connections=False):
+    """
+    Initializer for every process in the pool launched by `run_mp`.
+    """
+    # Connections inherited from the parent process can't be shared by
+    # several workers, but a single one can keep using them
+    if not keep_connections:
+        transport.reset()
+    if limiter is not None:
+        ratelimit.set_limiter(limiter)
+    if budget is not None:
+        retry.set_budget(budget)
+
 
 def run_mp(songs):
     """
@@ -220,15 +568,22 @@ def run_mp(songs):
         bad = open('notfound', 'w')
 
     logger.debug('Launching a pool of %d processes\n', CONFIG['jobcount'])
+    search = get_lyrics
+    if CONFIG['engine'] == 'hedged':
+        search = get_lyrics_hedged
     chunksize = math.ceil(len(songs) / os.cpu_count())
     try:
-        with Pool(CONFIG['jobcount']) as pool:
-            for result in pool.imap_unordered(get_lyrics, songs, chunksize):
+        initargs = (ratelimit.get_limiter(), retry.get_budget(),
+                    CONFIG['jobcount'] == 1)
+        with Pool(CONFIG['jobcount'], initializer=init_worker,
+                  initargs=initargs) as pool:
+            for result in pool.imap_unordered(search, songs, chunksize):
                 if result is None:
                     continue
 
                 for source, runtime in result.runtimes.items():
                     stats.add_result(source, result.source == source, runtime)
+                stats.add_counters(result.counters)
 
                 found = process_result(result)
                 if CONFIG['debug']:
@@ -1,49 +1,197 @@
 """
 Scraping functions.
 """
-import ssl
 import json
+import random
 import re
 import urllib.request as request
-from urllib.error import URLError, HTTPError
 from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
+from collections import namedtuple
+from functools import lru_cache, partial
 from operator import attrgetter
+from urllib.parse import urlsplit
 
 from . import CONFIG
 from . import URLESCAPE
 from . import URLESCAPES
+from . import cache
+from . import coalesce
+from . import documents
+from . import fastpath
 from . import logger
+from . import metrics
+from . import parsepool
+from . import transport
+from .region import Region
 
 
-def get_url(url, parser='html'):
+@lru_cache()
+def _check_parser(name):
+    """
+    Returns `name` if there's a BeautifulSoup parser with that name installed,
+    or the default 'html.parser' otherwise.
+    """
+    if builder_registry.lookup(name) is None:
+        logger.warning("HTML parser '%s' is not installed, using html.parser",
+                       name)
+        return 'html.parser'
+    return name
+
+
+def get_parser():
+    """
+    Returns the name of the parser used by BeautifulSoup to parse html, as
+    specified in CONFIG.
+    """
+    return _check_parser(CONFIG['html_parser'])
+
+
+def _parse(body, region=None):
+    """
+    Parse an html page, or only its `region` if passed.
+    """
+    if region is None:
+        return BeautifulSoup(body, get_parser(), from_encoding='utf-8')
+    return BeautifulSoup(region.extract(body), get_parser(),
+                         from_encoding='utf-8', parse_only=region.strainer())
+
+
+def make_soup(body, region=None, shared=False):
+    """
+    Returns a BeautifulSoup object with the contents of an html page. If a
+    `region` is passed, only that element of the page is parsed.
+
+    If `shared` is set, the soup is kept in the document cache and returned
+    again for the same body, so the caller must not modify it.
+    """
+    cached = documents.get_documents() if shared else None
+    size = len(body) * documents.SOUP_SIZE_FACTOR
+    if cached is None or size > int(CONFIG['memory_cache_parsed']):
+        return _parse(body, region)
+
+    # The hash of the body is computed only once, and the document cache
+    # keeps returning the same object for the same url
+    key = ('soup', get_parser(), str(region), body)
+    soup = cached.get(key)
+    if soup is None:
+        soup = _parse(body, region)
+        cached.put(key, soup, size)
+    return soup
+
+
+# Requests in progress in any thread of this process
+_flights = coalesce.SingleFlight()
+
+
+def fetch_body(url, parser='html', region=None):
+    """
+    Requests the specified url and returns the raw body of the response. The
+    parser is only used to tell apart the entries in the cache.
+
+    If another thread is already requesting the same url, wait for its
+    response instead of sending a new request.
+    """
+    url = request.quote(url, safe=':/?=&')
+    cached = documents.get_documents()
+    key = ('body', parser, str(region), url)
+    body = cached.get(key) if cached is not None else None
+    if body is not None:
+        return body
+
+    def fetch():
+        logger.debug('URL: %s', url)
+        body = cache.fetch(url, parser, region)
+        if cached is not None:
+            cached.put(key, body, len(body))
+        return body
+
+    while True:
+        try:
+            return _flights.do(key, fetch, transport.time_left())
+        except coalesce.WaitTimeout:
+            raise transport.DeadlineExceeded(url)
+        except transport.Cancelled:
+            # The request may have been sent for another search, which was
+            # cancelled. This one can send its own
+            if transport.is_cancelled():
+                raise
+
+
+def get_url(url, parser='html', region=None):
     """
     Requests the specified url and returns a BeautifulSoup object with its
     contents.
+
+    If a `region` is passed, only that element of the page is downloaded and
+    parsed.
     """
-    url = request.quote(url, safe=':/?=&')
-    logger.debug('URL: %s', url)
-    req = request.Request(url, headers={'User-Agent': 'foobar'})
-    try:
-        response = request.urlopen(req)
-    except HTTPError:
-        raise
-    except (ssl.SSLError, URLError):
-        # Some websites (like metal-archives) use older TLS versions and can
-        # make the ssl module trow a VERSION_TOO_LOW error. Here we try to use
-        # the older TLSv1 to see if we can fix that
-        context = ssl.SSLContext(ssl.PROTOCOL_TLSv1)
-        response = request.urlopen(req, context=context)
-
-    response = response.read()
+    response = fetch_body(url, parser, region)
     if parser == 'html':
-        return BeautifulSoup(response, 'html.parser', from_encoding='utf-8')
+        return make_soup(response, region)
     elif parser == 'json':
         return json.loads(response)
     elif parser == 'raw':
         return response.decode()
+    elif parser == 'bytes':
+        return response
     raise ValueError('Unrecognized parser')
 
 
+def fast_extract(body, song, fast, slow, region=None):
+    """
+    Get the lyrics from a response `body` with the `fast` extractor (one of the
+    functions in fastpath), and fall back to calling `slow` with the parsed
+    page if it can't handle it.
+
+    A fraction of the pages set in `CONFIG['fast_path_validation']` are also
+    parsed with the slow path to detect any drift between the two.
+    """
+    if CONFIG['fast_paths']:
+        text = fast(body, song)
+        if text is not None:
+            rate = float(CONFIG['fast_path_validation'])
+            if rate and random.random() < rate:
+                metrics.incr('fast_path_validated')
+                expected = slow(make_soup(body, region), song)
+                if text != expected:
+                    metrics.incr('fast_path_drift')
+                    logger.warning('Fast path for %s returned different '
+                                   'lyrics than the full parse', fast.__name__)
+                    return expected
+            metrics.incr('fast_path_hits')
+            return text
+        metrics.incr('fast_path_fallbacks')
+    return slow(make_soup(body, region), song)
+
+
+# A request planned by a source. Once downloaded, the body of the response must
+# be passed to `extract` along with the song, which returns either the lyrics
+# or the next Request to send. The parser is only used to tell apart the
+# entries in the cache, and the region is the part of the page needed by
+# `extract`, if any
+Request = namedtuple('Request', 'url extract parser region')
+Request.__new__.__defaults__ = ('html', None)
+
+
+def run_steps(plan, song):
+    """
+    Search for the lyrics of `song` by sending the request returned by the
+    `plan` step of a source, and every follow-up request returned by its
+    extract steps, unless the search is cancelled in between.
+    """
+    result = plan(song)
+    first = True
+    while isinstance(result, Request):
+        transport.check_cancelled(result.url)
+        if not first:
+            transport.require_time(result.url)
+        body = fetch_body(result.url, result.parser, result.region)
+        result = parsepool.extract(result, body, song)
+        first = False
+    return result or ''
+
+
 def get_lastfm(method, lastfm_key='', **kwargs):
     """
     Request the specified method from the lastfm api.
@@ -69,6 +217,28 @@ def get_lastfm(method, lastfm_key='', **kwargs):
     return response
 
 
+ACCENTS = str.maketrans({
+    'á': 'a',
+    'ä': 'a',
+    'æ': 'ae',
+    'é': 'e',
+    'í': 'i',
+    'ó': 'o',
+    'ö': 'o',
+    'ú': 'u',
+    'ü': 'u',
+    'ñ': 'n',
+})
+
+
+@lru_cache(maxsize=None)
+def _char_class(chars):
+    """
+    Returns a compiled regex that matches any of the characters in `chars`.
+    """
+    return re.compile('[' + re.escape(chars) + ']')
+
+
 def normalize(string, chars_to_remove=None, replacement=''):
     """
     Remove accented characters and such.
@@ -79,46 +249,80 @@ def normalize(string, chars_to_remove=None, replacement=''):
     mapping is desired, chars_to_remove may be a single string, but a third
     parameter, replacement, must be provided to complete the translation.
     """
-    ret = string.translate(str.maketrans({
-        'á': 'a',
-        'ä': 'a',
-        'æ': 'ae',
-        'é': 'e',
-        'í': 'i',
-        'ó': 'o',
-        'ö': 'o',
-        'ú': 'u',
-        'ü': 'u',
-        'ñ': 'n',
-    }))
+    ret = string.translate(ACCENTS)
 
     if isinstance(chars_to_remove, dict):
         for chars, replace in chars_to_remove.items():
-            reg = '[' + re.escape(chars) + ']'
-            ret = re.sub(reg, replace, ret)
+            ret = _char_class(chars).sub(replace, ret)
 
     elif isinstance(chars_to_remove, str):
-        reg = '[' + re.escape(chars_to_remove) + ']'
-        ret = re.sub(reg, replacement, ret)
+        ret = _char_class(chars_to_remove).sub(replacement, ret)
 
     return ret
 
 
+# Number of slugs memoized by every source
+SLUG_CACHE_SIZE = 4096
+
+
+def slugger(chars_to_remove=None, squash=None):
+    """
+    Returns a function that turns artist names, titles and such into the slugs
+    used in the urls of a source.
+
+    Slugs are built like `normalize(string, chars_to_remove)`, and then every
+    run of the `squash` character is replaced with a single one. The regexes
+    are compiled only once, and the slugs are memoized, since the same artists
+    come up again and again when scanning a library.
+    """
+    chars_to_remove = chars_to_remove or {}
+    patterns = [(_char_class(chars), replace)
+                for chars, replace in chars_to_remove.items()]
+    if squash:
+        patterns.append((re.compile(re.escape(squash) + '{2,}'), squash))
+
+    @lru_cache(maxsize=SLUG_CACHE_SIZE)
+    def slug(string):
+        ret = string.translate(ACCENTS)
+        for pattern, replace in patterns:
+            ret = pattern.sub(replace, ret)
+        return ret
+
+    return slug
+
+
+PLAIN_SLUG = slugger()
+DASH_SLUG = slugger({URLESCAPE: '', ' ': '-'}, squash='-')
+COMPACT_SLUG = slugger({URLESCAPES: ''})
+
+
 def metrolyrics(song):
     """
     Returns the lyrics found in metrolyrics for the specified mp3 file or an
     empty string if not found.
     """
-    translate = {URLESCAPE: '', ' ': '-'}
-    title = song.title.lower()
-    title = normalize(title, translate)
-    title = re.sub(r'\-{2,}', '-', title)
-    artist = song.artist.lower()
-    artist = normalize(artist, translate)
-    artist = re.sub(r'\-{2,}', '-', artist)
+    return run_steps(plan_metrolyrics, song)
+
+
+METROLYRICS_REGION = Region(id='lyrics-body-text')
+
+
+def plan_metrolyrics(song):
+    """
+    Returns the request to get the lyrics of `song` from metrolyrics.
+    """
+    title = DASH_SLUG(song.title.lower())
+    artist = DASH_SLUG(song.artist.lower())
 
     url = 'http://www.metrolyrics.com/{}-lyrics-{}.html'.format(title, artist)
-    soup = get_url(url)
+    return Request(url, extract_metrolyrics, region=METROLYRICS_REGION)
+
+
+def extract_metrolyrics(body, song):
+    """
+    Returns the lyrics in a metrolyrics page.
+    """
+    soup = make_soup(body, METROLYRICS_REGION)
     body = soup.find(id='lyrics-body-text')
     if body is None:
         return ''
@@ -137,28 +341,43 @@ def darklyrics(song):
     Returns the lyrics found in darklyrics for the specified mp3 file or an
     empty string if not found.
     """
+    return run_steps(plan_darklyrics, song)
 
+
+def plan_darklyrics(song):
+    """
+    Returns the request to get the lyrics of `song` from darklyrics, or None
+    if the album of the song is unknown.
+    """
     # Darklyrics relies on the album name
     if not hasattr(song, 'album') or not song.album:
         song.fetch_album_name()
         if not hasattr(song, 'album') or not song.album:
             # If we don't have the name of the album, there's nothing we can do
             # on darklyrics
-            return ''
+            return None
 
-    artist = song.artist.lower()
-    artist = normalize(artist, URLESCAPES, '')
-    album = song.album.lower()
-    album = normalize(album, URLESCAPES, '')
-    title = song.title
+    artist = COMPACT_SLUG(song.artist.lower())
+    album = COMPACT_SLUG(song.album.lower())
 
     url = 'http://www.darklyrics.com/lyrics/{}/{}.html'.format(artist, album)
-    soup = get_url(url)
+    # Getting the album name may have taken a while
+    transport.require_time(url)
+    return Request(url, extract_darklyrics)
+
+
+def extract_darklyrics(body, song):
+    """
+    Returns the lyrics of `song` in a darklyrics album page.
+    """
+    title = song.title
+    # Album pages are needed by every song in the album
+    soup = make_soup(body, shared=True)
     text = ''
     for header in soup.find_all('h3'):
-        song = str(header.get_text())
+        header_title = str(header.get_text())
         next_sibling = header.next_sibling
-        if song.lower().find(title.lower()) != -1:
+        if header_title.lower().find(title.lower()) != -1:
             while next_sibling is not None and\
                     (next_sibling.name is None or next_sibling.name != 'h3'):
                 if next_sibling.name is None:
@@ -173,16 +392,29 @@ def azlyrics(song):
     Returns the lyrics found in azlyrics for the specified mp3 file or an empty
     string if not found.
     """
+    return run_steps(plan_azlyrics, song)
+
+
+def plan_azlyrics(song):
+    """
+    Returns the request to get the lyrics of `song` from azlyrics.
+    """
     artist = song.artist.lower()
     if artist[0:2] == 'a ':
         artist = artist[2:]
-    artist = normalize(artist, URLESCAPES, '')
-    title = song.title.lower()
-    title = normalize(title, URLESCAPES, '')
+    artist = COMPACT_SLUG(artist)
+    title = COMPACT_SLUG(song.title.lower())
 
     url = 'https://www.azlyrics.com/lyrics/{}/{}.html'.format(artist, title)
-    soup = get_url(url)
-    paragraphs = map(attrgetter('text'), soup.find_all('div', class_=''))
+    return Request(url, extract_azlyrics)
+
+
+def extract_azlyrics(body, song):
+    """
+    Returns the lyrics in an azlyrics page.
+    """
+    soup = make_soup(body)
+    paragraphs = map(attrgetter('text'), soup.find_all('div', class_=False))
     text = '\n\n'.join(paragraphs).strip()
     return text
 
@@ -192,19 +424,33 @@ def genius(song):
     Returns the lyrics found in genius.com for the specified mp3 file or an
     empty string if not found.
     """
-    translate = {
-        '@': 'at',
-        '&': 'and',
-        URLESCAPE: '',
-        ' ': '-'
-    }
-    artist = song.artist.capitalize()
-    artist = normalize(artist, translate)
-    title = song.title.capitalize()
-    title = normalize(title, translate)
+    return run_steps(plan_genius, song)
+
+
+GENIUS_SLUG = slugger({
+    '@': 'at',
+    '&': 'and',
+    URLESCAPE: '',
+    ' ': '-'
+})
+
+
+def plan_genius(song):
+    """
+    Returns the request to get the lyrics of `song` from genius.com.
+    """
+    artist = GENIUS_SLUG(song.artist.capitalize())
+    title = GENIUS_SLUG(song.title.capitalize())
 
     url = 'https://www.genius.com/{}-{}-lyrics'.format(artist, title)
-    soup = get_url(url)
+    return Request(url, extract_genius)
+
+
+def extract_genius(body, song):
+    """
+    Returns the lyrics in a genius.com page.
+    """
+    soup = make_soup(body)
     for content in soup.find_all('p'):
         if content:
             text = content.get_text().strip()
@@ -219,12 +465,40 @@ def metalarchives(song):
     Returns the lyrics found in MetalArchives for the specified mp3 file or an
     empty string if not found.
     """
-    artist = normalize(song.artist)
-    title = normalize(song.title)
+    return run_steps(plan_metalarchives, song)
+
+
+def plan_metalarchives(song):
+    """
+    Returns the request to search for `song` in MetalArchives.
+    """
+    artist = PLAIN_SLUG(song.artist)
+    title = PLAIN_SLUG(song.title)
 
     url = 'https://www.metal-archives.com/search/ajax-advanced/searching/songs'
     url += f'/?songTitle={title}&bandName={artist}&ExactBandMatch=1'
-    soup = get_url(url, parser='json')
+    return Request(url, extract_metalarchives_search, parser='json')
+
+
+def _plan_metalarchives_lyrics(ids):
+    """
+    Returns the request to get the lyrics of the first song in `ids`, or an
+    empty string if there are none left.
+    """
+    if not ids:
+        return ''
+    url = 'https://www.metal-archives.com/release/ajax-view-lyrics/id/{}'
+    url = url.format(ids[0])
+    return Request(url, partial(extract_metalarchives, ids=ids[1:]),
+                   parser='bytes')
+
+
+def extract_metalarchives_search(body, song):
+    """
+    Returns the request to get the lyrics of the first song found in the
+    results of a MetalArchives search.
+    """
+    soup = json.loads(body)
     if not soup:
         return ''
 
@@ -235,15 +509,30 @@ def metalarchives(song):
 
     if None in ids:
         ids.remove(None)
-    ids = map(lambda a: a.group(1), ids)
-    for song_id in ids:
-        url = 'https://www.metal-archives.com/release/ajax-view-lyrics/id/{}'
-        lyrics = get_url(url.format(song_id), parser='html')
-        lyrics = lyrics.get_text().strip()
-        if not re.search('lyrics not available', lyrics):
-            return lyrics
+    ids = tuple(map(lambda a: a.group(1), ids))
+    return _plan_metalarchives_lyrics(ids)
 
-    return ''
+
+def extract_metalarchives(body, song, ids=()):
+    """
+    Returns the lyrics in a response from MetalArchives' lyrics endpoint, or
+    the request to get the lyrics of the next song in `ids` if they're not
+    available.
+    """
+    lyrics = fast_extract(body, song, fastpath.metalarchives,
+                          _parse_metalarchives)
+    if not re.search('lyrics not available', lyrics):
+        return lyrics
+
+    return _plan_metalarchives_lyrics(ids)
+
+
+def _parse_metalarchives(soup, song):
+    """
+    Returns the lyrics in the parsed html of a response from metal-archives'
+    lyrics endpoint.
+    """
+    return soup.get_text().strip()
 
 
 def lyricswikia(song):
@@ -251,13 +540,29 @@ def lyricswikia(song):
     Returns the lyrics found in lyrics.wikia.com for the specified mp3 file or
     an empty string if not found.
     """
-    artist = song.artist.title()
-    artist = normalize(artist, ' ', '_')
-    title = song.title
-    title = normalize(title, ' ', '_')
+    return run_steps(plan_lyricswikia, song)
+
+
+LYRICSWIKIA_REGION = Region('div', class_='lyricbox')
+LYRICSWIKIA_SLUG = slugger({' ': '_'})
+
+
+def plan_lyricswikia(song):
+    """
+    Returns the request to get the lyrics of `song` from lyrics.wikia.com.
+    """
+    artist = LYRICSWIKIA_SLUG(song.artist.title())
+    title = LYRICSWIKIA_SLUG(song.title)
 
     url = 'https://lyrics.wikia.com/wiki/{}:{}'.format(artist, title)
-    soup = get_url(url)
+    return Request(url, extract_lyricswikia, region=LYRICSWIKIA_REGION)
+
+
+def extract_lyricswikia(body, song):
+    """
+    Returns the lyrics in a lyrics.wikia.com page.
+    """
+    soup = make_soup(body, LYRICSWIKIA_REGION)
     text = ''
     content = soup.find('div', class_='lyricbox')
     if not content:
@@ -287,25 +592,42 @@ def musixmatch(song):
     Returns the lyrics found in musixmatch for the specified mp3 file or an
     empty string if not found.
     """
-    escape = re.sub("'-¡¿", '', URLESCAPE)
-    translate = {
-        escape: '',
-        ' ': '-'
-    }
-    artist = song.artist.title()
-    artist = re.sub(r"( '|' )", '', artist)
-    artist = re.sub(r"'", '-', artist)
-    title = song.title
-    title = re.sub(r"( '|' )", '', title)
-    title = re.sub(r"'", '-', title)
+    return run_steps(plan_musixmatch, song)
+
+
+MUSIXMATCH_QUOTES_RE = re.compile(r"( '|' )")
+MUSIXMATCH_SLUG = slugger({
+    re.sub("'-¡¿", '', URLESCAPE): '',
+    ' ': '-'
+}, squash='-')
 
-    artist = normalize(artist, translate)
-    artist = re.sub(r'\-{2,}', '-', artist)
-    title = normalize(title, translate)
-    title = re.sub(r'\-{2,}', '-', title)
+
+@lru_cache(maxsize=SLUG_CACHE_SIZE)
+def _musixmatch_slug(string):
+    """
+    Returns the slug of `string` in musixmatch urls, where quotes become
+    dashes unless they're next to a space.
+    """
+    string = MUSIXMATCH_QUOTES_RE.sub('', string).replace("'", '-')
+    return MUSIXMATCH_SLUG(string)
+
+
+def plan_musixmatch(song):
+    """
+    Returns the request to get the lyrics of `song` from musixmatch.
+    """
+    artist = _musixmatch_slug(song.artist.title())
+    title = _musixmatch_slug(song.title)
 
     url = 'https://www.musixmatch.com/lyrics/{}/{}'.format(artist, title)
-    soup = get_url(url)
+    return Request(url, extract_musixmatch)
+
+
+def extract_musixmatch(body, song):
+    """
+    Returns the lyrics in a musixmatch page.
+    """
+    soup = make_soup(body)
     text = ''
     contents = soup.find_all('p', class_='mxm-lyrics__content')
     for p in contents:
@@ -323,20 +645,28 @@ def songlyrics(song):
     Returns the lyrics found in songlyrics.com for the specified mp3 file or an
     empty string if not found.
     """
-    translate = {
-        URLESCAPE: '',
-        ' ': '-'
-    }
-    artist = song.artist.lower()
-    artist = normalize(artist, translate)
-    title = song.title.lower()
-    title = normalize(title, translate)
+    return run_steps(plan_songlyrics, song)
+
 
-    artist = re.sub(r'\-{2,}', '-', artist)
-    title = re.sub(r'\-{2,}', '-', title)
+SONGLYRICS_REGION = Region(id='songLyricsDiv')
+
+
+def plan_songlyrics(song):
+    """
+    Returns the request to get the lyrics of `song` from songlyrics.com.
+    """
+    artist = DASH_SLUG(song.artist.lower())
+    title = DASH_SLUG(song.title.lower())
 
     url = 'http://www.songlyrics.com/{}/{}-lyrics'.format(artist, title)
-    soup = get_url(url)
+    return Request(url, extract_songlyrics, region=SONGLYRICS_REGION)
+
+
+def extract_songlyrics(body, song):
+    """
+    Returns the lyrics in a songlyrics.com page.
+    """
+    soup = make_soup(body, SONGLYRICS_REGION)
     text = soup.find(id='songLyricsDiv')
     if not text:
         return ''
@@ -353,38 +683,72 @@ def lyricscom(song):
     Returns the lyrics found in lyrics.com for the specified mp3 file or an
     empty string if not found.
     """
-    artist = song.artist.lower()
-    artist = normalize(artist, ' ', '+')
+    return run_steps(plan_lyricscom, song)
+
+
+LYRICSCOM_REGION = Region(id='lyric-body-text')
+LYRICSCOM_SLUG = slugger({' ': '+'})
+
+
+def plan_lyricscom(song):
+    """
+    Returns the request to search for the artist of `song` in lyrics.com.
+    """
+    artist = LYRICSCOM_SLUG(song.artist.lower())
 
     url = 'https://www.lyrics.com/artist/{}'.format(artist)
-    soup = get_url(url)
+    return Request(url, extract_lyricscom_artist)
+
+
+def extract_lyricscom_artist(body, song):
+    """
+    Returns the request to get the page of the artist of `song` from the
+    search results of lyrics.com.
+    """
+    soup = make_soup(body, shared=True)
     artist_page = ''
     for link in soup.select('tr a.name'):
         title = link.attrs.get('title')
         if not title:
             continue
 
-        if normalize(title).lower() == normalize(song.artist).lower():
+        if PLAIN_SLUG(title).lower() == PLAIN_SLUG(song.artist).lower():
             artist_page = link.attrs['href']
             break
     else:
         return ''
 
     url = 'https://www.lyrics.com/' + artist_page
-    soup = get_url(url)
+    return Request(url, extract_lyricscom_songs)
+
+
+def extract_lyricscom_songs(body, song):
+    """
+    Returns the request to get the lyrics of `song` from the page of its
+    artist in lyrics.com.
+    """
+    soup = make_soup(body, shared=True)
     songs = soup.select('div.tdata-ext td a')
     for link in songs:
         if not link.string:
             continue
 
-        if normalize(link.string.lower()) == normalize(song.title.lower()):
+        if PLAIN_SLUG(link.string.lower()) == \
+                PLAIN_SLUG(song.title.lower()):
             song_page = link.attrs['href']
             break
     else:
         return ''
 
     url = 'https://www.lyrics.com/' + song_page
-    soup = get_url(url)
+    return Request(url, extract_lyricscom, region=LYRICSCOM_REGION)
+
+
+def extract_lyricscom(body, song):
+    """
+    Returns the lyrics in a lyrics.com song page.
+    """
+    soup = make_soup(body, LYRICSCOM_REGION)
     body = soup.find(id='lyric-body-text')
     if not body:
         return ''
@@ -397,20 +761,41 @@ def vagalume(song):
     Returns the lyrics found in vagalume.com.br for the specified mp3 file or
     an empty string if not found.
     """
-    translate = {
-        '@': 'a',
-        URLESCAPE: '',
-        ' ': '-'
-    }
-    artist = song.artist.lower()
-    artist = normalize(artist, translate)
-    artist = re.sub(r'\-{2,}', '-', artist)
-    title = song.title.lower()
-    title = normalize(title, translate)
-    title = re.sub(r'\-{2,}', '-', title)
+    return run_steps(plan_vagalume, song)
+
+
+VAGALUME_REGION = Region('div', id='lyrics')
+VAGALUME_SLUG = slugger({
+    '@': 'a',
+    URLESCAPE: '',
+    ' ': '-'
+}, squash='-')
+
+
+def plan_vagalume(song):
+    """
+    Returns the request to get the lyrics of `song` from vagalume.com.br.
+    """
+    artist = VAGALUME_SLUG(song.artist.lower())
+    title = VAGALUME_SLUG(song.title.lower())
 
     url = 'https://www.vagalume.com.br/{}/{}.html'.format(artist, title)
-    soup = get_url(url)
+    return Request(url, extract_vagalume, parser='bytes',
+                   region=VAGALUME_REGION)
+
+
+def extract_vagalume(body, song):
+    """
+    Returns the lyrics in a vagalume.com.br page.
+    """
+    return fast_extract(body, song, fastpath.vagalume, _parse_vagalume,
+                        VAGALUME_REGION)
+
+
+def _parse_vagalume(soup, song):
+    """
+    Returns the lyrics in the parsed html of a vagalume.com.br page.
+    """
     body = soup.select('div#lyrics')
     if body == []:
         return ''
@@ -427,17 +812,19 @@ def lyricsmode(song):
     Returns the lyrics found in lyricsmode.com for the specified mp3 file or an
     empty string if not found.
     """
-    translate = {
-        URLESCAPE: '',
-        ' ': '_'
-    }
-    artist = song.artist.lower()
-    artist = normalize(artist, translate)
-    title = song.title.lower()
-    title = normalize(title, translate)
+    return run_steps(plan_lyricsmode, song)
+
+
+LYRICSMODE_REGION = Region(id='lyrics_text')
+LYRICSMODE_SLUG = slugger({URLESCAPE: '', ' ': '_'}, squash='_')
 
-    artist = re.sub(r'\_{2,}', '_', artist)
-    title = re.sub(r'\_{2,}', '_', title)
+
+def plan_lyricsmode(song):
+    """
+    Returns the request to get the lyrics of `song` from lyricsmode.com.
+    """
+    artist = LYRICSMODE_SLUG(song.artist.lower())
+    title = LYRICSMODE_SLUG(song.title.lower())
 
     if artist[0:4].lower() == 'the ':
         artist = artist[4:]
@@ -449,7 +836,14 @@ def lyricsmode(song):
 
     url = 'http://www.lyricsmode.com/lyrics/{}/{}/{}.html'
     url = url.format(prefix, artist, title)
-    soup = get_url(url)
+    return Request(url, extract_lyricsmode, region=LYRICSMODE_REGION)
+
+
+def extract_lyricsmode(body, song):
+    """
+    Returns the lyrics in a lyricsmode.com page.
+    """
+    soup = make_soup(body, LYRICSMODE_REGION)
     content = soup.find(id='lyrics_text')
     for div in content.find_all('div'):
         div.decompose()
@@ -462,21 +856,41 @@ def letras(song):
     Returns the lyrics found in letras.com for the specified mp3 file or an
     empty string if not found.
     """
-    translate = {
-        '&': 'a',
-        URLESCAPE: '',
-        ' ': '-'
-    }
-    artist = song.artist.lower()
-    artist = normalize(artist, translate)
-    title = song.title.lower()
-    title = normalize(title, translate)
+    return run_steps(plan_letras, song)
+
+
+LETRAS_SLUG = slugger({
+    '&': 'a',
+    URLESCAPE: '',
+    ' ': '-'
+})
+
+
+def plan_letras(song):
+    """
+    Returns the request to get the lyrics of `song` from letras.com.
+    """
+    artist = LETRAS_SLUG(song.artist.lower())
+    title = LETRAS_SLUG(song.title.lower())
 
     url = 'https://www.letras.com/{}/{}/'.format(artist, title)
-    soup = get_url(url)
-    if not soup:
+    return Request(url, extract_letras, parser='bytes')
+
+
+def extract_letras(body, song):
+    """
+    Returns the lyrics in a letras.com page.
+    """
+    if not body:
         return ''
 
+    return fast_extract(body, song, fastpath.letras, _parse_letras)
+
+
+def _parse_letras(soup, song):
+    """
+    Returns the lyrics in the parsed html of a letras.com page.
+    """
     found_title = soup.select_one('div.cnt-head_title h1')
     if not found_title:
         # The site didn't find lyrics and took us to the homepage
@@ -502,19 +916,40 @@ def letras(song):
     return text.strip()
 
 
+# Maps every source to its short and full names, and the origins (scheme and
+# host) it sends its requests to
 source_ids = {
-    azlyrics: ('AZL', 'AZLyrics.com'),
-    metrolyrics: ('MET', 'Metrolyrics.com'),
-    lyricswikia: ('WIK', 'Lyrics.wikia.com'),
-    darklyrics: ('DAR', 'Darklyrics.com'),
-    metalarchives: ('ARC', 'Metal-archives.com'),
-    genius: ('GEN', 'Genius.com'),
-    musixmatch: ('XMA', 'Musixmatch.com'),
-    songlyrics: ('SON', 'SongLyrics.com'),
-    vagalume: ('VAG', 'Vagalume.com.br'),
-    letras: ('LET', 'Letras.com'),
-    lyricsmode: ('LYM', 'Lyricsmode.com'),
-    lyricscom: ('LYC', 'Lyrics.com'),
+    azlyrics: ('AZL', 'AZLyrics.com', ('https://www.azlyrics.com',)),
+    metrolyrics: ('MET', 'Metrolyrics.com', ('http://www.metrolyrics.com',)),
+    lyricswikia: ('WIK', 'Lyrics.wikia.com', ('https://lyrics.wikia.com',)),
+    darklyrics: ('DAR', 'Darklyrics.com', ('http://www.darklyrics.com',)),
+    metalarchives: ('ARC', 'Metal-archives.com',
+                    ('https://www.metal-archives.com',)),
+    genius: ('GEN', 'Genius.com', ('https://www.genius.com',
+                                   'https://genius.com')),
+    musixmatch: ('XMA', 'Musixmatch.com', ('https://www.musixmatch.com',)),
+    songlyrics: ('SON', 'SongLyrics.com', ('http://www.songlyrics.com',)),
+    vagalume: ('VAG', 'Vagalume.com.br', ('https://www.vagalume.com.br',)),
+    letras: ('LET', 'Letras.com', ('https://www.letras.com',)),
+    lyricsmode: ('LYM', 'Lyricsmode.com', ('http://www.lyricsmode.com',)),
+    lyricscom: ('LYC', 'Lyrics.com', ('https://www.lyrics.com',)),
+}
+
+
+# Maps every source to the step that plans its first request
+source_steps = {
+    azlyrics: plan_azlyrics,
+    metrolyrics: plan_metrolyrics,
+    lyricswikia: plan_lyricswikia,
+    darklyrics: plan_darklyrics,
+    metalarchives: plan_metalarchives,
+    genius: plan_genius,
+    musixmatch: plan_musixmatch,
+    songlyrics: plan_songlyrics,
+    vagalume: plan_vagalume,
+    letras: plan_letras,
+    lyricsmode: plan_lyricsmode,
+    lyricscom: plan_lyricscom,
 }
 
 
@@ -529,3 +964,22 @@ def id_source(source, full=False):
         return source_ids[source][1]
     else:
         return source_ids[source][0]
+
+
+def source_origins(sources):
+    """
+    Returns the list of origins (like 'https://www.azlyrics.com') the scraping
+    functions in `sources` send their requests to.
+    """
+    origins = []
+    for source in sources:
+        if source in source_ids:
+            origins.extend(source_ids[source][2])
+    return origins
+
+
+def source_hosts(sources):
+    """
+    Returns the list of hosts the scraping functions in `sources` connect to.
+    """
+    return [urlsplit(origin).hostname for origin in source_origins(sources)]
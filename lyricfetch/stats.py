@@ -2,6 +2,8 @@
 A collection of classes and methods to accumulate, calculate and show stats
 about an execution.
 """
+import math
+from collections import Counter
 from collections import defaultdict
 
 from . import sources
@@ -17,6 +19,25 @@ def avg(values):
         return sum(values) / len(values)
 
 
+def percentile(values, percent):
+    """
+    Returns the smallest of `values` that is greater than or equal to
+    `percent` percent of them.
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    rank = math.ceil(percent / 100 * len(values))
+    return values[max(rank, 1) - 1]
+
+
+def format_counter(name):
+    """
+    Returns a human readable version of a counter name.
+    """
+    return name.replace('_', ' ').capitalize()
+
+
 class Record:
     """
     Defines an entry in the stats 'database'. Packs a set of information about
@@ -26,15 +47,19 @@ class Record:
         self.successes = 0
         self.fails = 0
         self.runtimes = []
+        self.counters = Counter()
 
     def __str__(self):
         return self.__repr__()
 
     def __repr__(self):
-        return f"""Successes: {self.successes}
+        output = f"""Successes: {self.successes}
 Fails: {self.fails}
 Success rate: {self.success_rate():.2f}%
 Average runtime: {avg(self.runtimes):.2f}s"""
+        for name, value in sorted(self.counters.items()):
+            output += f'\n{format_counter(name)}: {value}'
+        return output
 
     def add_runtime(self, runtime):
         """
@@ -63,6 +88,8 @@ class Stats:
     def __init__(self):
         # Maps every lyrics scraping function to a Record object
         self.source_stats = defaultdict(Record)
+        # Counters that can't be attributed to any specific source
+        self.counters = Counter()
 
     def add_result(self, source, found, runtime):
         """
@@ -77,6 +104,24 @@ class Stats:
         else:
             self.source_stats[source.__name__].fails += 1
 
+    def add_counters(self, counters):
+        """
+        Merge the counters collected during a search (as stored in a `Result`
+        object) into the statistics.
+        """
+        for (source, name), value in counters.items():
+            if source is None:
+                self.counters[name] += value
+            else:
+                self.source_stats[source].counters[name] += value
+
+    def total(self, name):
+        """
+        Returns the sum of the counter `name` over every source.
+        """
+        return self.counters[name] + sum(stats.counters[name] for stats in
+                                         self.source_stats.values())
+
     def avg_time(self, source=None):
         """
         Returns the average time taken to scrape lyrics. If a string or a
@@ -148,12 +193,14 @@ Total runtime: {total_time}
 {worst} ({worst_count} lyrics found) ({worst_rate:.2f}% success rate)
     Fastest website to scrape: {fastest} (Avg: {fastest_time:.2f}s per search)
     Slowest website to scrape: {slowest} (Avg: {slowest_time:.2f}s per search)
-    Average time per website: {avg_time:.2f}s
+    Average time per website: {avg_time:.2f}s{counters}
 
 xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
 xxx    PER WEBSITE STATS:      xxx
 xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
 """
+        counters = ''.join(f'\n    {format_counter(name)}: {value}'
+                           for name, value in sorted(self.counters.items()))
         output = output.format(total_time=total_time,
                                found=stats['found'],
                                notfound=stats['notfound'],
@@ -167,7 +214,8 @@ xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
                                fastest_time=stats['fastest'][1],
                                slowest=stats['slowest'][0].capitalize(),
                                slowest_time=stats['slowest'][1],
-                               avg_time=self.avg_time())
+                               avg_time=self.avg_time(),
+                               counters=counters)
         for source in sources:
             stat = str(self.source_stats[source.__name__])
             output += f'\n{source.__name__.upper()}\n{stat}\n'
@@ -3,15 +3,85 @@ Common fixtures and helper functions.
 """
 import os
 import shutil
+import ssl
+import subprocess
 import tempfile
+import threading
 import urllib.request
 from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.error import HTTPError
 
 import pytest
 import eyed3
 
 from lyricfetch import CONFIG
+from lyricfetch import breaker
+from lyricfetch import cache
+from lyricfetch import documents
+from lyricfetch import retry
+from lyricfetch import tls
+from lyricfetch import transport
 from dbus_object import DBusObject
+from sample_pages import sample_pages
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """
+    Keep the files created by the caches out of the user's home directory.
+    """
+    cache.reset()
+    monkeypatch.setitem(CONFIG, 'cache_dir', str(tmp_path / 'cache'))
+    yield tmp_path / 'cache'
+    cache.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_documents():
+    """
+    Don't let the pages kept in memory by one test leak into the next ones.
+    """
+    documents.reset()
+    yield
+    documents.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_breakers():
+    """
+    Don't let the circuit breakers opened by one test affect the next ones.
+    """
+    breaker.reset()
+    yield
+    breaker.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_retries():
+    """
+    Give every test a fresh retry budget.
+    """
+    retry.set_budget(None)
+    yield
+    retry.set_budget(None)
+
+
+@pytest.fixture
+def sample_site(monkeypatch):
+    """
+    Serve the sample pages instead of downloading them from the internet.
+    """
+    def fetch(url, parser, region=None):
+        for pages in sample_pages.values():
+            for fragment, body in pages.items():
+                if fragment in url:
+                    return body.encode()
+        raise HTTPError(url, 404, 'Not found', {}, None)
+
+    monkeypatch.setattr(cache, 'fetch', fetch)
 
 
 @pytest.fixture(scope='session')
@@ -88,3 +158,106 @@ def dbus_service(request):
         yield service
     finally:
         service.stop()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """
+    Request handler that replies with the responses registered in the server's
+    `routes` dictionary.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        route = self.server.routes.get(self.path.split('?')[0])
+        if route is None:
+            route = (404, {}, b'Not found')
+        elif callable(route):
+            route = route(self)
+        elif isinstance(route, bytes):
+            route = (200, {}, route)
+
+        status, headers, body = route
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    """
+    A local HTTP server to test the transport without hitting the internet.
+
+    Responses are registered in `routes`, which maps a path to either the
+    bytes to reply with, a (status, headers, body) tuple, or a callable that
+    receives the request handler and returns such a tuple.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeHandler)
+        self.routes = {}
+        self.requests = []
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self.server_port, path)
+
+
+@pytest.fixture
+def http_server():
+    """
+    A local HTTP server running in a background thread.
+    """
+    transport.reset()
+    server = FakeServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        transport.reset()
+
+
+@pytest.fixture(scope='session')
+def certificate(tmp_path_factory):
+    """
+    A self-signed certificate for localhost, as a tuple of the paths to the
+    certificate and its key.
+    """
+    if not shutil.which('openssl'):
+        pytest.skip('openssl is not available')
+    tmpdir = tmp_path_factory.mktemp('cert')
+    cert, key = tmpdir / 'cert.pem', tmpdir / 'key.pem'
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                    '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                    '-addext', 'subjectAltName=DNS:localhost',
+                    '-keyout', str(key), '-out', str(cert)],
+                   check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+@pytest.fixture
+def https_server(http_server, certificate):
+    """
+    A local HTTPS server with a certificate trusted by the transport.
+    """
+    cert, key = certificate
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(str(cert), str(key))
+    http_server.socket = server_context.wrap_socket(http_server.socket,
+                                                    server_side=True)
+    http_server.url = lambda path: 'https://localhost:{}{}'.format(
+        http_server.server_port, path)
+
+    tls.reset()
+    tls.get_context().load_verify_locations(str(cert))
+    yield http_server
+    tls.reset()
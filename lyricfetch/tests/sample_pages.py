@@ -0,0 +1,214 @@
+"""
+Collection of sample pages with the structure of the websites scraped by every
+source.
+
+These variables are used to test the scraping functions without hitting the
+internet. Every entry maps the name of a source to a dictionary of url
+fragments and the response body served for the urls that contain them.
+"""
+# flake8: noqa: E501
+
+sample_song = {
+    'artist': 'Nightwish',
+    'title': 'Alpenglow',
+    'album': 'Endless Forms Most Beautiful',
+}
+
+sample_lyrics = ['Wish I could see', 'Alpenglow']
+
+_head = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Nightwish - Alpenglow Lyrics</title>
+<script type="text/javascript">
+  var ads = "<div class='ad'></div>";
+  if (window.innerWidth < 600 && ads) { document.write(ads); }
+</script>
+</head>
+<body>
+<div class="header"><a href="/">Home</a> | <a href="/top">Top</a></div>
+"""
+
+_tail = """
+<div class="footer">
+<p>Copyright &copy; 2019 &mdash; All rights reserved</p>
+<img src="/logo.png" alt="logo">
+</div>
+</body>
+</html>
+"""
+
+sample_pages = {
+    'azlyrics': {
+        'azlyrics.com/lyrics/nightwish/alpenglow.html': _head + """
+<div class="col-xs-12 col-lg-8 text-center">
+<div class="ringtone"><a href="#">Send "Alpenglow" Ringtone</a></div>
+<b>"Alpenglow"</b><br>
+<br>
+<div>
+<!-- Usage of azlyrics.com content by any third-party lyrics provider is prohibited by our licensing agreement. Sorry about that. -->
+Wish I could see<br>
+Over the mountains<br>
+<i>[Chorus]</i><br>
+Alpenglow, so bright<br>
+</div>
+<br><br>
+<div class="noprint"><span>Submit Corrections</span></div>
+</div>
+""" + _tail,
+    },
+    'darklyrics': {
+        'darklyrics.com/lyrics/nightwish/endlessformsmostbeautiful.html': _head + """
+<div class="lyrics">
+<h3><a name="1">1. Shudder Before The Beautiful</a></h3><br />
+Deep in the heart<br />
+Of the night<br />
+<br />
+<h3><a name="6">6. Alpenglow</a></h3><br />
+Wish I could see<br />
+Over the mountains<br />
+<i>[Chorus]</i><br />
+Alpenglow, so bright<br />
+<br />
+<h3><a name="7">7. The Eyes Of Sharbat Gula</a></h3><br />
+<i>[Instrumental]</i><br />
+<br />
+<div class="thanks">Thanks to someone for sending these lyrics.</div>
+</div>
+""" + _tail,
+    },
+    'genius': {
+        'genius.com/Nightwish-Alpenglow-lyrics': _head + """
+<div class="song_body-lyrics">
+<div class="lyrics">
+<!--sse-->
+<p>Wish I could see<br>
+Over the mountains<br>
+<a href="/123" data-id="123">Alpenglow, so bright</a><br>
+<br>
+[Chorus]<br>
+Alpenglow</p>
+<!--/sse-->
+</div>
+</div>
+""" + _tail,
+    },
+    'letras': {
+        'letras.com/nightwish/alpenglow/': _head + """
+<div class="cnt-head">
+<div class="cnt-head_title"><h1>Alpenglow</h1><h2><a href="/nightwish/">Nightwish</a></h2></div>
+</div>
+<div class="cnt-letra">
+<article>
+<p>Wish I could see<br/>Over the mountains<br/>Alpenglow, so bright</p>
+<p>Alpenglow<br/>Over the sea</p>
+</article>
+</div>
+""" + _tail,
+    },
+    'lyricscom': {
+        'lyrics.com/artist/nightwish': _head + """
+<table class="tdata">
+<tr><th>Artist</th></tr>
+<tr><td><a class="name" href="artist/Nightwish/12345" title="Nightwish">Nightwish</a></td></tr>
+<tr><td><a class="name" href="artist/Nightwish-Tribute/999" title="Nightwish Tribute">Nightwish Tribute</a></td></tr>
+</table>
+""" + _tail,
+        'lyrics.com/artist/Nightwish/12345': _head + """
+<div class="tdata-ext">
+<table>
+<tr><td><a href="/lyric/1/Nightwish/Shudder+Before+the+Beautiful">Shudder Before the Beautiful</a></td></tr>
+<tr><td><a href="/lyric/2"><strong>Weak Fantasy</strong></a></td></tr>
+<tr><td><a href="/lyric/6/Nightwish/Alpenglow">Alpenglow</a></td></tr>
+</table>
+</div>
+""" + _tail,
+        'lyrics.com//lyric/6/Nightwish/Alpenglow': _head + """
+<div class="lyric clearfix">
+<pre id="lyric-body-text" class="lyric-body" dir="ltr" data-lang="en">Wish I could see
+Over the mountains
+<a style="color: black" href="/lyric/6">Alpenglow</a>, so bright
+
+Alpenglow</pre>
+</div>
+""" + _tail,
+    },
+    'lyricsmode': {
+        'lyricsmode.com/lyrics/n/nightwish/alpenglow.html': _head + """
+<div id="lyrics_text" class="ui-annotatable js-lyric-text-container">
+Wish I could see<br />
+Over the mountains<br />
+Alpenglow, so bright<br />
+<div class="ad-rectangle"><span>Advertisement</span></div>
+Alpenglow<br />
+</div>
+""" + _tail,
+    },
+    'lyricswikia': {
+        'lyrics.wikia.com/wiki/Nightwish:Alpenglow': _head + """
+<div class='lyricbox'>Wish I could see<br />Over the <b>mountains</b><br /><i>Alpenglow</i>, so bright<br /><br /><br />Alpenglow<div class='lyricsbreak'></div>
+</div>
+""" + _tail,
+    },
+    'metalarchives': {
+        'search/ajax-advanced/searching/songs': """{
+    "error": "",
+    "iTotalRecords": 1,
+    "iTotalDisplayRecords": 1,
+    "sEcho": 0,
+    "aaData": [
+        ["<a href=\\"https://www.metal-archives.com/bands/Nightwish/39\\">Nightwish</a>", "<a href=\\"https://www.metal-archives.com/albums/Nightwish/Endless_Forms_Most_Beautiful/476458\\">Endless Forms Most Beautiful</a>", "Full-length", "Alpenglow", "<a href=\\"javascript:;\\" id=\\"lyricsLink_3958004\\" onclick=\\"toggleLyrics('3958004'); return false;\\">Show lyrics</a>"]
+    ]
+}""",
+        'ajax-view-lyrics/id/3958004': """
+Wish I could see<br />
+Over the mountains<br />
+Alpenglow, so bright<br />
+<br />
+Alpenglow<br />
+""",
+    },
+    'metrolyrics': {
+        'metrolyrics.com/alpenglow-lyrics-nightwish.html': _head + """
+<div id="lyrics-body-text" class="js-lyric-text">
+<p class='verse'>Wish I could see<br>
+Over the mountains<br>
+Alpenglow, so bright</p>
+<div class="mxm-ad"><p>Advertisement</p></div>
+<p class='verse'>Alpenglow<br>
+Over the sea</p>
+</div>
+""" + _tail,
+    },
+    'musixmatch': {
+        'musixmatch.com/lyrics/Nightwish/Alpenglow': _head + """
+<div class="mxm-lyrics">
+<span><p class="mxm-lyrics__content "><span class="lyrics__content__ok">Wish I could see
+Over the mountains
+Alpenglow, so bright</span></p></span>
+<div class="banner"></div>
+<span><p class="mxm-lyrics__content "><span class="lyrics__content__ok">Alpenglow
+Over the sea</span></p></span>
+</div>
+""" + _tail,
+    },
+    'songlyrics': {
+        'songlyrics.com/nightwish/alpenglow-lyrics': _head + """
+<div id="songLyricsContainer">
+<p id="songLyricsDiv" class="songLyricsV14 iComment-text">Wish I could see<br />
+Over the mountains<br />
+Alpenglow, so bright<br />
+<br />
+Alpenglow</p>
+</div>
+""" + _tail,
+    },
+    'vagalume': {
+        'vagalume.com.br/nightwish/alpenglow.html': _head + """
+<div id="lyricContent">
+<div id="lyrics">Wish I could see<br/>Over the mountains<br/>Alpenglow, so bright<br/><br/>Alpenglow</div>
+</div>
+""" + _tail,
+    },
+}
@@ -0,0 +1,233 @@
+"""
+Tests for the async search engine.
+"""
+import asyncio
+import threading
+import time
+from collections import Counter
+
+import pytest
+from sample_pages import sample_lyrics
+from sample_pages import sample_song
+
+from lyricfetch import CONFIG
+from lyricfetch import Song
+from lyricfetch import aio
+from lyricfetch import breaker
+from lyricfetch import sources
+from lyricfetch import transport
+from lyricfetch.scraping import Request
+from lyricfetch.scraping import source_steps
+
+
+@pytest.fixture(autouse=True)
+def reset_executor():
+    """
+    Give every test a new pool of threads.
+    """
+    aio.reset()
+    yield
+    aio.reset()
+
+
+def fast_source(song):
+    return 'Some lyrics'
+
+
+def empty_source(song):
+    return ''
+
+
+def slow_source(song):
+    pass
+
+
+@pytest.mark.parametrize('source', sources)
+def test_get_lyrics_source(sample_site, source):
+    """
+    Every source should find the sample lyrics when run by the async engine.
+    """
+    song = Song(**sample_song)
+    result = aio.run_loop(aio.get_lyrics(song, [source]))
+    assert result.source is source
+    assert list(result.runtimes) == [source]
+    assert all(line in song.lyrics for line in sample_lyrics)
+
+
+def test_get_lyrics_cancel(http_server, monkeypatch):
+    """
+    Once a source finds the lyrics, the rest should be cancelled before their
+    next request, and their requests in progress counted as wasted.
+    """
+    arrived = threading.Event()
+
+    def slow_page(handler):
+        arrived.set()
+        time.sleep(0.5)
+        return (200, {}, b'Page')
+
+    def winner(song):
+        arrived.wait(1)
+        return 'Some lyrics'
+
+    def plan(song):
+        return Request(http_server.url('/slow'), extract, 'raw')
+
+    def extract(body, song):
+        return Request(http_server.url('/next'), lambda body, song: 'Late')
+
+    http_server.routes['/slow'] = slow_page
+    monkeypatch.setitem(source_steps, slow_source, plan)
+    monkeypatch.setitem(CONFIG, 'cache', False)
+
+    song = Song('Artist', 'Title')
+    l_sources = [slow_source, empty_source, winner]
+    start = time.time()
+    result = aio.run_loop(aio.get_lyrics(song, l_sources))
+    assert time.time() - start < 0.5
+    assert result.source is winner
+    assert song.lyrics == 'Some lyrics'
+    assert set(result.runtimes) == {empty_source, winner}
+    assert result.counters['slow_source', 'cancelled'] == 1
+    assert result.counters['slow_source', 'wasted_requests'] == 1
+
+    # Let the thread sending the first request finish
+    time.sleep(0.6)
+    assert [path for path, _ in http_server.requests] == ['/slow']
+
+
+def test_get_lyrics_not_found(monkeypatch):
+    """
+    Songs that no source has should get an empty result, and songs that
+    already have lyrics should not be searched.
+    """
+    song = Song('Artist', 'Title')
+    result = aio.run_loop(aio.get_lyrics(song, [empty_source, empty_source]))
+    assert result.source is None
+    assert not song.lyrics
+
+    song.lyrics = 'Old lyrics'
+    assert aio.run_loop(aio.get_lyrics(song, [fast_source])) is None
+    monkeypatch.setitem(CONFIG, 'overwrite', True)
+    assert aio.run_loop(aio.get_lyrics(song, [fast_source])).source is not None
+
+
+def test_search(monkeypatch):
+    """
+    Every song should be searched, without going over the concurrency limit.
+    """
+    monkeypatch.setitem(CONFIG, 'async_concurrency', 3)
+    active = []
+
+    async def func(song):
+        active.append(song)
+        await asyncio.sleep(0.01)
+        running = len(active)
+        active.remove(song)
+        return song, running
+
+    async def collect(songs):
+        return [result async for result in aio.search(songs, func)]
+
+    songs = [Song('Artist', str(title)) for title in range(10)]
+    results = aio.run_loop(collect(songs))
+    assert sorted(str(song) for song, _ in results) == \
+        sorted(str(song) for song in songs)
+    assert max(running for _, running in results) == 3
+
+
+def test_scrape_cancelled_probe():
+    """
+    Cancelling the task of a half-open breaker's probe should let the next
+    search through.
+    """
+    started = threading.Event()
+
+    def stuck_source(song):
+        started.set()
+        time.sleep(0.2)
+        return 'Some lyrics'
+
+    async def cancel_probe():
+        task = asyncio.ensure_future(aio.scrape(stuck_source, song))
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    song = Song('Artist', 'Title')
+    circuit = breaker.get_breaker(stuck_source)
+    circuit.state = breaker.HALF_OPEN
+    aio.run_loop(cancel_probe())
+    assert circuit.state == breaker.HALF_OPEN
+    assert not circuit.probing
+    assert not circuit.outcomes
+
+
+def test_run_steps_plan(http_server, monkeypatch):
+    """
+    The plan of a source should run in the pool of threads, with the deadline
+    of the search, since it may send requests of its own.
+    """
+    threads = []
+
+    def plan(song):
+        threads.append(threading.current_thread())
+        transport.fetch(http_server.url('/lookup'))
+        return 'Some lyrics'
+
+    http_server.routes['/lookup'] = b'Hello'
+    monkeypatch.setitem(source_steps, slow_source, plan)
+    song = Song('Artist', 'Title')
+    assert aio.run_loop(aio.run_steps(slow_source, song)) == 'Some lyrics'
+    assert threads[0] is not threading.current_thread()
+
+    res = aio.run_loop(aio.scrape(slow_source, song, until=time.time() - 1))
+    assert res['error']
+    assert not res['lyrics']
+    assert len(http_server.requests) == 1
+
+
+def test_scrape_breaker_counters():
+    """
+    The transitions of the breakers should be added to the counters of the
+    search.
+    """
+    def down_source(song):
+        raise ConnectionError
+
+    song = Song('Artist', 'Title')
+    counters = Counter()
+    for _ in range(CONFIG['breaker']['min_calls'] + 1):
+        aio.run_loop(aio.scrape(down_source, song, counters))
+    assert counters['down_source', 'breaker_open'] == 1
+    assert counters['down_source', 'breaker_skipped'] == 1
+
+
+def test_thread_count(monkeypatch):
+    """
+    By default, every source of every song in flight should get a thread.
+    """
+    monkeypatch.setitem(CONFIG, 'async_concurrency', 4)
+    monkeypatch.setitem(CONFIG, 'async_threads', 0)
+    assert aio.thread_count() == 4 * len(sources)
+    assert aio.get_executor()._max_workers == 4 * len(sources)
+    monkeypatch.setitem(CONFIG, 'async_threads', 10)
+    assert aio.thread_count() == 10
+
+
+def test_run_loop():
+    """
+    Coroutines should run on a new event loop, which is closed afterwards.
+    """
+    async def current_loop():
+        await asyncio.sleep(0)
+        return asyncio.get_event_loop()
+
+    async def fail():
+        raise ValueError
+
+    loop = aio.run_loop(current_loop())
+    assert loop.is_closed()
+    with pytest.raises(ValueError):
+        aio.run_loop(fail())
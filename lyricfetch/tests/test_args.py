@@ -1,8 +1,10 @@
 """
 Module to test the different CLI arguments that can be passed.
 """
+import json
 import random
 import shutil
+import subprocess
 import sys
 import tempfile
 from pathlib import Path
@@ -13,6 +15,8 @@ from conftest import chdir
 from conftest import tag_mp3
 
 import lyricfetch
+import lyricfetch.bench
+import lyricfetch.cli
 import lyricfetch.song
 from lyricfetch import Song
 from lyricfetch import CONFIG
@@ -56,6 +60,122 @@ def test_argv_flag(monkeypatch, arg, config):
     assert CONFIG[config]
 
 
+def test_argv_no_cache(monkeypatch):
+    """
+    Check that the `--no-cache` flag disables the cache.
+    """
+    monkeypatch.setitem(CONFIG, 'cache', True)
+    monkeypatch.setattr(sys, 'argv', ['python', __file__, '--no-cache'])
+    parse_argv()
+    assert not CONFIG['cache']
+
+
+def test_argv_deadline(monkeypatch):
+    """
+    Check that the deadline passed in the command line is stored in CONFIG,
+    and that negative values are rejected.
+    """
+    monkeypatch.setitem(CONFIG, 'deadline', 0)
+    monkeypatch.setattr(sys, 'argv', ['python', __file__, '--deadline', '2.5'])
+    parse_argv()
+    assert CONFIG['deadline'] == 2.5
+
+    monkeypatch.setattr(sys, 'argv', ['python', __file__, '--deadline', '-1'])
+    with pytest.raises(SystemExit):
+        parse_argv()
+    assert CONFIG['deadline'] == 2.5
+
+
+def test_load_config_sections(monkeypatch, tmp_path):
+    """
+    Check that a partial section in the config file or the environment only
+    overrides the keys it sets, and keeps the defaults of the rest.
+    """
+    hedge = {'percentile': 90, 'delay': 2, 'max_sources': 3}
+    monkeypatch.setitem(CONFIG, 'hedge', hedge)
+    monkeypatch.setitem(CONFIG, 'jobcount', 1)
+    (tmp_path / 'lyricfetch').mkdir()
+    config = {'hedge': {'delay': 0.5}, 'jobcount': 4}
+    (tmp_path / 'config.json').write_text(json.dumps(config))
+    init = tmp_path / 'lyricfetch' / '__init__.py'
+    monkeypatch.setattr(lyricfetch, '__file__', str(init))
+    lyricfetch._load_config()
+    assert CONFIG['hedge'] == {'percentile': 90, 'delay': 0.5,
+                               'max_sources': 3}
+    assert CONFIG['jobcount'] == 4
+    assert hedge['delay'] == 2
+
+    monkeypatch.setenv('LFETCH_HEDGE', '{"max_sources": 5}')
+    lyricfetch._load_config()
+    assert CONFIG['hedge'] == {'percentile': 90, 'delay': 0.5,
+                               'max_sources': 5}
+
+
+def test_argv_warmup(monkeypatch):
+    """
+    Check that the `--warmup` option starts opening connections to the first
+    sources before the songs are read.
+    """
+    started = []
+    monkeypatch.setattr(lyricfetch.cli, 'start_warmup', started.append)
+    monkeypatch.setitem(CONFIG, 'warmup', 0)
+    monkeypatch.setattr(sys, 'argv', ['python', __file__, '--warmup', '3'])
+    parse_argv()
+    assert CONFIG['warmup'] == 3
+    assert started == [3]
+
+    monkeypatch.setattr(sys, 'argv', ['python', __file__, '--warmup', '-1'])
+    with pytest.raises(SystemExit):
+        parse_argv()
+    assert started == [3]
+
+
+def test_argv_record_replay(monkeypatch):
+    """
+    Check that the `--record` and `--replay` options set the archive and
+    disable the cache.
+    """
+    for key in ('cache', 'record', 'replay', 'replay_timing'):
+        monkeypatch.setitem(CONFIG, key, CONFIG[key])
+    monkeypatch.setattr(sys, 'argv', ['python', __file__, '--record', 'a'])
+    parse_argv()
+    assert CONFIG['record'] == 'a'
+    assert not CONFIG['replay']
+    assert not CONFIG['cache']
+
+    monkeypatch.setattr(sys, 'argv', ['python', __file__, '--replay', 'b',
+                                      '--replay-timing'])
+    parse_argv()
+    assert CONFIG['replay'] == 'b'
+    assert not CONFIG['record']
+    assert CONFIG['replay_timing']
+
+    monkeypatch.setattr(sys, 'argv', ['python', __file__, '--record', 'a',
+                                      '--replay', 'b'])
+    with pytest.raises(SystemExit):
+        parse_argv()
+
+
+def test_argv_engine(monkeypatch):
+    """
+    Check that `--engine async` makes `main()` run the async engine.
+    """
+    monkeypatch.setitem(CONFIG, 'engine', CONFIG['engine'])
+    monkeypatch.setattr(sys, 'argv', ['lyricfetch', '--engine', 'async',
+                                      'Artist - Title'])
+    ran = []
+    monkeypatch.setattr(lyricfetch.cli, 'run', ran.append)
+    monkeypatch.setattr(lyricfetch.cli, 'run_async',
+                        lambda songs: ran.append(('async', songs)))
+    assert main() == 0
+    assert CONFIG['engine'] == 'async'
+    assert ran == [('async', {Song('Artist', 'Title')})]
+
+    monkeypatch.setattr(sys, 'argv', ['python', __file__, '--engine', 'foo'])
+    with pytest.raises(SystemExit):
+        parse_argv()
+
+
 @pytest.mark.parametrize('num', [-1, 0])
 def test_argv_invalid_jobs(monkeypatch, num):
     """
@@ -276,3 +396,26 @@ def test_main_errors(monkeypatch):
     monkeypatch.setattr(lyricfetch.cli, 'parse_argv', filled_set)
     monkeypatch.setattr(lyricfetch.cli, 'run', fake_run)
     assert main() == 1
+
+
+def test_main_bench(monkeypatch):
+    """
+    `lyricfetch bench` should run the benchmarks with the rest of the
+    arguments.
+    """
+    received = []
+    monkeypatch.setattr(lyricfetch.bench, 'main', received.append)
+    monkeypatch.setattr(sys, 'argv', ['lyricfetch', 'bench', '--songs', '5'])
+    main()
+    assert received == [['--songs', '5']]
+
+
+def test_main_no_bench():
+    """
+    The benchmarks shouldn't be loaded unless they are run.
+    """
+    code = ('import sys, lyricfetch.cli; '
+            'print("lyricfetch.bench" in sys.modules)')
+    root = Path(lyricfetch.__file__).parent.parent
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=root)
+    assert output.strip() == b'False'
@@ -0,0 +1,67 @@
+"""
+Tests for the benchmarks module.
+"""
+import pytest
+
+from lyricfetch import CONFIG
+from lyricfetch.bench import bench_load
+from lyricfetch.bench import bench_slugs
+from lyricfetch.bench import main
+from lyricfetch.bench import make_library
+from lyricfetch.fakesite import SiteOptions
+from lyricfetch.fakesite import serve
+
+
+def test_make_library():
+    """
+    The library should be the same every time, with several songs per artist.
+    """
+    songs = make_library(50, songs_per_artist=5)
+    assert len(songs) == 50
+    assert len(set(song.artist for song in songs)) <= 10
+    assert all(song.artist and song.title and song.album for song in songs)
+    assert [s.title for s in songs] == [s.title for s in make_library(50, 5)]
+
+
+def test_bench_slugs(capsys):
+    """
+    Check that the benchmark reports the songs per second.
+    """
+    cold, warm = bench_slugs(make_library(20), rounds=2)
+    assert cold > 0 and warm > 0
+
+    main(['--slugs', '--songs', '20', '--rounds', '2'])
+    assert 'songs/s' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('engine', ['sequential', 'async'])
+def test_bench_load(monkeypatch, engine):
+    """
+    Every song should be searched, with the stats and resources of the run.
+    """
+    songs = make_library(8)
+    monkeypatch.setitem(CONFIG, 'cache', False)
+    monkeypatch.setitem(CONFIG, 'rate_limits', {'default': [0, 0]})
+    with serve(songs, SiteOptions(latency=0, miss_rate=0)) as url:
+        monkeypatch.setitem(CONFIG, 'host_override', url)
+        results = bench_load(songs, engine, jobs=2)
+    assert results['songs'] == results['found'] == 8
+    assert results['requests'] >= 8
+    assert results['throughput'] > 0
+    assert results['rss'] > 0
+    assert results['latencies'][50] <= results['latencies'][100]
+    records = results['stats'].source_stats.values()
+    assert sum(record.successes for record in records) == 8
+
+
+def test_bench_main(monkeypatch, capsys):
+    """
+    Check that the load test reports its results.
+    """
+    for key in ('cache', 'rate_limits', 'jobcount', 'host_override'):
+        monkeypatch.setitem(CONFIG, key, CONFIG[key])
+    main(['--songs', '5', '--latency', '0', '--stats'])
+    out = capsys.readouterr().out
+    assert 'Songs: 5 (' in out
+    assert 'songs/s' in out
+    assert 'p99' in out
@@ -0,0 +1,109 @@
+"""
+Tests for the circuit breakers.
+"""
+import time
+
+from lyricfetch import breaker
+from lyricfetch.breaker import CircuitBreaker
+
+
+def test_breaker_error_rate():
+    """
+    The breaker should open once the error rate goes over the limit, but not
+    before the minimum number of calls.
+    """
+    circuit = CircuitBreaker('source', window=10, min_calls=4, error_rate=0.5)
+    for _ in range(3):
+        circuit.record(0.1, error=True)
+        assert circuit.state == breaker.CLOSED
+        assert circuit.allow()
+    circuit.record(0.1, error=True)
+    assert circuit.state == breaker.OPEN
+    assert not circuit.allow()
+
+
+def test_breaker_timeout_rate():
+    """
+    The breaker should open once the timeout rate goes over the limit.
+    """
+    circuit = CircuitBreaker('source', min_calls=4, error_rate=1,
+                             timeout_rate=0.5)
+    circuit.record(0.1)
+    circuit.record(0.1)
+    circuit.record(0.1, timeout=True)
+    assert circuit.state == breaker.CLOSED
+    circuit.record(0.1, timeout=True)
+    assert circuit.state == breaker.OPEN
+
+
+def test_breaker_latency():
+    """
+    The breaker should open once the average latency goes over the limit.
+    """
+    circuit = CircuitBreaker('source', min_calls=2, latency=1)
+    circuit.record(0.5)
+    circuit.record(1)
+    assert circuit.state == breaker.CLOSED
+    circuit.record(3)
+    assert circuit.state == breaker.OPEN
+
+
+def test_breaker_latency_percentile():
+    """
+    Only the calls that didn't fail should count for the latency percentiles,
+    once there are enough of them.
+    """
+    circuit = CircuitBreaker('source', min_calls=3, latency=0)
+    circuit.record(1)
+    circuit.record(2)
+    circuit.record(30, timeout=True)
+    assert circuit.latency_percentile(90) is None
+    circuit.record(3)
+    circuit.record(4, error=True)
+    assert circuit.latency_percentile(90) == 3
+    assert circuit.latency_percentile(50) == 2
+
+
+def test_breaker_half_open():
+    """
+    After the cooldown, a single call should be allowed through, closing the
+    breaker if it succeeds or opening it again otherwise.
+    """
+    circuit = CircuitBreaker('source', min_calls=1, cooldown=0.05)
+    circuit.record(0.1, error=True)
+    assert not circuit.allow()
+
+    time.sleep(0.1)
+    assert circuit.allow()
+    assert circuit.state == breaker.HALF_OPEN
+    assert not circuit.allow()
+    circuit.record(0.1, error=True)
+    assert circuit.state == breaker.OPEN
+
+    time.sleep(0.1)
+    assert circuit.allow()
+    circuit.record(0.1)
+    assert circuit.state == breaker.CLOSED
+    assert circuit.allow()
+    assert circuit.allow()
+
+
+def test_breaker_release():
+    """
+    A probe that ends without an outcome should let another one through.
+    """
+    circuit = CircuitBreaker('source', min_calls=1, cooldown=0.05)
+    circuit.record(0.1, error=True)
+    time.sleep(0.1)
+    assert circuit.allow()
+    assert not circuit.allow()
+    circuit.release()
+    assert circuit.state == breaker.HALF_OPEN
+    assert circuit.allow()
+    circuit.record(0.1)
+    assert circuit.state == breaker.CLOSED
+
+    # Calls that end without an outcome while closed change nothing
+    circuit.release()
+    assert circuit.allow()
+    assert circuit.allow()
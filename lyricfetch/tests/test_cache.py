@@ -0,0 +1,301 @@
+"""
+Tests for the persistent caches.
+"""
+import os
+import time
+from collections import Counter
+from urllib.error import HTTPError
+
+import pytest
+
+from lyricfetch import CONFIG
+from lyricfetch import Song
+from lyricfetch import cache
+from lyricfetch import metrics
+from lyricfetch import run
+from lyricfetch.cache import NegativeCache
+from lyricfetch.cache import RedirectStore
+from lyricfetch.cache import ResponseCache
+from lyricfetch.cache import normalize_url
+
+
+@pytest.mark.parametrize('url,normalized', [
+    ('HTTP://Example.com:80', 'http://example.com/'),
+    ('https://example.com:443/a?b=1&a=2#x', 'https://example.com/a?a=2&b=1'),
+    ('http://example.com:8080/a', 'http://example.com:8080/a'),
+])
+def test_normalize_url(url, normalized):
+    """
+    Check that equivalent urls are normalized to the same string.
+    """
+    assert normalize_url(url) == normalized
+
+
+def test_get_ttl(monkeypatch):
+    """
+    Sources without a specific ttl should use the default one.
+    """
+    monkeypatch.setitem(CONFIG, 'cache_ttl', {'default': 10, 'genius': 5})
+    assert cache.get_ttl('genius') == 5
+    assert cache.get_ttl('azlyrics') == 10
+    assert cache.get_ttl(None) == 10
+
+
+def test_response_cache(cache_dir):
+    """
+    Check that bodies can be stored and read back from the cache, even from a
+    different instance using the same file.
+    """
+    response_cache = ResponseCache(cache_dir / 'test.sqlite', 1024)
+    assert response_cache.get('key') is None
+    response_cache.put('key', b'body', 'etag', 'yesterday')
+    entry = response_cache.get('key')
+    assert entry.body == b'body'
+    assert entry.etag == 'etag'
+    assert entry.last_modified == 'yesterday'
+
+    other_cache = ResponseCache(cache_dir / 'test.sqlite', 1024)
+    assert other_cache.get('key').body == b'body'
+
+
+def test_response_cache_eviction(cache_dir):
+    """
+    The least recently used entries should be evicted when the cache grows
+    over its maximum size.
+    """
+    # Random bytes, so they can't be compressed
+    body = os.urandom(1000)
+    response_cache = ResponseCache(cache_dir / 'test.sqlite', 2500)
+    response_cache.access_resolution = 0
+    response_cache.put('first', body)
+    response_cache.put('second', body)
+    assert response_cache.get('first')
+    response_cache.put('third', body)
+    assert response_cache.size() <= 2500
+    assert response_cache.get('second') is None
+    assert response_cache.get('first')
+    assert response_cache.get('third')
+
+
+def test_response_cache_size(cache_dir):
+    """
+    The total size should be kept up to date when entries are replaced or
+    evicted, and computed for databases that didn't keep it.
+    """
+    def real_size(cache):
+        return cache.execute('SELECT SUM(size) FROM responses')[0][0]
+
+    path = cache_dir / 'test.sqlite'
+    response_cache = ResponseCache(path, 2500)
+    response_cache.evict_batch = 1
+    for key in ['first', 'second', 'first', 'third', 'fourth']:
+        response_cache.put(key, os.urandom(1000))
+        assert response_cache.size() == real_size(response_cache)
+    assert 2000 < response_cache.size() <= 2500
+    assert response_cache.get('first') is None
+
+    response_cache.execute('DROP TABLE responses_size')
+    response_cache.close()
+    response_cache = ResponseCache(path, 2500)
+    assert response_cache.size() == real_size(response_cache)
+
+
+def test_response_cache_access(cache_dir):
+    """
+    Reading an entry should only update its access time once in a while.
+    """
+    def accessed(cache):
+        return cache.execute('SELECT accessed FROM responses')[0][0]
+
+    response_cache = ResponseCache(cache_dir / 'test.sqlite', 1024)
+    response_cache.put('key', b'body')
+    stored = accessed(response_cache)
+    time.sleep(0.01)
+    assert response_cache.get('key')
+    assert accessed(response_cache) == stored
+
+    response_cache.access_resolution = 0
+    assert response_cache.get('key')
+    assert accessed(response_cache) > stored
+
+
+def test_fetch_cached(http_server):
+    """
+    A fresh response should be read from the cache without sending any
+    requests.
+    """
+    http_server.routes['/page'] = b'Hello'
+    url = http_server.url('/page')
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        assert cache.fetch(url, 'html') == b'Hello'
+        assert cache.fetch(url, 'html') == b'Hello'
+        assert cache.fetch(url, 'json') == b'Hello'
+    assert len(http_server.requests) == 2
+    assert counters['some_source', 'cache_hits'] == 1
+    assert counters['some_source', 'cache_misses'] == 2
+
+
+def test_fetch_revalidate(http_server, monkeypatch):
+    """
+    Stale responses should be revalidated with the server before being used.
+    """
+    def etag(handler):
+        if handler.headers.get('If-None-Match') == '"v1"':
+            return (304, {}, b'')
+        return (200, {'ETag': '"v1"'}, b'Hello')
+
+    http_server.routes['/page'] = etag
+    monkeypatch.setitem(CONFIG, 'cache_ttl', {'default': 0})
+    url = http_server.url('/page')
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        assert cache.fetch(url, 'html') == b'Hello'
+        time.sleep(0.01)
+        assert cache.fetch(url, 'html') == b'Hello'
+    assert len(http_server.requests) == 2
+    assert http_server.requests[1][1]['If-None-Match'] == '"v1"'
+    assert counters['some_source', 'cache_revalidated'] == 1
+
+
+def test_fetch_disabled(http_server, monkeypatch):
+    """
+    Every request should hit the network when the cache is disabled.
+    """
+    http_server.routes['/page'] = b'Hello'
+    monkeypatch.setitem(CONFIG, 'cache', False)
+    cache.fetch(http_server.url('/page'), 'html')
+    cache.fetch(http_server.url('/page'), 'html')
+    assert len(http_server.requests) == 2
+
+
+def test_negative_cache(cache_dir):
+    """
+    Check that misses are remembered per source, and that artist and title are
+    normalized before being compared.
+    """
+    negative_cache = NegativeCache(cache_dir / 'test.sqlite', 100)
+    song = Song(artist='Gojira', title='Flying whales')
+    assert negative_cache.misses(song, ['AZL', 'GEN']) == set()
+    negative_cache.add(song, ['AZL'])
+    assert negative_cache.misses(song, ['AZL', 'GEN']) == {'AZL'}
+
+    same_song = Song(artist='GOJIRA ', title='flying  whales')
+    assert negative_cache.misses(same_song, ['AZL', 'GEN']) == {'AZL'}
+    other_song = Song(artist='Gojira', title='The heaviest matter')
+    assert negative_cache.misses(other_song, ['AZL', 'GEN']) == set()
+
+
+def test_negative_cache_ttl(cache_dir):
+    """
+    Misses older than the ttl should be ignored, and removed when purging.
+    """
+    negative_cache = NegativeCache(cache_dir / 'test.sqlite', 0.05)
+    song = Song(artist='Gojira', title='Flying whales')
+    negative_cache.add(song, ['AZL'])
+    assert negative_cache.misses(song, ['AZL']) == {'AZL'}
+    time.sleep(0.1)
+    assert negative_cache.misses(song, ['AZL']) == set()
+    negative_cache.purge()
+    assert negative_cache.execute('SELECT COUNT(*) FROM misses') == [(0,)]
+
+
+def test_known_misses_disabled(monkeypatch):
+    """
+    No misses should be remembered when the negative cache is disabled.
+    """
+    song = Song(artist='Gojira', title='Flying whales')
+    monkeypatch.setitem(CONFIG, 'negative_ttl', 0)
+    cache.add_misses(song, ['AZL'])
+    assert cache.known_misses(song, ['AZL']) == set()
+
+    monkeypatch.setitem(CONFIG, 'negative_ttl', 100)
+    cache.add_misses(song, ['AZL'])
+    assert cache.known_misses(song, ['AZL']) == {'AZL'}
+
+
+def test_purge_misses(monkeypatch):
+    """
+    Expired misses should be removed from the database before every run.
+    """
+    song = Song(artist='Gojira', title='Flying whales')
+    monkeypatch.setitem(CONFIG, 'negative_ttl', 0.05)
+    monkeypatch.setitem(CONFIG, 'host_override', 'http://127.0.0.1:1')
+    cache.add_misses(song, ['AZL'])
+    time.sleep(0.1)
+    run.prepare_run()
+    negative_cache = cache.get_negative_cache()
+    assert negative_cache.execute('SELECT COUNT(*) FROM misses') == [(0,)]
+
+
+def test_redirect_store(cache_dir):
+    """
+    Redirects that only change the origin should apply to every url in it,
+    and the rest only to their exact url.
+    """
+    redirects = RedirectStore(cache_dir / 'test.sqlite', 1000)
+    redirects.add([
+        ('http://www.example.com/a', 301, 'https://example.com/a'),
+        ('https://example.com/old?x=1', 308, 'https://example.com/new'),
+        ('https://example.com/temporary', 302, 'https://example.com/b'),
+    ])
+    assert redirects.rewrite('http://www.example.com/b?c=d') == (
+        'https://example.com/b?c=d', ['http://www.example.com'])
+    assert redirects.rewrite('http://www.example.com/old?x=1')[0] == \
+        'https://example.com/new'
+    assert redirects.rewrite('https://example.com/temporary') == (
+        'https://example.com/temporary', [])
+
+    redirects.remove(['http://www.example.com'])
+    assert redirects.rewrite('http://www.example.com/b')[1] == []
+
+
+def test_fetch_redirects(http_server):
+    """
+    Permanent redirects should be followed only once, and forgotten if their
+    target stops working.
+    """
+    http_server.routes['/old'] = (301, {'Location': '/new'}, b'')
+    http_server.routes['/new'] = b'Hello'
+    url = http_server.url('/old')
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        assert cache.fetch(url, 'html') == b'Hello'
+        assert cache.fetch(url, 'raw') == b'Hello'
+    assert [path for path, _ in http_server.requests] == ['/old', '/new',
+                                                          '/new']
+    assert counters['some_source', 'redirects_saved'] == 1
+
+    del http_server.routes['/new']
+    with pytest.raises(HTTPError):
+        cache.fetch(url, 'json')
+    assert cache.get_redirects().rewrite(url) == (url, [])
+
+
+def test_fetch_redirects_origin(http_server):
+    """
+    Redirects for a whole origin should only be forgotten when their target
+    can't be used, not when a single page is missing.
+    """
+    port = http_server.server_port
+    old_origin = 'http://localhost:{}'.format(port)
+    new_origin = 'http://127.0.0.1:{}'.format(port)
+
+    def moved(handler):
+        if handler.headers['Host'].startswith('localhost'):
+            return (301, {'Location': new_origin + handler.path}, b'')
+        return (200, {}, b'Hello')
+
+    for path in ['/page', '/other', '/gone']:
+        http_server.routes[path] = moved
+    assert cache.fetch(old_origin + '/page', 'html') == b'Hello'
+    assert len(http_server.requests) == 2
+    with pytest.raises(HTTPError):
+        cache.fetch(old_origin + '/missing', 'html')
+    assert cache.fetch(old_origin + '/other', 'html') == b'Hello'
+    assert len(http_server.requests) == 4
+
+    http_server.routes['/gone'] = (421, {}, b'')
+    with pytest.raises(HTTPError):
+        cache.fetch(old_origin + '/gone', 'html')
+    assert cache.get_redirects().rewrite(old_origin + '/page')[1] == []
@@ -0,0 +1,147 @@
+"""
+Tests for the coalescing of identical requests.
+"""
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from lyricfetch import CONFIG
+from lyricfetch import metrics
+from lyricfetch import transport
+from lyricfetch.coalesce import SingleFlight
+from lyricfetch.coalesce import WaitTimeout
+from lyricfetch.scraping import fetch_body
+
+
+def test_single_flight():
+    """
+    Concurrent calls with the same key should run only once, and share their
+    result or error.
+    """
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def call(value):
+        calls.append(value)
+        release.wait(5)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(flights.do, 'key', lambda: call(1))
+                   for _ in range(3)]
+        other = executor.submit(flights.do, 'other', lambda: call(2))
+        while len(flights.flights) < 2 or len(calls) < 2:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        release.set()
+        assert [future.result() for future in futures] == [1, 1, 1]
+        assert other.result() == 2
+    assert sorted(calls) == [1, 2]
+    assert not flights.flights
+
+    release.clear()
+    error = ValueError('some error')
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(flights.do, 'key', lambda: call(error))
+                   for _ in range(2)]
+        time.sleep(0.1)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result()
+
+    # Calls after the previous one has finished run again
+    assert flights.do('key', lambda: 3) == 3
+
+
+def test_single_flight_timeout():
+    """
+    Waiting for a call in progress should time out.
+    """
+    flights = SingleFlight()
+    release = threading.Event()
+    thread = threading.Thread(target=flights.do,
+                              args=('key', lambda: release.wait(5)))
+    thread.start()
+    while not flights.flights:
+        time.sleep(0.01)
+    with pytest.raises(WaitTimeout):
+        flights.do('key', lambda: None, timeout=0.05)
+    release.set()
+    thread.join()
+
+
+def test_fetch_body_coalesced(http_server, monkeypatch):
+    """
+    Threads fetching the same page at the same time should send a single
+    request.
+    """
+    monkeypatch.setitem(CONFIG, 'cache', False)
+    monkeypatch.setitem(CONFIG, 'memory_cache', 0)
+
+    def slow(handler):
+        time.sleep(0.3)
+        return (200, {}, b'album')
+
+    http_server.routes['/album'] = slow
+    url = http_server.url('/album')
+    counters = Counter()
+
+    def fetch():
+        with metrics.track('darklyrics', counters):
+            return fetch_body(url)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: fetch(), range(4)))
+    assert results == [b'album'] * 4
+    assert len(http_server.requests) == 1
+    assert counters['darklyrics', 'coalesced'] == 3
+
+    # Waiters can't go over their deadline
+    thread = threading.Thread(target=fetch_body, args=(url,))
+    thread.start()
+    time.sleep(0.05)
+    with transport.deadline(0.05):
+        with pytest.raises(transport.DeadlineExceeded):
+            fetch_body(url)
+    thread.join()
+
+
+def test_fetch_body_cancelled_leader(http_server, monkeypatch):
+    """
+    A thread waiting for a request of another search that gets cancelled
+    should send its own request.
+    """
+    monkeypatch.setitem(CONFIG, 'cache', False)
+    monkeypatch.setitem(CONFIG, 'memory_cache', 0)
+    arrived = threading.Event()
+
+    def slow(handler):
+        arrived.set()
+        time.sleep(0.3)
+        return (200, {}, b'album')
+
+    http_server.routes['/album'] = slow
+    url = http_server.url('/album')
+    token = transport.CancelToken()
+
+    def cancelled_search():
+        with transport.cancellation(token):
+            with pytest.raises(transport.Cancelled):
+                fetch_body(url)
+
+    thread = threading.Thread(target=cancelled_search)
+    thread.start()
+    arrived.wait(1)
+    waiter = ThreadPoolExecutor(max_workers=1).submit(fetch_body, url)
+    time.sleep(0.05)
+    token.cancel()
+    thread.join()
+    assert waiter.result(timeout=2) == b'album'
+    assert len(http_server.requests) == 2
@@ -0,0 +1,98 @@
+"""
+Tests for the in-memory cache of documents.
+"""
+from collections import Counter
+
+from sample_pages import sample_pages
+from sample_pages import sample_song
+
+from lyricfetch import CONFIG
+from lyricfetch import Song
+from lyricfetch import documents
+from lyricfetch import metrics
+from lyricfetch.documents import DocumentCache
+from lyricfetch.scraping import fetch_body
+from lyricfetch.scraping import make_soup
+from lyricfetch.scraping import darklyrics
+
+
+def test_document_cache():
+    """
+    The least recently used documents should be evicted when the cache is
+    full.
+    """
+    cache = DocumentCache(10)
+    cache.put('a', b'aaaa', 4)
+    cache.put('b', b'bbbb', 4)
+    assert cache.get('a') == b'aaaa'
+    cache.put('c', b'cccc', 4)
+    assert cache.get('b') is None
+    assert cache.get('c') == b'cccc'
+    cache.put('d', b'd' * 11, 11)
+    assert cache.get('d') is None
+
+    stats = cache.stats()
+    assert stats['documents'] == 2
+    assert stats['size'] == 8
+    assert stats['hits'] == 2
+    assert stats['misses'] == 2
+    assert stats['hit_rate'] == 50
+
+
+def test_get_documents(monkeypatch):
+    """
+    The cache should be disabled if its size is 0.
+    """
+    monkeypatch.setitem(CONFIG, 'memory_cache', 0)
+    assert documents.get_documents() is None
+    monkeypatch.setitem(CONFIG, 'memory_cache', 100)
+    assert documents.get_documents() is documents.get_documents()
+    assert documents.get_documents().max_size == 100
+
+
+def test_fetch_body(http_server):
+    """
+    Pages should only be fetched once.
+    """
+    http_server.routes['/page'] = b'<html></html>'
+    url = http_server.url('/page')
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        assert fetch_body(url) == fetch_body(url) == b'<html></html>'
+        assert fetch_body(url, parser='raw') == b'<html></html>'
+    assert len(http_server.requests) == 2
+    assert counters['some_source', 'memory_hits'] == 1
+    assert counters['some_source', 'memory_misses'] == 2
+
+
+def test_make_soup(monkeypatch):
+    """
+    Only shared soups should be kept in the cache, as long as they're not too
+    big.
+    """
+    body = b'<html><p>Lyrics</p></html>'
+    assert make_soup(body) is not make_soup(body)
+    assert make_soup(body, shared=True) is make_soup(body, shared=True)
+
+    monkeypatch.setitem(CONFIG, 'memory_cache_parsed', len(body))
+    assert make_soup(body, shared=True) is not make_soup(body, shared=True)
+
+
+def test_darklyrics_album(monkeypatch):
+    """
+    Album pages should be parsed only once for all their songs.
+    """
+    page = next(iter(sample_pages['darklyrics'].values())).encode()
+    fetches = []
+
+    def fetch(url, parser, region=None):
+        fetches.append(url)
+        return page
+
+    monkeypatch.setattr('lyricfetch.cache.fetch', fetch)
+    assert 'Wish I could see' in darklyrics(Song(**sample_song))
+    song = Song(sample_song['artist'], 'Shudder before the beautiful',
+                sample_song['album'])
+    assert 'Deep in the heart' in darklyrics(song)
+    assert len(fetches) == 1
+    assert documents.get_documents().hits == 2
@@ -0,0 +1,109 @@
+"""
+Tests for the local server that stands in for every website.
+"""
+import threading
+from urllib.error import HTTPError
+
+import pytest
+
+from lyricfetch import CONFIG
+from lyricfetch import transport
+from lyricfetch.bench import make_library
+from lyricfetch.fakesite import DISTRIBUTIONS
+from lyricfetch.fakesite import SiteOptions
+from lyricfetch.fakesite import StandInServer
+from lyricfetch.fakesite import make_lyrics
+from lyricfetch.fakesite import serve
+from lyricfetch.run import get_lyrics
+from lyricfetch.scraping import source_steps
+
+SONGS = make_library(6, songs_per_artist=3)
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    """
+    Start a StandInServer in a background thread, and send every request to
+    it. Returns a function that starts it with some options.
+    """
+    servers = []
+
+    def start(**options):
+        server = StandInServer(SONGS, SiteOptions(**options))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        monkeypatch.setitem(CONFIG, 'host_override', server.url)
+        return server
+
+    monkeypatch.setitem(CONFIG, 'cache', False)
+    monkeypatch.setitem(CONFIG, 'overwrite', True)
+    monkeypatch.setitem(CONFIG, 'rate_limits', {'default': [0, 0]})
+    transport.reset()
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+    transport.reset()
+
+
+@pytest.mark.parametrize('source', source_steps)
+def test_stand_in_sources(stand_in, source):
+    """
+    Every source should find the lyrics of every song in the server.
+    """
+    stand_in(latency=0, miss_rate=0)
+    for song in SONGS:
+        result = get_lyrics(song, l_sources=[source])
+        assert result.source is source
+        assert make_lyrics(song)[1] in song.lyrics
+
+
+def test_stand_in_errors(stand_in):
+    """
+    The server should fail, throttle and miss songs as set in its options.
+    """
+    server = stand_in(latency=0, miss_rate=1)
+    assert get_lyrics(SONGS[0]).source is None
+    assert server.respond('www.azlyrics.com', '/')[0] == 404
+
+    server.options = SiteOptions(latency=0, error_rate=1)
+    assert server.respond('www.azlyrics.com', '/')[0] == 503
+    with pytest.raises(HTTPError):
+        transport.fetch('https://www.azlyrics.com/')
+
+    server.options = SiteOptions(latency=0, throttle=1)
+    assert server.respond('www.azlyrics.com', '/')[0] == 404
+    status, headers, _ = server.respond('www.azlyrics.com', '/')
+    assert status == 429
+    assert headers['Retry-After'] == '1'
+    # Every host has its own limit
+    assert server.respond('genius.com', '/')[0] == 404
+
+
+@pytest.mark.parametrize('distribution', DISTRIBUTIONS)
+def test_stand_in_delay(distribution):
+    """
+    Delays should be positive, and average close to the latency.
+    """
+    options = SiteOptions(latency=0.1, distribution=distribution)
+    server = StandInServer(SONGS, options)
+    try:
+        delays = [server.delay() for _ in range(2000)]
+    finally:
+        server.server_close()
+    assert all(delay >= 0 for delay in delays)
+    assert 0.08 < sum(delays) / len(delays) < 0.12
+
+    with pytest.raises(ValueError):
+        StandInServer(SONGS, SiteOptions(distribution='whatever'))
+
+
+def test_serve(monkeypatch):
+    """
+    The server should run in a separate process.
+    """
+    monkeypatch.setitem(CONFIG, 'cache', False)
+    monkeypatch.setitem(CONFIG, 'overwrite', True)
+    with serve(SONGS, SiteOptions(latency=0, miss_rate=0)) as url:
+        monkeypatch.setitem(CONFIG, 'host_override', url)
+        assert get_lyrics(SONGS[0]).source is not None
@@ -0,0 +1,74 @@
+"""
+Tests for the pool of parsing processes.
+"""
+from collections import Counter
+
+import pytest
+from sample_pages import sample_lyrics
+from sample_pages import sample_song
+
+from lyricfetch import CONFIG
+from lyricfetch import Song
+from lyricfetch import metrics
+from lyricfetch import parsepool
+from lyricfetch import sources
+from lyricfetch.run import get_lyrics_threaded
+from lyricfetch.scraping import run_steps
+from lyricfetch.scraping import source_steps
+
+
+@pytest.fixture
+def parse_pool(monkeypatch):
+    """
+    Start a pool of two parsing processes.
+    """
+    monkeypatch.setitem(CONFIG, 'parse_workers', 2)
+    pool = parsepool.start()
+    yield pool
+    parsepool.stop()
+
+
+def test_pool_disabled(monkeypatch):
+    """
+    The pool should not be started unless it's enabled in CONFIG.
+    """
+    monkeypatch.setitem(CONFIG, 'parse_workers', 0)
+    assert parsepool.start() is None
+
+
+def test_pool_extract(sample_site, parse_pool, monkeypatch):
+    """
+    The results and counters of the extract steps run in the pool should be
+    the same as in the current thread.
+    """
+    assert parse_pool is not None
+    # Pages would be downloaded only once
+    monkeypatch.setitem(CONFIG, 'memory_cache', 0)
+    # Validations are random, so they wouldn't match
+    monkeypatch.setitem(CONFIG, 'fast_path_validation', 0)
+    for source in sources:
+        plan = source_steps[source]
+        counters = Counter()
+        with metrics.track(source, counters):
+            lyrics = run_steps(plan, Song(**sample_song))
+        assert all(line in lyrics for line in sample_lyrics)
+        assert counters[source.__name__, 'parse_ms'] >= 0
+
+        parsepool.stop()
+        expected = Counter()
+        with metrics.track(source, expected):
+            assert run_steps(plan, Song(**sample_song)) == lyrics
+        parsepool.start()
+
+        del counters[source.__name__, 'parse_ms']
+        del expected[source.__name__, 'parse_ms']
+        assert counters == expected
+
+
+def test_pool_threaded(sample_site, parse_pool):
+    """
+    Searches with threads should hand the pages to the pool.
+    """
+    result = get_lyrics_threaded(Song(**sample_song))
+    assert result.source is not None
+    assert all(line in result.song.lyrics for line in sample_lyrics)
@@ -0,0 +1,116 @@
+"""
+Tests for the per-host rate limiter.
+"""
+import multiprocessing
+import time
+
+import pytest
+
+from lyricfetch import CONFIG
+from lyricfetch import ratelimit
+from lyricfetch.ratelimit import RateLimiter
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    """
+    A fresh rate limiter installed as the one used by this process.
+    """
+    previous = ratelimit.get_limiter()
+    new_limiter = RateLimiter(slots=4)
+    ratelimit.set_limiter(new_limiter)
+    monkeypatch.setitem(CONFIG, 'rate_limits', {'default': [0, 0]})
+    monkeypatch.setitem(CONFIG, 'max_host_connections', 0)
+    yield new_limiter
+    ratelimit.set_limiter(previous)
+
+
+def take_tokens(limiter, host, count):
+    """
+    Helper to take tokens from a limiter in a different process.
+    """
+    for _ in range(count):
+        slot = limiter.try_acquire(host, 0.001, 5, 100)[1]
+        limiter.release(slot)
+
+
+def test_get_limits(monkeypatch):
+    """
+    Hosts without specific limits should use the default ones.
+    """
+    monkeypatch.setitem(CONFIG, 'rate_limits', {
+        'default': [1, 2],
+        'example.com': [3, 4],
+    })
+    assert ratelimit.get_limits('example.com') == (3, 4)
+    assert ratelimit.get_limits('example.org') == (1, 2)
+
+
+def test_try_acquire_burst(limiter):
+    """
+    A host should allow `burst` requests at once, and then wait for the bucket
+    to refill.
+    """
+    for _ in range(3):
+        allowed, slot, wait = limiter.try_acquire('example.com', 10, 3, 100)
+        assert allowed
+        limiter.release(slot)
+
+    allowed, slot, wait = limiter.try_acquire('example.com', 10, 3, 100)
+    assert not allowed
+    assert 0 < wait <= 0.1
+
+    # Other hosts have their own bucket
+    assert limiter.try_acquire('example.org', 10, 3, 100)[0]
+
+
+def test_try_acquire_max_active(limiter):
+    """
+    No more than `max_active` requests can be in flight for the same host.
+    """
+    allowed, slot, _ = limiter.try_acquire('example.com', 0, 1, 1)
+    assert allowed
+    assert not limiter.try_acquire('example.com', 0, 1, 1)[0]
+    limiter.release(slot)
+    assert limiter.try_acquire('example.com', 0, 1, 1)[0]
+
+
+def test_try_acquire_no_slots(limiter):
+    """
+    Hosts that don't fit in the limiter shouldn't be limited.
+    """
+    for i in range(4):
+        limiter.try_acquire(f'host{i}', 0.001, 1, 1)
+    for _ in range(3):
+        allowed, slot, _ = limiter.try_acquire('host4', 0.001, 1, 1)
+        assert allowed
+        assert slot is None
+
+
+def test_acquire_waits(limiter, monkeypatch):
+    """
+    `acquire()` should block until the bucket has enough tokens, or raise an
+    error if that would take longer than the timeout.
+    """
+    monkeypatch.setitem(CONFIG, 'rate_limits', {'default': [10, 1]})
+    ratelimit.release(ratelimit.acquire('example.com')[0])
+    start = time.time()
+    slot, waited = ratelimit.acquire('example.com')
+    ratelimit.release(slot)
+    assert 0.05 < time.time() - start < 0.5
+    assert waited > 0.05
+
+    with pytest.raises(TimeoutError):
+        ratelimit.acquire('example.com', timeout=0.01)
+
+
+def test_limiter_shared_between_processes(limiter):
+    """
+    Tokens taken by a child process should not be available to the parent.
+    """
+    process = multiprocessing.Process(target=take_tokens,
+                                      args=(limiter, 'example.com', 5))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    assert not limiter.try_acquire('example.com', 0.001, 5, 100)[0]
@@ -0,0 +1,136 @@
+"""
+Tests for the partial downloads and parsing of pages.
+"""
+from collections import Counter
+
+import pytest
+
+from lyricfetch import CONFIG
+from lyricfetch import metrics
+from lyricfetch import transport
+from lyricfetch.region import Region
+from lyricfetch.scraping import get_url
+
+PAGE = b"""<html><body>
+<div class="header"><div>Menu</div></div>
+<DIV class="box lyricbox" id='lyrics'>
+  <div class="verse">First <br/>verse</div>
+  <div/>
+  <div class="verse">Second verse</div>
+</DIV>
+<div class="footer">""" + b'x' * 1000 + b"""</div>
+</body></html>"""
+REGION = PAGE[PAGE.index(b'<DIV'):PAGE.index(b'</DIV>') + 6]
+
+
+@pytest.mark.parametrize('region', [
+    Region(id='lyrics'),
+    Region('div', id='lyrics'),
+    Region('div', class_='lyricbox'),
+])
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, len(PAGE)])
+def test_scanner(region, chunk_size):
+    """
+    The scanner should find the region no matter how the body is split.
+    """
+    scanner = region.scanner()
+    done = False
+    for start in range(0, len(PAGE), chunk_size):
+        done = scanner.feed(PAGE[start:start + chunk_size])
+        if done:
+            break
+    assert done
+    assert PAGE[scanner.start:scanner.end] == REGION
+    assert region.extract(PAGE) == REGION
+
+
+def test_scanner_missing():
+    """
+    Bodies without the region should be read completely.
+    """
+    region = Region('div', class_='lyrics')
+    scanner = region.scanner()
+    assert not scanner.feed(PAGE)
+    assert scanner.start is None
+    assert region.extract(PAGE) == PAGE
+    with pytest.raises(ValueError):
+        Region('div')
+
+
+def test_fetch_region(http_server):
+    """
+    The download should stop right after the end of the region.
+    """
+    http_server.routes['/page'] = PAGE
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        response = transport.fetch(http_server.url('/page'),
+                                   region=Region(id='lyrics'))
+    assert response.body.endswith(REGION)
+    assert counters['some_source', 'early_stops'] == 1
+
+    # Transport chunks are big, so the stop is only noticeable on big pages
+    http_server.routes['/big'] = PAGE + b'x' * 10 * transport.CHUNK_SIZE
+    response = transport.fetch(http_server.url('/big'),
+                               region=Region(id='lyrics'))
+    assert len(response.body) <= transport.CHUNK_SIZE
+
+
+def test_fetch_region_reuses_connections(http_server):
+    """
+    Stopping early should only close the connection if there's a lot left to
+    read.
+    """
+    # Both pages are longer than the first chunk read
+    http_server.routes['/page'] = PAGE + b'x' * transport.CHUNK_SIZE
+    http_server.routes['/big'] = PAGE + b'x' * 10 * transport.CHUNK_SIZE
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        for _ in range(5):
+            transport.fetch(http_server.url('/page'),
+                            region=Region(id='lyrics'))
+    assert counters['some_source', 'early_stops'] == 5
+    assert counters['some_source', 'connections_opened'] == 1
+    assert counters['some_source', 'connections_reused'] == 4
+
+    counters.clear()
+    with metrics.track('some_source', counters):
+        for _ in range(2):
+            transport.fetch(http_server.url('/big'),
+                            region=Region(id='lyrics'))
+    assert counters['some_source', 'early_stops'] == 2
+    # The first big page closes the connection, so the second needs a new one
+    assert counters['some_source', 'connections_opened'] == 1
+    assert counters['some_source', 'connections_reused'] == 1
+
+
+def test_fetch_too_large(http_server, monkeypatch):
+    """
+    Responses bigger than the maximum size should be abandoned, and not
+    retried.
+    """
+    monkeypatch.setitem(CONFIG, 'max_body_size', 100)
+    http_server.routes['/page'] = PAGE
+    with pytest.raises(transport.BodyTooLarge):
+        transport.fetch(http_server.url('/page'))
+    assert len(http_server.requests) == 1
+
+    monkeypatch.setitem(CONFIG, 'max_body_size', 0)
+    assert transport.fetch(http_server.url('/page')).body == PAGE
+
+
+def test_get_url_region(http_server):
+    """
+    Only the region should be parsed, and cached separately from the full
+    page.
+    """
+    http_server.routes['/page'] = PAGE
+    url = http_server.url('/page')
+    soup = get_url(url, region=Region('div', id='lyrics'))
+    assert soup.find(class_='header') is None
+    assert soup.select_one('div#lyrics').get_text().split() == [
+        'First', 'verse', 'Second', 'verse']
+
+    soup = get_url(url)
+    assert soup.find(class_='header') is not None
+    assert len(http_server.requests) == 2
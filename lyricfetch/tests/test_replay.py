@@ -0,0 +1,93 @@
+"""
+Tests for the record and replay of responses.
+"""
+from urllib.error import HTTPError
+
+import pytest
+
+from lyricfetch import CONFIG
+from lyricfetch import replay
+from lyricfetch import transport
+from lyricfetch.region import Region
+from lyricfetch.scraping import get_url
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    """
+    Path of an empty archive, which is closed after the test.
+    """
+    monkeypatch.setitem(CONFIG, 'cache', False)
+    monkeypatch.setitem(CONFIG, 'record', '')
+    monkeypatch.setitem(CONFIG, 'replay', '')
+    monkeypatch.setitem(CONFIG, 'replay_timing', False)
+    replay.reset()
+    yield str(tmp_path / 'archive.sqlite')
+    replay.reset()
+
+
+def test_record_replay(http_server, archive, monkeypatch):
+    """
+    Responses recorded to the archive should be served back exactly the same
+    without sending any request.
+    """
+    page = b'<html><body><div id="lyrics">Alpenglow</div>' + b'x' * 100 + \
+        b'</body></html>'
+    http_server.routes['/page'] = page
+    http_server.routes['/old'] = (301, {'Location': '/page'}, b'')
+    http_server.routes['/json'] = (200, {'X-Custom': 'yes'}, b'{"a": 1}')
+
+    monkeypatch.setitem(CONFIG, 'record', archive)
+    region = Region('div', id='lyrics')
+    recorded = [
+        transport.fetch(http_server.url('/old')),
+        transport.fetch(http_server.url('/json')),
+        transport.fetch(http_server.url('/page'), region=region),
+    ]
+    with pytest.raises(HTTPError):
+        transport.fetch(http_server.url('/missing'))
+    requests = len(http_server.requests)
+    assert recorded[0].history
+
+    monkeypatch.setitem(CONFIG, 'record', '')
+    monkeypatch.setitem(CONFIG, 'replay', archive)
+    replayed = [
+        transport.fetch(http_server.url('/old')),
+        transport.fetch(http_server.url('/json')),
+        transport.fetch(http_server.url('/page'), region=region),
+    ]
+    for original, response in zip(recorded, replayed):
+        assert response.url == original.url
+        assert response.status == original.status
+        assert response.body == original.body
+        assert response.history == original.history
+        assert dict(response.headers) == dict(original.headers)
+    assert replayed[2].body.endswith(b'</div>')
+    assert get_url(http_server.url('/json'), parser='json') == {'a': 1}
+
+    with pytest.raises(HTTPError) as error:
+        transport.fetch(http_server.url('/missing'))
+    assert error.value.code == 404
+    with pytest.raises(replay.NotRecorded):
+        transport.fetch(http_server.url('/page'))
+    assert len(http_server.requests) == requests
+
+
+def test_replay_timing(http_server, archive, monkeypatch):
+    """
+    The original timings should only be replayed if enabled.
+    """
+    http_server.routes['/page'] = b'page'
+    monkeypatch.setitem(CONFIG, 'record', archive)
+    transport.fetch(http_server.url('/page'))
+
+    sleeps = []
+    monkeypatch.setattr(replay.time, 'sleep', sleeps.append)
+    monkeypatch.setitem(CONFIG, 'record', '')
+    monkeypatch.setitem(CONFIG, 'replay', archive)
+    assert transport.fetch(http_server.url('/page')).body == b'page'
+    assert sleeps == []
+
+    monkeypatch.setitem(CONFIG, 'replay_timing', True)
+    assert transport.fetch(http_server.url('/page')).body == b'page'
+    assert len(sleeps) == 1 and sleeps[0] > 0
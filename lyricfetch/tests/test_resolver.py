@@ -0,0 +1,144 @@
+"""
+Tests for the DNS cache.
+"""
+import socket
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+from urllib.error import URLError
+
+import pytest
+import urllib3
+
+from lyricfetch import CONFIG
+from lyricfetch import Song
+from lyricfetch import metrics
+from lyricfetch import resolver
+from lyricfetch import tls
+from lyricfetch import transport
+from lyricfetch.scraping import source_hosts
+from lyricfetch.scraping import source_origins
+from lyricfetch.scraping import source_steps
+from lyricfetch.scraping import source_ids
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """
+    Replace the system resolver with a fake one that resolves every host to
+    localhost, and returns the list of hosts looked up.
+    """
+    lookups = []
+
+    def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+        lookups.append(host)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '',
+                 ('127.0.0.1', port))]
+
+    resolver.reset()
+    monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+    yield lookups
+    resolver.reset()
+
+
+def test_resolve_cached(lookups, monkeypatch):
+    """
+    Addresses should be cached until their TTL expires.
+    """
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        assert resolver.resolve('example.com') == ['127.0.0.1']
+        assert resolver.resolve('example.com') == ['127.0.0.1']
+    assert lookups == ['example.com']
+    assert counters['some_source', 'dns_lookups'] == 1
+    assert counters['some_source', 'dns_hits'] == 1
+
+    monkeypatch.setitem(CONFIG, 'dns_ttl', 0.1)
+    resolver.reset()
+    resolver.resolve('example.com')
+    time.sleep(0.2)
+    resolver.resolve('example.com')
+    assert lookups == ['example.com'] * 3
+
+
+def test_resolve_failure(monkeypatch):
+    """
+    Hosts that can't be resolved should fail like any other connection error.
+    """
+    def getaddrinfo(*args, **kwargs):
+        raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+
+    resolver.reset()
+    monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+    with pytest.raises(URLError) as error:
+        transport.fetch('http://example.com/page')
+    assert isinstance(error.value.reason,
+                      urllib3.exceptions.NewConnectionError)
+    assert isinstance(error.value.reason.__cause__, socket.gaierror)
+    resolver.reset()
+
+
+def test_prefetch(lookups, monkeypatch):
+    """
+    Every host should be resolved once, and in parallel.
+    """
+    barrier = threading.Barrier(3, timeout=1)
+    lookup = socket.getaddrinfo
+
+    def getaddrinfo(*args):
+        barrier.wait()
+        return lookup(*args)
+
+    monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+    resolver.prefetch(['a.com', 'b.com', 'a.com', 'c.com'], timeout=2)
+    assert sorted(lookups) == ['a.com', 'b.com', 'c.com']
+
+
+def test_source_hosts():
+    """
+    Every source should list the hosts it connects to.
+    """
+    for source in source_ids:
+        assert source_hosts([source])
+    assert 'www.azlyrics.com' in source_hosts(source_ids)
+
+
+@pytest.mark.parametrize('source', list(source_steps))
+def test_source_origins(source):
+    """
+    The connections warmed up for a source should be in the same pool as its
+    first request.
+    """
+    song = Song('Artist', 'Title', album='Album')
+    request = source_steps[source](song)
+    host = urlsplit(request.url).hostname
+    manager = transport.get_manager(tls.get_variant(host))
+    pools = [manager.connection_from_url(origin + '/')
+             for origin in source_origins([source])]
+    assert manager.connection_from_url(request.url) in pools
+
+
+def test_fetch_uses_cache(http_server, lookups):
+    """
+    New connections should get their addresses from the cache.
+    """
+    http_server.routes['/page'] = b'Hello'
+    url = 'http://some.host:{}/page'.format(http_server.server_port)
+    assert transport.fetch(url).body == b'Hello'
+    transport.reset()
+    assert transport.fetch(url).body == b'Hello'
+    assert lookups.count('some.host') == 1
+
+
+def test_fetch_tries_every_address(http_server, monkeypatch):
+    """
+    If an address refuses the connection, the next one should be used.
+    """
+    http_server.routes['/page'] = b'Hello'
+    monkeypatch.setattr(resolver, '_lookup', lambda *args: ['127.0.0.2',
+                                                            '127.0.0.1'])
+    resolver.reset()
+    url = 'http://some.host:{}/page'.format(http_server.server_port)
+    assert transport.fetch(url).body == b'Hello'
+    resolver.reset()
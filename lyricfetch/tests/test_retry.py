@@ -0,0 +1,154 @@
+"""
+Tests for the retry policy.
+"""
+import socket
+import ssl
+import time
+from collections import Counter
+from email.utils import formatdate
+from urllib.error import HTTPError
+from urllib.error import URLError
+
+import pytest
+import urllib3
+
+from lyricfetch import CONFIG
+from lyricfetch import metrics
+from lyricfetch import retry
+from lyricfetch import transport
+
+
+def http_error(code, headers=None):
+    return HTTPError('http://localhost', code, 'Error', headers or {}, None)
+
+
+def test_parse_retry_after():
+    """
+    Retry-After headers can have either a number of seconds or a date.
+    """
+    assert retry.parse_retry_after('3') == 3
+    assert retry.parse_retry_after('-3') == 0
+    assert retry.parse_retry_after(None) is None
+    assert retry.parse_retry_after('soon') is None
+    seconds = retry.parse_retry_after(formatdate(time.time() + 60,
+                                                 usegmt=True))
+    assert 55 < seconds <= 60
+
+
+def test_get_delay(monkeypatch):
+    """
+    Check the delays before every retry, and which errors are retried.
+    """
+    monkeypatch.setitem(CONFIG, 'retries', {
+        'total': 3,
+        'backoff': 1,
+        'max_backoff': 3,
+        'statuses': [503],
+    })
+    for attempt, backoff in enumerate([1, 2, 3]):
+        delay = retry.get_delay(http_error(503), attempt)
+        assert 0 <= delay <= backoff
+    assert retry.get_delay(http_error(503), 3) is None
+    assert retry.get_delay(http_error(404), 0) is None
+    assert retry.get_delay(URLError('refused'), 0) is not None
+
+    # The delay requested by the server takes precedence, unless it's too long
+    assert retry.get_delay(http_error(503, {'Retry-After': '2'}), 0) == 2
+    assert retry.get_delay(http_error(503, {'Retry-After': '5'}), 0) is None
+
+
+def test_is_retryable():
+    """
+    TLS errors and hosts that can't be resolved should not be retried.
+    """
+    assert retry.is_retryable(URLError(ConnectionRefusedError()))
+    assert retry.is_retryable(URLError('refused'))
+    assert not retry.is_retryable(URLError(ssl.SSLError('handshake')))
+    ssl_error = urllib3.exceptions.SSLError('handshake')
+    assert not retry.is_retryable(URLError(ssl_error))
+    assert not retry.is_retryable(URLError(socket.gaierror(-2, 'Unknown')))
+
+    connection_error = urllib3.exceptions.NewConnectionError(None, 'Refused')
+    assert retry.is_retryable(URLError(connection_error))
+    connection_error.__cause__ = socket.gaierror(-2, 'Unknown')
+    assert not retry.is_retryable(URLError(connection_error))
+
+
+def test_fetch_no_retries_tls(http_server):
+    """
+    A TLS handshake that fails even with the older TLS version should not be
+    retried.
+    """
+    url = 'https://127.0.0.1:{}/page'.format(http_server.server_port)
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        with pytest.raises(URLError):
+            transport.fetch(url)
+    assert counters['some_source', 'tls_fallbacks'] == 1
+    assert counters['some_source', 'retries'] == 0
+
+
+def test_retry_budget(monkeypatch):
+    """
+    Retries can't go over the minimum plus a fraction of the requests.
+    """
+    monkeypatch.setitem(CONFIG['retries'], 'budget_ratio', 0.5)
+    monkeypatch.setitem(CONFIG['retries'], 'budget_min', 1)
+    budget = retry.get_budget()
+    assert retry.allow_retry()
+    assert not retry.allow_retry()
+    budget.add_request()
+    budget.add_request()
+    assert retry.allow_retry()
+    assert not retry.allow_retry()
+
+
+def test_fetch_retries(http_server, monkeypatch):
+    """
+    Transient errors should be retried until the request succeeds.
+    """
+    monkeypatch.setitem(CONFIG['retries'], 'backoff', 0.01)
+    replies = [(503, {}, b''), (429, {'Retry-After': '0'}, b''),
+               (200, {}, b'Hello')]
+    http_server.routes['/flaky'] = lambda handler: replies.pop(0)
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        response = transport.fetch(http_server.url('/flaky'))
+    assert response.body == b'Hello'
+    assert counters['some_source', 'retries'] == 2
+    assert counters['some_source', 'requests'] == 3
+
+
+def test_fetch_retries_exhausted(http_server, monkeypatch):
+    """
+    Requests should fail after the maximum number of retries, and errors that
+    are not transient should not be retried at all.
+    """
+    monkeypatch.setitem(CONFIG['retries'], 'backoff', 0.01)
+    http_server.routes['/down'] = (503, {}, b'')
+    with pytest.raises(HTTPError):
+        transport.fetch(http_server.url('/down'))
+    assert len(http_server.requests) == CONFIG['retries']['total'] + 1
+
+    del http_server.requests[:]
+    with pytest.raises(HTTPError):
+        transport.fetch(http_server.url('/missing'))
+    assert len(http_server.requests) == 1
+
+
+def test_fetch_retries_budget(http_server, monkeypatch):
+    """
+    No more retries should be sent once the budget is spent.
+    """
+    monkeypatch.setitem(CONFIG['retries'], 'backoff', 0.01)
+    monkeypatch.setitem(CONFIG['retries'], 'budget_ratio', 0)
+    monkeypatch.setitem(CONFIG['retries'], 'budget_min', 1)
+    http_server.routes['/down'] = (503, {}, b'')
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        for _ in range(2):
+            with pytest.raises(HTTPError):
+                transport.fetch(http_server.url('/down'))
+    assert len(http_server.requests) == 3
+    assert counters['some_source', 'retries'] == 1
+    assert counters['some_source', 'retries_denied'] == 2
@@ -1,21 +1,30 @@
 """
 Main tests module.
 """
+import logging
 import os
 import shutil
 import tempfile
+import threading
 import time
+from collections import Counter
 from queue import Queue
+from urllib.error import HTTPError
 
 import pytest
 
 import lyricfetch.run
 from lyricfetch import CONFIG
+from lyricfetch import aio
+from lyricfetch import breaker
+from lyricfetch import cache
+from lyricfetch import transport
 from lyricfetch import Result
 from lyricfetch import Stats
 from lyricfetch import Song
 from lyricfetch import get_lyrics
 from lyricfetch.run import LyrThread
+from lyricfetch.run import get_lyrics_hedged
 from lyricfetch.run import get_lyrics_threaded
 from lyricfetch.run import process_result
 from lyricfetch.run import run_mp
@@ -237,3 +246,257 @@ def fake_getlyrics_run_mp(source):
     runtimes = {azlyrics: 1}
     song = Song(artist='breaking benjamin', title='i will not bow')
     return Result(song, source, runtimes)
+
+
+def test_getlyrics_deadline(monkeypatch):
+    """
+    Once the deadline for a song has passed, `get_lyrics()` should stop trying
+    new sources.
+    """
+    def slow_source(_):
+        time.sleep(0.5)
+        return ''
+
+    def fast_source(_):
+        return 'Lyrics'
+
+    monkeypatch.setitem(CONFIG, 'deadline', 0.2)
+    song = Song(artist='Mastodon', title='Oblivion')
+    result = get_lyrics(song, l_sources=[slow_source, fast_source])
+    assert result.source is None
+    assert fast_source not in result.runtimes
+
+    monkeypatch.setitem(CONFIG, 'deadline', 0)
+    result = get_lyrics(song, l_sources=[slow_source, fast_source])
+    assert result.source == fast_source
+
+
+def get_lyrics_async(song, l_sources=None):
+    return aio.run_loop(aio.get_lyrics(song, l_sources))
+
+
+@pytest.mark.parametrize('search', [get_lyrics, get_lyrics_threaded,
+                                    get_lyrics_hedged, get_lyrics_async])
+def test_getlyrics_negative_cache(search):
+    """
+    Sources that didn't have the lyrics for a song (whether they found no
+    lyrics or their page doesn't exist) should not be scraped again for it,
+    unless they failed with an error.
+    """
+    calls = []
+
+    def empty_source(_):
+        calls.append(empty_source)
+        return ''
+
+    def missing_source(_):
+        calls.append(missing_source)
+        raise HTTPError('http://example.com', 404, 'Not Found', {}, None)
+
+    def failing_source(_):
+        calls.append(failing_source)
+        raise ConnectionError
+
+    l_sources = [empty_source, missing_source, failing_source]
+    song = Song(artist='Opeth', title='Ghost of perdition')
+    search(song, l_sources=l_sources)
+    assert sorted(calls, key=id) == sorted(l_sources, key=id)
+    assert cache.known_misses(song, ['empty_source', 'missing_source',
+                                     'failing_source']) == \
+        {'empty_source', 'missing_source'}
+
+    calls.clear()
+    result = search(song, l_sources=l_sources)
+    assert calls == [failing_source]
+    assert result.counters['empty_source', 'negative_cache_hits'] == 1
+    assert result.counters['missing_source', 'negative_cache_hits'] == 1
+
+
+def test_getlyrics_circuit_breaker(monkeypatch):
+    """
+    A source that keeps failing should stop being called once its circuit
+    breaker opens, and the transitions should be reported in the counters.
+    """
+    calls = []
+
+    def failing_source(_):
+        calls.append(failing_source)
+        raise ConnectionError
+
+    monkeypatch.setitem(CONFIG, 'breaker', dict(CONFIG['breaker'],
+                                                min_calls=2, cooldown=60))
+    counters = Counter()
+    for i in range(4):
+        song = Song(artist='Meshuggah', title=f'Song {i}')
+        result = get_lyrics(song, l_sources=[failing_source])
+        counters.update(result.counters)
+
+    assert len(calls) == 2
+    assert counters['failing_source', 'breaker_open'] == 1
+    assert counters['failing_source', 'breaker_skipped'] == 2
+
+
+def test_getlyrics_hedged(monkeypatch):
+    """
+    The next source should only be started early when the running ones take
+    longer than the hedge delay, and never over the limit of sources.
+    """
+    running = []
+    most_running = []
+
+    def source(delay, lyrics=''):
+        def search(_):
+            running.append(search)
+            most_running.append(len(running))
+            time.sleep(delay)
+            running.remove(search)
+            return lyrics
+        search.__name__ = f'source_{delay}_{lyrics}'
+        return search
+
+    monkeypatch.setitem(CONFIG, 'hedge', dict(CONFIG['hedge'], delay=0.1,
+                                              max_sources=2))
+    song = Song(artist='Gojira', title='Stranded')
+    slow, fast = source(0.5, 'Slow'), source(0, 'Fast')
+    start = time.time()
+    result = get_lyrics_hedged(song, l_sources=[slow, fast])
+    assert time.time() - start < 0.5
+    assert result.source is fast
+    assert song.lyrics == 'Fast'
+    assert result.counters[fast.__name__, 'hedged'] == 1
+
+    # Sources that answer in time don't need to be hedged
+    song.lyrics = ''
+    quick, fast = source(0.01), source(0.01, 'Fast')
+    result = get_lyrics_hedged(song, l_sources=[quick, fast])
+    assert result.source is fast
+    assert set(result.runtimes) == {quick, fast}
+    assert not any(name == 'hedged' for _, name in result.counters)
+
+    # Wait for the slow source of the first search
+    while running:
+        time.sleep(0.01)
+    song.lyrics = ''
+    most_running.clear()
+    l_sources = [source(0.2 + i / 100) for i in range(4)]
+    result = get_lyrics_hedged(song, l_sources=l_sources)
+    assert result.source is None
+    assert set(result.runtimes) == set(l_sources)
+    assert max(most_running) == 2
+
+
+def test_hedge_delay(monkeypatch):
+    """
+    The hedge delay should be the percentile of the recent search times of a
+    source, once there are enough of them.
+    """
+    monkeypatch.setitem(CONFIG, 'hedge', dict(CONFIG['hedge'], delay=5,
+                                              percentile=50))
+    assert lyricfetch.run.hedge_delay(azlyrics) == 5
+    circuit = lyricfetch.run.breaker.get_breaker(azlyrics)
+    for runtime in range(circuit.min_calls):
+        circuit.record(runtime)
+    assert lyricfetch.run.hedge_delay(azlyrics) == \
+        (circuit.min_calls - 1) // 2
+
+
+@pytest.mark.parametrize('search', [get_lyrics_threaded, get_lyrics_hedged])
+def test_getlyrics_cancel(search, http_server, monkeypatch):
+    """
+    Once a source finds the lyrics, the result should be returned right away,
+    the requests of the rest aborted and counted as wasted.
+    """
+    arrived = threading.Event()
+    finished = threading.Event()
+
+    def slow_page(handler):
+        arrived.set()
+        time.sleep(2)
+        return (200, {}, b'Late')
+
+    def slow_source(_):
+        try:
+            return transport.fetch(http_server.url('/slow')).body.decode()
+        finally:
+            finished.set()
+
+    def fast_source(_):
+        arrived.wait(1)
+        return 'Lyrics'
+
+    http_server.routes['/slow'] = slow_page
+    monkeypatch.setitem(CONFIG, 'hedge', dict(CONFIG['hedge'], delay=0))
+    song = Song(artist='Tool', title='Lateralus')
+    start = time.time()
+    result = search(song, l_sources=[slow_source, fast_source])
+    assert time.time() - start < 1
+    assert result.source is fast_source
+    assert result.counters['slow_source', 'cancelled'] == 1
+    assert result.counters['slow_source', 'wasted_requests'] == 1
+
+    assert finished.wait(1)
+    # Being cancelled is not the website's fault
+    assert not breaker.get_breaker(slow_source).outcomes
+    assert LyrThread(slow_source, song, Queue()).daemon
+
+
+def test_scrape_cancelled_probe():
+    """
+    A half-open breaker whose probe runs out of time or is cancelled should
+    let the next search through.
+    """
+    def cancelled_source(_):
+        raise transport.Cancelled('http://example.com')
+
+    def late_source(_):
+        raise transport.DeadlineExceeded('http://example.com')
+
+    song = Song(artist='Mastodon', title='Oblivion')
+    for source in (cancelled_source, late_source):
+        circuit = breaker.get_breaker(source)
+        circuit.state = breaker.HALF_OPEN
+        for _ in range(2):
+            result = lyricfetch.run.scrape(source, song)
+            assert not result['skipped']
+            assert result['error']
+        assert circuit.state == breaker.HALF_OPEN
+        assert not circuit.probing
+
+
+@pytest.mark.parametrize('code,error,opened', [
+    (404, False, False),
+    (410, False, False),
+    (403, True, False),
+    (429, True, True),
+    (503, True, True),
+])
+def test_scrape_http_errors(code, error, opened):
+    """
+    Only the HTTP errors that mean the website is in trouble should open its
+    breaker, and pages that don't exist are just a miss.
+    """
+    def http_source(song):
+        raise HTTPError('http://example.com', code, 'Error', {}, None)
+
+    song = Song(artist='Mastodon', title='Oblivion')
+    for _ in range(CONFIG['breaker']['min_calls']):
+        result = lyricfetch.run.scrape(http_source, song)
+        assert result['error'] == error
+        assert not result['lyrics']
+    state = breaker.get_breaker(http_source).state
+    assert state == (breaker.OPEN if opened else breaker.CLOSED)
+
+
+def test_report_run_documents(caplog, monkeypatch):
+    """
+    The hit rate of the document cache should be calculated from the counters
+    of every search, which may have run in other processes.
+    """
+    monkeypatch.setitem(CONFIG, 'print_stats', False)
+    caplog.set_level(logging.DEBUG, logger='lyricfetch')
+    stats = Stats()
+    stats.add_counters(Counter({('azlyrics', 'memory_hits'): 2,
+                                ('azlyrics', 'memory_misses'): 1}))
+    stats.add_counters(Counter({('genius', 'memory_hits'): 1}))
+    lyricfetch.run.report_run(stats, 1)
+    assert 'Document cache: 4 lookups, 75.00% hit rate' in caplog.text
@@ -1,23 +1,37 @@
 """
 Tests for the specific scraping functions.
 """
+from collections import Counter
 from urllib.error import URLError
 from urllib.error import HTTPError
 from http.client import RemoteDisconnected
 
 import pytest
+from sample_pages import sample_lyrics
+from sample_pages import sample_pages
+from sample_pages import sample_song
 
+from lyricfetch import CONFIG
 from lyricfetch import Song
+from lyricfetch import cache
+from lyricfetch import fastpath
+from lyricfetch import metrics
 from lyricfetch import exclude_sources
 from lyricfetch import sources
 from lyricfetch.scraping import azlyrics, metrolyrics, lyricswikia
 from lyricfetch.scraping import darklyrics, metalarchives, genius
 from lyricfetch.scraping import musixmatch, songlyrics, vagalume
 from lyricfetch.scraping import letras, lyricsmode, lyricscom
+from lyricfetch.scraping import get_parser
+from lyricfetch.scraping import Request
 from lyricfetch.scraping import get_url
+from lyricfetch.scraping import plan_lyricscom
+from lyricfetch.scraping import run_steps
+from lyricfetch.scraping import source_steps
 from lyricfetch.scraping import get_lastfm
 from lyricfetch.scraping import id_source
 from lyricfetch.scraping import normalize
+from lyricfetch.scraping import slugger
 
 
 def check_site_available(site, secure=False):
@@ -161,6 +175,26 @@ def test_normalize_extra_chars_string():
     assert normalize(weird, 'n', '99') == 'aaeeiiooouuu9999'
 
 
+def test_slugger():
+    """
+    Check that the slugs are normalized like in `normalize`, with runs of the
+    squash character replaced, and memoized.
+    """
+    chars_dict = {
+        '&': 'and',
+        '(),': '',
+        ' ': '-'
+    }
+    slug = slugger(chars_dict, squash='-')
+    weird = 'Mötley Crüe & Niño - (Live)'
+    assert slug(weird) == 'Motley-Crue-and-Nino-Live'
+    assert slug(weird) == slug(weird)
+    assert slug.cache_info().hits == 2
+
+    assert slugger()('aáeé  ') == normalize('aáeé  ')
+    assert slugger({' ': '_'})('a  b') == 'a__b'
+
+
 def test_id_source_mappings():
     """
     Check that every source function has a mapping in `id_source`, and none of
@@ -175,6 +209,35 @@ def test_id_source_mappings():
         assert name != ''
 
 
+def test_source_steps():
+    """
+    Every source should have a plan step that returns its first request.
+    """
+    song = Song(**sample_song)
+    for source in sources:
+        request = source_steps[source](song)
+        assert isinstance(request, Request)
+        assert request.url.startswith('http')
+        assert callable(request.extract)
+
+
+def test_run_steps(sample_site):
+    """
+    The extract steps should only depend on the body of the response, and
+    return the next request to send if there is one.
+    """
+    song = Song(**sample_song)
+    request = plan_lyricscom(song)
+    bodies = []
+    while isinstance(request, Request):
+        body = cache.fetch(request.url, request.parser, request.region)
+        bodies.append(body)
+        request = request.extract(body, song)
+    assert len(bodies) == 3
+    assert request == run_steps(plan_lyricscom, song)
+    assert all(line in request for line in sample_lyrics)
+
+
 def test_exclude_sources_callable():
     """
     Check that a source is correctly excluded from the main list when passing a
@@ -248,3 +311,86 @@ def test_scrape_darklyrics(artist, title, lastfm_key):
     except RemoteDisconnected:
         pytest.skip('Remote disconnected')
     assert lyrics != ''
+
+
+def test_get_parser(monkeypatch):
+    """
+    Parsers that are not installed should fall back to html.parser.
+    """
+    monkeypatch.setitem(CONFIG, 'html_parser', 'html.parser')
+    assert get_parser() == 'html.parser'
+    monkeypatch.setitem(CONFIG, 'html_parser', 'not-a-parser')
+    assert get_parser() == 'html.parser'
+
+
+@pytest.mark.parametrize('source', sources)
+def test_html_parsers(source, sample_site, monkeypatch):
+    """
+    Every source should find the same lyrics in the sample pages with any of
+    the supported html parsers.
+    """
+    pytest.importorskip('lxml')
+    monkeypatch.setitem(CONFIG, 'fast_paths', False)
+    results = {}
+    for parser in ('html.parser', 'lxml'):
+        monkeypatch.setitem(CONFIG, 'html_parser', parser)
+        assert get_parser() == parser
+        results[parser] = source(Song(**sample_song))
+
+    assert results['html.parser'] == results['lxml']
+    for line in sample_lyrics:
+        assert line in results['lxml']
+
+
+@pytest.mark.parametrize('source', [vagalume, letras, metalarchives])
+def test_fast_paths(source, sample_site, monkeypatch):
+    """
+    The fast path extractors should return exactly the same lyrics as the
+    full parse.
+    """
+    monkeypatch.setitem(CONFIG, 'fast_paths', False)
+    expected = source(Song(**sample_song))
+    assert expected
+
+    monkeypatch.setitem(CONFIG, 'fast_paths', True)
+    monkeypatch.setitem(CONFIG, 'fast_path_validation', 1)
+    counters = Counter()
+    with metrics.track(source, counters):
+        assert source(Song(**sample_song)) == expected
+    name = source.__name__
+    assert counters[name, 'fast_path_validated'] == 1
+    assert counters[name, 'fast_path_hits'] == 1
+    assert counters[name, 'fast_path_drift'] == 0
+
+
+def test_fast_path_fallback(sample_site, monkeypatch):
+    """
+    Pages that the fast path can't handle should be fully parsed.
+    """
+    page = sample_pages['vagalume']['vagalume.com.br/nightwish/alpenglow.html']
+    page = page.replace('<br/><br/>', '<div class="ad"></div><br/><br/>')
+    monkeypatch.setitem(sample_pages['vagalume'],
+                        'vagalume.com.br/nightwish/alpenglow.html', page)
+    counters = Counter()
+    with metrics.track(vagalume, counters):
+        lyrics = vagalume(Song(**sample_song))
+    assert all(line in lyrics for line in sample_lyrics)
+    assert counters['vagalume', 'fast_path_fallbacks'] == 1
+    assert counters['vagalume', 'fast_path_hits'] == 0
+
+
+def test_fast_path_drift(sample_site, monkeypatch):
+    """
+    When validating, differences with the full parse should be reported and
+    the result of the full parse returned.
+    """
+    monkeypatch.setattr(fastpath, 'vagalume', lambda body, song: 'Wrong')
+    monkeypatch.setitem(CONFIG, 'fast_path_validation', 1)
+    counters = Counter()
+    with metrics.track(vagalume, counters):
+        lyrics = vagalume(Song(**sample_song))
+    assert lyrics != 'Wrong'
+    assert counters['vagalume', 'fast_path_drift'] == 1
+
+    monkeypatch.setitem(CONFIG, 'fast_path_validation', 0)
+    assert vagalume(Song(**sample_song)) == 'Wrong'
@@ -1,11 +1,14 @@
 """
 Tests for the `Stats` and `Record` classes.
 """
+from collections import Counter
+
 from lyricfetch import Stats
 from lyricfetch.scraping import azlyrics
 from lyricfetch.scraping import metrolyrics
 from lyricfetch.stats import Record
 from lyricfetch.stats import avg
+from lyricfetch.stats import percentile
 
 
 def some_source():
@@ -117,3 +120,35 @@ def test_stats_calculate():
         'notfound': 4,
         'total_time': 10
     }
+
+
+def test_stats_add_counters():
+    """
+    Check that counters are added to their corresponding source, or to the
+    general counters if they don't belong to any.
+    """
+    stats = statistics()
+    counters = Counter({
+        ('some_source', 'requests'): 2,
+        ('other_source', 'requests'): 1,
+        (None, 'requests'): 3,
+    })
+    stats.add_counters(counters)
+    stats.add_counters(counters)
+    assert stats.source_stats['some_source'].counters['requests'] == 4
+    assert stats.source_stats['other_source'].counters['requests'] == 2
+    assert stats.counters['requests'] == 6
+    assert 'Requests: 4' in str(stats.source_stats['some_source'])
+
+
+def test_percentile():
+    """
+    Percentiles should be one of the values, by the nearest rank method.
+    """
+    values = list(range(100, 0, -1))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile(values, 0) == 1
+    assert percentile([3], 90) == 3
+    assert percentile([], 50) == 0
@@ -0,0 +1,66 @@
+"""
+Tests for the shared SSL contexts.
+"""
+import ssl
+from collections import Counter
+from urllib.error import URLError
+
+from lyricfetch import metrics
+from lyricfetch import tls
+from lyricfetch import transport
+
+
+def test_get_context():
+    """
+    Contexts should be created only once per variant.
+    """
+    tls.reset()
+    context = tls.get_context()
+    assert isinstance(context, tls.ResumingSSLContext)
+    assert context.verify_mode == ssl.CERT_REQUIRED
+    assert tls.get_context() is context
+    assert tls.get_context('tlsv1') is not context
+    tls.reset()
+
+
+def test_session_resumption(https_server):
+    """
+    New connections to the same host should resume the previous TLS session.
+    """
+    https_server.routes['/page'] = (200, {'Connection': 'close'}, b'Hello')
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        for _ in range(3):
+            assert transport.fetch(https_server.url('/page')).body == b'Hello'
+
+    assert counters['some_source', 'connections_opened'] == 3
+    assert counters['some_source', 'tls_resumed'] == 2
+
+
+def test_tls_fallback_remembered(monkeypatch):
+    """
+    After a host has failed with the default TLS variant, the next requests
+    should go straight to the older one.
+    """
+    calls = []
+
+    def fake_urlopen(manager, url, headers, region=None):
+        variant = 'tlsv1' if manager is transport.get_manager('tlsv1') \
+            else 'default'
+        calls.append(variant)
+        if variant == 'default':
+            raise URLError(ssl.SSLError('VERSION_TOO_LOW'))
+        return transport.Response(url, 200, {}, b'Hello')
+
+    transport.reset()
+    tls.reset()
+    monkeypatch.setattr(transport, '_urlopen', fake_urlopen)
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        transport.fetch('https://legacy.example.com/a')
+        transport.fetch('https://legacy.example.com/b')
+        transport.fetch('https://other.example.com/a')
+
+    assert calls == ['default', 'tlsv1', 'tlsv1', 'default', 'tlsv1']
+    assert counters['some_source', 'tls_fallbacks'] == 2
+    tls.reset()
@@ -0,0 +1,267 @@
+"""
+Tests for the HTTP transport.
+"""
+import gzip
+import threading
+import time
+import zlib
+from collections import Counter
+from urllib.error import HTTPError
+from urllib.error import URLError
+
+import pytest
+
+from lyricfetch import CONFIG
+from lyricfetch import metrics
+from lyricfetch import transport
+from lyricfetch.scraping import get_url
+
+
+def test_fetch(http_server):
+    """
+    Check that `fetch` returns the status, headers and body of a response.
+    """
+    http_server.routes['/page'] = (200, {'X-Test': 'yes'}, b'Hello')
+    response = transport.fetch(http_server.url('/page'))
+    assert response.status == 200
+    assert response.headers['X-Test'] == 'yes'
+    assert response.body == b'Hello'
+
+    path, headers = http_server.requests[-1]
+    assert path == '/page'
+    assert headers['User-Agent'] == transport.USER_AGENT
+
+
+def test_fetch_http_error(http_server):
+    """
+    Error status codes should be raised as urllib's HTTPError.
+    """
+    with pytest.raises(HTTPError) as error:
+        transport.fetch(http_server.url('/missing'))
+    assert error.value.code == 404
+
+
+def test_fetch_connection_error(http_server):
+    """
+    Connection errors should be raised as urllib's URLError, and not be
+    mistaken for timeouts.
+    """
+    url = http_server.url('/page')
+    http_server.shutdown()
+    http_server.server_close()
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        with pytest.raises(URLError) as error:
+            transport.fetch(url)
+    # Even though urllib3 considers them a kind of timeout
+    assert not transport.is_timeout(error.value)
+    assert counters['some_source', 'timeouts'] == 0
+
+
+def test_fetch_reuses_connections(http_server):
+    """
+    Consecutive requests to the same host should be sent through the same
+    connection, and that should be reflected in the counters.
+    """
+    http_server.routes['/page'] = b'Hello'
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        for _ in range(5):
+            transport.fetch(http_server.url('/page'))
+
+    assert counters['some_source', 'requests'] == 5
+    assert counters['some_source', 'connections_opened'] == 1
+    assert counters['some_source', 'connections_reused'] == 4
+
+    stats = transport.pool_stats()['127.0.0.1']
+    assert stats == {'connections': 1, 'requests': 5, 'reused': 4}
+
+
+def test_get_url_parsers(http_server):
+    """
+    Check every parser supported by `get_url` against a local server.
+    """
+    http_server.routes['/html'] = b'<html><body><p>Text</p></body></html>'
+    http_server.routes['/json'] = b'{"data": [1, 2]}'
+
+    soup = get_url(http_server.url('/html'))
+    assert soup.find('p').get_text() == 'Text'
+    assert get_url(http_server.url('/json'), parser='json') == {'data': [1, 2]}
+    raw = get_url(http_server.url('/html'), parser='raw')
+    assert raw == '<html><body><p>Text</p></body></html>'
+    with pytest.raises(ValueError):
+        get_url(http_server.url('/html'), parser='asdf')
+
+
+def test_deadline():
+    """
+    Check that nested deadlines can only make the time available shorter.
+    """
+    assert transport.time_left() is None
+    with transport.deadline(10):
+        assert 9 < transport.time_left() <= 10
+        with transport.deadline(100):
+            assert transport.time_left() <= 10
+        with transport.deadline(1):
+            assert transport.time_left() <= 1
+        with transport.deadline(None):
+            assert 9 < transport.time_left() <= 10
+    assert transport.time_left() is None
+
+
+def test_fetch_deadline_exceeded(http_server):
+    """
+    No request should be sent once the deadline has passed.
+    """
+    http_server.routes['/page'] = b'Hello'
+    with transport.deadline(until=time.time() - 1):
+        assert not transport.can_finish(http_server.url('/page'))
+        with pytest.raises(transport.DeadlineExceeded):
+            transport.fetch(http_server.url('/page'))
+    assert not http_server.requests
+
+
+def test_fetch_read_timeout(http_server, monkeypatch):
+    """
+    A server that takes too long to reply should make the request fail.
+    """
+    def slow(handler):
+        time.sleep(1)
+        return (200, {}, b'Hello')
+
+    http_server.routes['/slow'] = slow
+    monkeypatch.setitem(CONFIG, 'read_timeout', 0.2)
+    monkeypatch.setitem(CONFIG['retries'], 'total', 0)
+    counters = Counter()
+    start = time.time()
+    with metrics.track('some_source', counters):
+        with pytest.raises(URLError):
+            transport.fetch(http_server.url('/slow'))
+    assert time.time() - start < 1
+    assert counters['some_source', 'timeouts'] == 1
+
+    # The deadline should also limit the read timeout
+    monkeypatch.setitem(CONFIG, 'read_timeout', 10)
+    start = time.time()
+    with transport.deadline(0.2), pytest.raises(URLError):
+        transport.fetch(http_server.url('/slow'))
+    assert time.time() - start < 1
+
+
+def test_fetch_compressed(http_server):
+    """
+    Compressed responses should be decoded transparently, and both the
+    compressed and uncompressed sizes should be counted.
+    """
+    body = b'<p>Some lyrics</p>' * 100
+    http_server.routes['/gzip'] = (200, {'Content-Encoding': 'gzip'},
+                                   gzip.compress(body))
+    http_server.routes['/deflate'] = (200, {'Content-Encoding': 'deflate'},
+                                      zlib.compress(body))
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        assert transport.fetch(http_server.url('/gzip')).body == body
+        assert transport.fetch(http_server.url('/deflate')).body == body
+
+    accepted = http_server.requests[0][1]['Accept-Encoding']
+    assert 'gzip' in accepted
+    assert 'deflate' in accepted
+    assert counters['some_source', 'bytes_decoded'] == 2 * len(body)
+    assert counters['some_source', 'bytes_received'] < len(body)
+
+
+def test_warmup(http_server):
+    """
+    Connections opened by `warmup` should be used by the first requests.
+    """
+    http_server.routes['/page'] = b'Hello'
+    origin = http_server.url('')
+    metrics.reset()
+    transport.warmup([origin, origin], timeout=5)
+    assert metrics.totals[None, 'connections_warmed'] == 1
+
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        transport.fetch(http_server.url('/page'))
+    assert counters['some_source', 'connections_opened'] == 0
+    assert counters['some_source', 'connections_reused'] == 1
+
+
+def test_host_override(http_server, monkeypatch):
+    """
+    Requests should be sent to the override, with the original host.
+    """
+    http_server.routes['/page'] = b'Hello'
+    monkeypatch.setitem(CONFIG, 'host_override', http_server.url(''))
+    response = transport.fetch('https://www.example.com/page?q=1')
+    assert response.body == b'Hello'
+    assert response.url == 'https://www.example.com/page?q=1'
+    path, headers = http_server.requests[0]
+    assert path == '/page?q=1'
+    assert headers['Host'] == 'www.example.com'
+
+
+def test_fetch_cancelled(http_server):
+    """
+    Cancelling a search should abort its request in progress, and keep it
+    from sending new ones.
+    """
+    arrived = threading.Event()
+
+    def slow(handler):
+        arrived.set()
+        time.sleep(2)
+        return (200, {}, b'Hello')
+
+    http_server.routes['/slow'] = slow
+    token = transport.CancelToken()
+    threading.Timer(0.1, token.cancel).start()
+    counters = Counter()
+    start = time.time()
+    with metrics.track('some_source', counters), \
+            transport.cancellation(token):
+        with pytest.raises(transport.Cancelled):
+            transport.fetch(http_server.url('/slow'))
+        assert time.time() - start < 1
+        assert arrived.is_set()
+        assert counters['some_source', 'requests_aborted'] == 1
+
+        http_server.routes['/page'] = b'Hello'
+        with pytest.raises(transport.Cancelled):
+            transport.fetch(http_server.url('/page'))
+    assert len(http_server.requests) == 1
+
+    # Other threads and searches are not affected
+    assert transport.fetch(http_server.url('/page')).body == b'Hello'
+    with transport.cancellation(transport.CancelToken()):
+        assert transport.fetch(http_server.url('/page')).body == b'Hello'
+
+
+def test_fetch_cancelled_redirect(http_server):
+    """
+    Every socket used by a request that follows a redirect should stop being
+    aborted by its search once the request is done.
+    """
+    http_server.routes['/old'] = (301, {'Location': 'http://localhost:{}/new'
+                                        .format(http_server.server_port)}, b'')
+    http_server.routes['/new'] = b'Hello'
+    token = transport.CancelToken()
+    with transport.cancellation(token):
+        response = transport.fetch(http_server.url('/old'))
+    assert response.body == b'Hello'
+    assert len(response.history) == 1
+    assert not token.sockets
+
+
+def test_fetch_https_plain_server(http_server):
+    """
+    A TLS handshake with a server that doesn't speak TLS should fail without
+    reconnecting over and over.
+    """
+    http_server.routes['/page'] = b'Hello'
+    url = 'https://127.0.0.1:{}/page'.format(http_server.server_port)
+    counters = Counter()
+    with metrics.track('some_source', counters):
+        with pytest.raises(URLError):
+            transport.fetch(url)
+    assert counters['some_source', 'connections_opened'] <= 10
@@ -0,0 +1,139 @@
+"""
+SSL contexts shared by all the connections of a process.
+
+Contexts are created only once per TLS variant, remember the TLS sessions
+negotiated with every host so new connections can resume them instead of
+going through a full handshake, and hosts that only work with an older
+protocol version are remembered so the failing handshake is not repeated.
+"""
+import ssl
+import threading
+import warnings
+import weakref
+
+from . import metrics
+
+_contexts = {}
+_contexts_lock = threading.Lock()
+
+# Hosts that only accept the older TLSv1 protocol
+_legacy_hosts = set()
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """
+    SSL context that reuses the last TLS session negotiated with every host
+    when opening a new connection to it.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.sessions = {}
+        self.sockets = {}
+
+    def last_session(self, hostname):
+        """
+        Returns the most recent TLS session established with `hostname`.
+        """
+        sock = self.sockets.get(hostname)
+        sock = sock() if sock is not None else None
+        if sock is not None:
+            # With TLSv1.3 the session tickets are only received after the
+            # handshake, so the latest socket may have a newer session
+            self.save_session(sock)
+        return self.sessions.get(hostname)
+
+    def save_session(self, sock):
+        """
+        Store the TLS session of `sock` before it's closed.
+        """
+        try:
+            session = sock.session
+        except (OSError, ValueError):
+            return
+        if session is not None and sock.server_hostname is not None:
+            self.sessions[sock.server_hostname] = session
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None,
+                    **kwargs):
+        if session is None and server_hostname is not None:
+            session = self.last_session(server_hostname)
+        try:
+            ssock = super().wrap_socket(sock, *args,
+                                        server_hostname=server_hostname,
+                                        session=session, **kwargs)
+        except ValueError:
+            # The stored session can't be used with this connection
+            self.sessions.pop(server_hostname, None)
+            ssock = super().wrap_socket(sock, *args,
+                                        server_hostname=server_hostname,
+                                        **kwargs)
+
+        if server_hostname is not None:
+            self.sockets[server_hostname] = weakref.ref(ssock)
+            if ssock.session is not None:
+                self.sessions[server_hostname] = ssock.session
+        if ssock.session_reused:
+            metrics.incr('tls_resumed')
+        return ssock
+
+
+def save_session(sock):
+    """
+    Store the TLS session of `sock` in its context, so that it can be resumed
+    by future connections to the same host. This should be called right before
+    closing the socket.
+    """
+    if isinstance(sock, ssl.SSLSocket) and \
+            isinstance(sock.context, ResumingSSLContext):
+        sock.context.save_session(sock)
+
+
+def _new_context(variant):
+    """
+    Create the SSL context for the specified TLS variant.
+    """
+    if variant == 'tlsv1':
+        # Some websites (like metal-archives) use older TLS versions and can
+        # make the ssl module trow a VERSION_TOO_LOW error, so they need a
+        # context using the older TLSv1
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            return ResumingSSLContext(ssl.PROTOCOL_TLSv1)
+
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_default_certs()
+    return context
+
+
+def get_context(variant='default'):
+    """
+    Returns the SSL context of this process for the specified TLS variant,
+    which can be either 'default' or 'tlsv1'.
+    """
+    with _contexts_lock:
+        if variant not in _contexts:
+            _contexts[variant] = _new_context(variant)
+        return _contexts[variant]
+
+
+def get_variant(host):
+    """
+    Returns the TLS variant known to work with `host`.
+    """
+    return 'tlsv1' if host in _legacy_hosts else 'default'
+
+
+def set_legacy(host):
+    """
+    Remember that `host` only works with the older TLSv1 protocol.
+    """
+    _legacy_hosts.add(host)
+
+
+def reset():
+    """
+    Forget every context and the hosts known to need an older protocol.
+    """
+    with _contexts_lock:
+        _contexts.clear()
+    _legacy_hosts.clear()
@@ -0,0 +1,711 @@
+"""
+HTTP transport used by the scraping functions.
+
+Every process keeps a pool of keep-alive connections per host, so consecutive
+requests to the same website don't have to go through the TCP and TLS
+handshakes again.
+"""
+import socket
+import ssl
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from http.client import responses
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from urllib.error import HTTPError, URLError
+
+import urllib3
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+from urllib3.util.request import ACCEPT_ENCODING
+
+from . import CONFIG
+from . import logger
+from . import metrics
+from . import ratelimit
+from . import resolver
+from . import replay
+from . import retry
+from . import tls
+
+USER_AGENT = 'foobar'
+# Size of the chunks read from the network
+CHUNK_SIZE = 64 * 1024
+
+# The history is a tuple of (url, status, location) for every redirect that
+# was followed to get the response
+Response = namedtuple('Response', 'url status headers body history')
+Response.__new__.__defaults__ = ((),)
+
+# Maps a TLS variant ('default' or 'tlsv1') to its pool manager
+_managers = {}
+_managers_lock = threading.Lock()
+_local = threading.local()
+
+# Maps every host to a moving average of the time taken by its requests
+_latencies = {}
+
+
+class DeadlineExceeded(URLError):
+    """
+    Raised when a request can't be sent because the current search has
+    already run out of time.
+    """
+    def __init__(self, url):
+        super().__init__(f'Deadline exceeded before requesting {url}')
+
+
+class Cancelled(URLError):
+    """
+    Raised when a request can't be sent or finished because the search it
+    belongs to has been cancelled.
+    """
+    def __init__(self, url):
+        super().__init__(f'Search cancelled while requesting {url}')
+
+
+class BodyTooLarge(URLError):
+    """
+    Raised when the body of a response is bigger than the maximum size
+    allowed.
+    """
+    def __init__(self, url, max_size):
+        super().__init__(f'Response from {url} is bigger than {max_size} '
+                         'bytes')
+
+
+@contextmanager
+def deadline(seconds=None, until=None):
+    """
+    Limit the time available to every request sent by the current thread
+    inside this context. The limit can be specified either as a number of
+    `seconds` from now, or as an absolute timestamp with `until`. A value of
+    None or 0 means no limit.
+
+    Nested deadlines can only make the current one shorter.
+    """
+    previous = getattr(_local, 'deadline', None)
+    if seconds:
+        until = time.time() + float(seconds)
+    if until is not None and previous is not None:
+        until = min(until, previous)
+    elif until is None:
+        until = previous
+
+    _local.deadline = until
+    try:
+        yield until
+    finally:
+        _local.deadline = previous
+
+
+def time_left():
+    """
+    Returns the number of seconds left until the current deadline, or None if
+    there is no deadline.
+    """
+    until = getattr(_local, 'deadline', None)
+    if until is None:
+        return None
+    return until - time.time()
+
+
+def can_finish(url):
+    """
+    Returns a boolean indicating if a request to `url` is expected to finish
+    before the current deadline, given the latency observed for its host.
+    """
+    left = time_left()
+    if left is None:
+        return True
+    return left > _latencies.get(urlsplit(url).hostname, 0)
+
+
+def require_time(url):
+    """
+    Raise DeadlineExceeded if a request to `url` is not expected to finish
+    before the current deadline. Sources that need several requests should
+    call this before every follow-up request.
+    """
+    if not can_finish(url):
+        raise DeadlineExceeded(url)
+
+
+class CancelToken:
+    """
+    Lets any thread cancel a search run by other threads. Once cancelled,
+    their requests fail with Cancelled, and the ones waiting for a response
+    are aborted by shutting down their sockets.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.sockets = set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self):
+        """
+        Cancel the search and abort its requests in progress.
+        """
+        with self.lock:
+            self.event.set()
+            sockets, self.sockets = self.sockets, set()
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def register(self, sock):
+        """
+        Shut down `sock` when the search is cancelled, until it's passed to
+        `unregister()`. If it's already cancelled, it's shut down right away.
+        """
+        with self.lock:
+            if not self.event.is_set():
+                self.sockets.add(sock)
+                return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def unregister(self, sock):
+        with self.lock:
+            self.sockets.discard(sock)
+
+
+@contextmanager
+def cancellation(token):
+    """
+    Make every request sent by the current thread inside this context fail or
+    be aborted once `token` is cancelled. A token of None does nothing.
+    """
+    previous = getattr(_local, 'token', None)
+    _local.token = token if token is not None else previous
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def is_cancelled():
+    """
+    Returns a boolean indicating whether the search run by the current thread
+    has been cancelled.
+    """
+    token = getattr(_local, 'token', None)
+    return token is not None and token.cancelled
+
+
+def check_cancelled(url):
+    """
+    Raise Cancelled if the search run by the current thread has been
+    cancelled. Sources should call this before every request.
+    """
+    if is_cancelled():
+        raise Cancelled(url)
+
+
+def is_timeout(error):
+    """
+    Returns a boolean indicating whether `error` was caused by a timeout.
+    """
+    reason = getattr(error, 'reason', error)
+    # urllib3's connection errors (including the failed DNS lookups) are a
+    # subclass of its connect timeouts
+    if isinstance(reason, NewConnectionError):
+        return False
+    return isinstance(reason, (socket.timeout,
+                               urllib3.exceptions.TimeoutError))
+
+
+def _record_latency(url, elapsed):
+    """
+    Update the average latency of the host of `url`.
+    """
+    host = urlsplit(url).hostname
+    if host in _latencies:
+        _latencies[host] = 0.8 * _latencies[host] + 0.2 * elapsed
+    else:
+        _latencies[host] = elapsed
+
+
+def get_timeout(url):
+    """
+    Returns the timeout for a request to `url`, taking into account both the
+    configured timeouts and the current deadline.
+    """
+    connect = float(CONFIG['connect_timeout'])
+    read = float(CONFIG['read_timeout'])
+    left = time_left()
+    if left is not None:
+        if left <= 0:
+            raise DeadlineExceeded(url)
+        connect = min(connect, left)
+        read = min(read, left)
+    return urllib3.Timeout(connect=connect, read=read, total=left)
+
+
+def _count_connection():
+    """
+    Register that a new socket is being opened by the current thread.
+    """
+    _local.opened = getattr(_local, 'opened', 0) + 1
+    metrics.incr('connections_opened')
+
+
+class ResolvingConnectionMixin:
+    """
+    Resolves the host of the connection through the in-process DNS cache,
+    trying every address until one of them accepts the connection.
+    """
+    def _new_conn(self):
+        host = self._dns_host
+        try:
+            addresses = resolver.resolve(host, self.port,
+                                         allowed_gai_family())
+        except socket.gaierror as error:
+            # Like urllib3 2's NameResolutionError, which is a subclass of it
+            message = f'Failed to resolve {self.host!r} ({error})'
+            raise NewConnectionError(self, message) from error
+
+        error = None
+        for address in addresses:
+            # urllib3 won't do another lookup when given a numeric address
+            self._dns_host = address
+            try:
+                return super()._new_conn()
+            except NewConnectionError as exc:
+                error = exc
+            finally:
+                self._dns_host = host
+        if error is None:
+            raise NewConnectionError(self, f'No addresses found for {host}')
+        raise error
+
+
+class AbortableConnectionMixin:
+    """
+    Registers the socket of the connection with the cancel token of the
+    current thread while it waits for a response, so the request can be
+    aborted. The socket stays registered until `_release_socket()` is called,
+    once the body has been read or the connection goes back to the pool.
+    """
+    def getresponse(self, *args, **kwargs):
+        token = getattr(_local, 'token', None)
+        if token is not None and self.sock is not None:
+            token.register(self.sock)
+            # A request registers one socket for every redirect it follows
+            registered = getattr(_local, 'registered', None)
+            if registered is None:
+                registered = _local.registered = []
+            registered.append((token, self.sock))
+        return super().getresponse(*args, **kwargs)
+
+
+def _release_socket(sock=None):
+    """
+    Stop aborting `sock`, or every socket registered by the current thread if
+    it's None.
+    """
+    registered = getattr(_local, 'registered', None)
+    if not registered:
+        return
+    for token, registered_sock in list(registered):
+        if sock is None or registered_sock is sock:
+            token.unregister(registered_sock)
+            registered.remove((token, registered_sock))
+
+
+class ReleasingPoolMixin:
+    """
+    Stops aborting the socket of a connection when it's put back in the pool,
+    where any other request may use it.
+    """
+    def _put_conn(self, conn):
+        if conn is not None and conn.sock is not None:
+            _release_socket(conn.sock)
+        super()._put_conn(conn)
+
+
+class CountingHTTPConnection(AbortableConnectionMixin,
+                             ResolvingConnectionMixin, HTTPConnection):
+    """
+    HTTP connection that keeps track of how many sockets are opened.
+    """
+    def connect(self):
+        _count_connection()
+        super().connect()
+
+
+class CountingHTTPSConnection(AbortableConnectionMixin,
+                              ResolvingConnectionMixin, HTTPSConnection):
+    """
+    HTTPS connection that keeps track of how many sockets are opened, and
+    saves their TLS sessions before closing them.
+    """
+    def connect(self):
+        _count_connection()
+        super().connect()
+
+    def close(self):
+        tls.save_session(getattr(self, 'sock', None))
+        super().close()
+
+
+class CountingHTTPConnectionPool(ReleasingPoolMixin, HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+
+
+class CountingHTTPSConnectionPool(ReleasingPoolMixin,
+                                  HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+
+
+def _new_manager(variant):
+    """
+    Create a pool manager for the specified TLS variant.
+    """
+    # Only redirects are followed here, every other error (including TLS
+    # handshake failures, counted as 'other') goes up to the retry policy
+    retries = urllib3.Retry(total=None, connect=0, read=0, redirect=10,
+                            status=0, other=0)
+    manager = urllib3.PoolManager(num_pools=int(CONFIG['pool_hosts']),
+                                  maxsize=int(CONFIG['pool_size']),
+                                  retries=retries,
+                                  ssl_context=tls.get_context(variant))
+    manager.pool_classes_by_scheme = {
+        'http': CountingHTTPConnectionPool,
+        'https': CountingHTTPSConnectionPool,
+    }
+    return manager
+
+
+def get_manager(variant='default'):
+    """
+    Returns the pool manager of this process for the specified TLS variant,
+    creating it if necessary.
+    """
+    with _managers_lock:
+        if variant not in _managers:
+            _managers[variant] = _new_manager(variant)
+        return _managers[variant]
+
+
+def reset():
+    """
+    Forget every pooled connection. This must be called in any child process
+    after a fork, since sockets can't be shared with the parent.
+    """
+    with _managers_lock:
+        _managers.clear()
+
+
+def _open_connection(url):
+    """
+    Open a connection to the host of `url` and leave it in the pool.
+    """
+    host = urlsplit(url).hostname
+    pool = get_manager(tls.get_variant(host)).connection_from_url(url)
+    conn = pool._get_conn(timeout=float(CONFIG['connect_timeout']))
+    try:
+        if conn.sock is not None:
+            return
+        conn.timeout = float(CONFIG['connect_timeout'])
+        with _translate_errors():
+            conn.connect()
+        metrics.incr('connections_warmed')
+    except URLError:
+        conn.close()
+        raise
+    finally:
+        pool._put_conn(conn)
+
+
+def warmup(origins, timeout=None):
+    """
+    Open a pooled connection to every origin (like 'https://example.com') in
+    `origins` in parallel, so the first requests sent to them don't have to
+    wait for the DNS lookup and the TCP and TLS handshakes. Waits at most
+    `timeout` seconds, and errors are logged and ignored.
+    """
+    origins = list(dict.fromkeys(origins))
+    if not origins:
+        return
+
+    def connect(origin):
+        try:
+            _open_connection(origin + '/')
+        except (URLError, OSError) as error:
+            logger.debug('Could not warm up a connection to %s: %s', origin,
+                         error)
+
+    executor = ThreadPoolExecutor(max_workers=len(origins))
+    wait([executor.submit(connect, origin) for origin in origins],
+         timeout=timeout)
+    executor.shutdown(wait=False)
+
+
+def pool_stats():
+    """
+    Returns a dictionary that maps every host in the pool to the number of
+    connections opened, requests sent and connections reused to send them.
+    """
+    stats = {}
+    for manager in list(_managers.values()):
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            host = stats.setdefault(pool.host, dict.fromkeys(
+                ('connections', 'requests', 'reused'), 0))
+            host['connections'] += pool.num_connections
+            host['requests'] += pool.num_requests
+            host['reused'] += max(pool.num_requests - pool.num_connections,
+                                  0)
+    return stats
+
+
+def _raise_for_status(url, response):
+    """
+    Raise an HTTPError, just like urllib would, if the response has an error
+    status code.
+    """
+    if response.status >= 400:
+        reason = responses.get(response.status, '')
+        raise HTTPError(url, response.status, reason, response.headers, None)
+
+
+@contextmanager
+def _translate_errors():
+    """
+    Translate urllib3's exceptions raised inside this context into urllib's
+    URLError.
+    """
+    try:
+        yield
+    except urllib3.exceptions.HTTPError as error:
+        reason = error
+        if isinstance(error, urllib3.exceptions.MaxRetryError):
+            reason = error.reason
+        if is_timeout(reason):
+            metrics.incr('timeouts')
+        raise URLError(reason) from error
+
+
+def _discard_rest(response):
+    """
+    Get rid of the rest of a response that won't be read. If it's small, it's
+    read and thrown away so the connection can be reused. Otherwise (or if its
+    size is unknown), the connection is closed.
+    """
+    remaining = response.length_remaining
+    if remaining is not None and remaining <= int(CONFIG['max_drain_size']):
+        metrics.incr('bytes_drained', remaining)
+        response.drain_conn()
+    else:
+        response.close()
+
+
+def _read_body(url, response, region=None):
+    """
+    Read the body of a response, decompressing it on the fly, and return the
+    connection to the pool.
+
+    If a `region` is passed, stop reading as soon as it has been received.
+    Raises BodyTooLarge if the body is bigger than `CONFIG['max_body_size']`.
+    """
+    chunks = []
+    size = 0
+    max_size = int(CONFIG['max_body_size'])
+    scanner = region.scanner() if region is not None else None
+    try:
+        for chunk in response.stream(CHUNK_SIZE, decode_content=True):
+            check_cancelled(url)
+            chunks.append(chunk)
+            size += len(chunk)
+            if max_size and size > max_size:
+                metrics.incr('bodies_too_large')
+                raise BodyTooLarge(url, max_size)
+            if scanner is not None and scanner.feed(chunk):
+                metrics.incr('early_stops')
+                _discard_rest(response)
+                break
+        # An aborted response may look like a complete one
+        check_cancelled(url)
+    except BaseException:
+        response.close()
+        raise
+    finally:
+        response.release_conn()
+
+    body = b''.join(chunks)
+    if scanner is not None and scanner.done:
+        body = body[:scanner.end]
+    metrics.incr('bytes_received', response.tell())
+    metrics.incr('bytes_decoded', len(body))
+    return body
+
+
+def _override_host(url, headers):
+    """
+    Returns the url a request to `url` should actually be sent to and its
+    headers. Unless `CONFIG['host_override']` is set, that's just the same url.
+
+    Overridden requests keep the original host in the Host header, so a local
+    server can stand in for several websites at once.
+    """
+    override = CONFIG['host_override']
+    if not override:
+        return url, headers
+    parts = urlsplit(url)
+    target = urlsplit(override)
+    headers = dict(headers, Host=parts.netloc)
+    return urlunsplit((target.scheme, target.netloc, parts.path, parts.query,
+                       '')), headers
+
+
+def _urlopen(manager, url, headers, region=None):
+    """
+    Send a single GET request through `manager` and return its Response.
+    """
+    try:
+        slot, waited = ratelimit.acquire(urlsplit(url).hostname, time_left())
+    except TimeoutError:
+        raise DeadlineExceeded(url)
+    if waited:
+        metrics.incr('rate_limited')
+
+    metrics.incr('requests')
+    opened = getattr(_local, 'opened', 0)
+    start = time.time()
+    try:
+        timeout = get_timeout(url)
+        target, headers = _override_host(url, headers)
+        with _translate_errors():
+            response = manager.request('GET', target, headers=headers,
+                                       timeout=timeout, preload_content=False)
+            if getattr(_local, 'opened', 0) == opened:
+                metrics.incr('connections_reused')
+            body = _read_body(url, response, region)
+    except URLError as error:
+        if is_cancelled():
+            metrics.incr('requests_aborted')
+            raise Cancelled(url) from error
+        raise
+    finally:
+        _release_socket()
+        ratelimit.release(slot)
+        _record_latency(url, time.time() - start)
+
+    history = ()
+    if response.retries is not None:
+        history = tuple((entry.url, entry.status,
+                         urljoin(entry.url, entry.redirect_location))
+                        for entry in response.retries.history
+                        if entry.redirect_location)
+    final_url = history[-1][2] if history else url
+    return Response(final_url, response.status, response.headers, body,
+                    history)
+
+
+def _fetch(url, headers=None, region=None):
+    """
+    Send a single GET request to `url`, falling back to an older TLS version
+    if needed.
+    """
+    # Includes brotli if it's installed
+    request_headers = {
+        'User-Agent': USER_AGENT,
+        'Accept-Encoding': ACCEPT_ENCODING,
+    }
+    if headers:
+        request_headers.update(headers)
+
+    host = urlsplit(url).hostname
+    variant = tls.get_variant(host)
+    start = time.time()
+    try:
+        response = _urlopen(get_manager(variant), url, request_headers,
+                            region)
+    except URLError as error:
+        if variant != 'default' or not isinstance(
+                error.reason, (ssl.SSLError, urllib3.exceptions.SSLError)):
+            raise
+        # Some websites (like metal-archives) use older TLS versions and can
+        # make the ssl module trow a VERSION_TOO_LOW error. Here we try to use
+        # the older TLSv1 to see if we can fix that, and remember it for the
+        # next requests to the same host
+        metrics.incr('tls_fallbacks')
+        response = _urlopen(get_manager('tlsv1'), url, request_headers,
+                            region)
+        tls.set_legacy(host)
+
+    replay.record(url, region, response, time.time() - start)
+    _raise_for_status(url, response)
+    return response
+
+
+def _replay(url, region=None):
+    """
+    Returns the Response recorded for `url` in the archive.
+    """
+    recording = replay.replay(url, region)
+    response = Response(*recording[:len(Response._fields)])
+    _raise_for_status(url, response)
+    return response
+
+
+def fetch(url, headers=None, region=None):
+    """
+    Send a GET request to `url` through the connection pool and return a
+    Response object with the full body of the reply. Compressed responses are
+    decoded transparently, and transient errors are retried as specified in
+    the retry policy. If a `region` of the page is passed, the download stops
+    as soon as it has been received.
+
+    Errors are raised as urllib's HTTPError and URLError, so callers don't need
+    to care about the library that is actually doing the requests.
+
+    When replaying an archive (see the replay module), the response is taken
+    from it instead, without sending any request.
+    """
+    if CONFIG['replay']:
+        return _replay(url, region)
+
+    attempt = 0
+    while True:
+        check_cancelled(url)
+        retry.get_budget().add_request()
+        try:
+            return _fetch(url, headers, region)
+        except URLError as error:
+            if isinstance(error, (DeadlineExceeded, BodyTooLarge, Cancelled)):
+                raise
+            delay = retry.get_delay(error, attempt)
+            if delay is None:
+                raise
+            left = time_left()
+            if left is not None and delay >= left:
+                raise
+            if not retry.allow_retry():
+                metrics.incr('retries_denied')
+                raise
+            logger.debug('Retrying %s in %.2fs: %s', url, delay, error)
+
+        metrics.incr('retries')
+        token = getattr(_local, 'token', None)
+        if token is not None:
+            # Stop waiting as soon as the search is cancelled
+            token.event.wait(delay)
+        else:
+            time.sleep(delay)
+        attempt += 1
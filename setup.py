@@ -38,12 +38,18 @@ setup(
     },
     python_requires='>=3.6',
     install_requires=[
-        'urllib3>=1.22',
+        'urllib3>=1.26',
         'beautifulsoup4>=4.5.3',
         'eyeD3>=0.8.2',
         'jeepney>=0.4',
     ],
     extras_require={
+        'brotli': [
+            'brotli',
+        ],
+        'lxml': [
+            'lxml',
+        ],
         'lint': [
             'flake8',
             'flake8-quotes',